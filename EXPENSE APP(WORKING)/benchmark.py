@@ -0,0 +1,236 @@
+# Benchmark suite for the expense data paths (asv-style: each case is timed over several repeats
+# at several data sizes, and results are written as JSON so runs can be compared across commits).
+#
+# Usage:
+#   python benchmark.py [--sizes 1000,100000] [--repeat 5] [--output results.json] [--data-dir DIR]
+#   python benchmark.py --sizes 10000000          # the 10M-row run (slow to generate; cached in --data-dir)
+#   python benchmark.py --compare OLD.json NEW.json
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+import datagen
+from repository import ExpenseRepository
+
+DEFAULT_SIZES = (1000, 100000)
+
+# Expenses per generated user; smaller datasets get a single user
+EXPENSES_PER_USER = 1000
+
+# Rows inserted per run of the bulk insert case
+BULK_INSERT_ROWS = 10000
+
+# Numbers for throwaway users created by the delete_user case, clear of the generated ones
+THROWAWAY_USERS = itertools.count(10 ** 8)
+
+# Version of the generated datasets, part of their cached file names; bump it when datagen's output changes
+DATASET_VERSION = 2
+
+# Reference date for period queries (the generator's data ends on this date)
+REFERENCE_DATE = date(2024, 12, 31)
+
+
+# Function to get (or generate once and cache) a database with `size` expenses; returns (path, user_ids)
+def prepare_database(size, data_dir, seed):
+    users = max(1, size // EXPENSES_PER_USER)
+    per_user = size // users
+    path = os.path.join(data_dir, "bench-{}-{}-v{}.db".format(size, seed, DATASET_VERSION))
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        repo = ExpenseRepository(path + ".tmp", password_iterations=datagen.GENERATED_PASSWORD_ITERATIONS)
+        datagen.generate(repo, users, per_user, seed=seed, end_date=REFERENCE_DATE)
+        repo.close()
+        os.replace(path + ".tmp", path)
+        print("  generated {} in {:.1f}s".format(os.path.basename(path), time.perf_counter() - started))
+    repo = ExpenseRepository(path, password_iterations=datagen.GENERATED_PASSWORD_ITERATIONS)
+    user_ids = [row[0] for row in repo.conn.execute("SELECT id FROM users WHERE username != 'admin' ORDER BY id")]
+    repo.close()
+    return path, user_ids
+
+
+# ---- Benchmark cases ----
+# Each case is called as case(repo, user_ids) and runs one unit of work. Cases that modify the
+# database have a setup(repo, user_ids) returning the arguments for one run.
+
+def bench_login_lookup(repo, user_ids):
+    username, password = datagen.generated_credentials(len(user_ids) // 2)
+    assert repo.authenticate(username, password)
+
+def bench_update_expense_list(repo, user_ids):
+    # First page plus scrolling through four more, as the expense list does
+    user_id = user_ids[len(user_ids) // 2]
+    page = repo.fetch_expense_page(user_id)
+    for _ in range(4):
+        if not page:
+            break
+        page = repo.fetch_expense_page(user_id, before=(page[-1][4], page[-1][0]))
+
+def bench_fetch_expenses_for_period(repo, user_ids):
+    repo.fetch_expenses_for_period(user_ids[len(user_ids) // 2], date(2024, 6, 1), date(2024, 6, 30))
+
+def bench_statistics(repo, user_ids):
+    user_id = user_ids[len(user_ids) // 2]
+    repo.fetch_statistics(user_id, REFERENCE_DATE)
+    repo.fetch_category_totals(user_id, date(2024, 1, 1), REFERENCE_DATE)
+
+def bench_search_expenses(repo, user_ids):
+    # A common merchant prefix, then the next page of its hits
+    user_id = user_ids[len(user_ids) // 2]
+    rows, next_offset = repo.search_expenses(user_id, "merc")
+    if next_offset is not None:
+        repo.search_expenses(user_id, "merc", next_offset)
+    repo.query_cache.clear()  # Time the index, not the cache
+
+def setup_delete_user(repo, user_ids):
+    # A throwaway user with a typical number of expenses
+    user_id = datagen.generate_users(repo, 1, first=next(THROWAWAY_USERS))[0]
+    food = repo.get_or_create_category_id(None, "Food")
+    with repo.conn:
+        repo.insert_expenses([(user_id, 1000, food, "2024-06-01", "Jollibee", None)] * min(EXPENSES_PER_USER, 1000))
+    repo.query_cache.invalidate(user_id)
+    return (user_id,)
+
+def bench_delete_user(repo, user_ids, user_id):
+    repo.delete_user(user_id)
+
+def setup_bulk_insert(repo, user_ids):
+    food = repo.get_or_create_category_id(None, "Food")
+    return ([(user_ids[0], 1250, food, "2024-06-{:02d}".format(1 + n % 28), None, None) for n in range(BULK_INSERT_ROWS)],)
+
+def bench_bulk_insert(repo, user_ids, rows):
+    with repo.conn:
+        repo.insert_expenses(rows)
+    repo.query_cache.invalidate(user_ids[0])
+
+BENCHMARKS = [
+    ('login_lookup', bench_login_lookup, None),
+    ('update_expense_list', bench_update_expense_list, None),
+    ('fetch_expenses_for_period', bench_fetch_expenses_for_period, None),
+    ('statistics', bench_statistics, None),
+    ('search_expenses', bench_search_expenses, None),
+    ('delete_user', bench_delete_user, setup_delete_user),
+    ('bulk_insert_{}'.format(BULK_INSERT_ROWS), bench_bulk_insert, setup_bulk_insert),
+]
+
+
+# Function to time one case: `repeat` samples, each the mean of enough calls to take ~50 ms
+def time_case(repo, user_ids, case, setup, repeat):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            args = setup(repo, user_ids)
+            started = time.perf_counter()
+            case(repo, user_ids, *args)
+            samples.append(time.perf_counter() - started)
+            continue
+        number = 1
+        while True:
+            started = time.perf_counter()
+            for _ in range(number):
+                case(repo, user_ids)
+            elapsed = time.perf_counter() - started
+            if elapsed >= 0.05 or number >= 10000:
+                break
+            number *= 10
+        samples.append(elapsed / number)
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.mean(samples),
+        'repeat': repeat,
+    }
+
+# Function to run every case at every size; returns the results document
+def run(sizes, repeat, data_dir, seed):
+    results = {'meta': environment_metadata(seed), 'benchmarks': {}}
+    for size in sizes:
+        print("size {}:".format(size))
+        path, user_ids = prepare_database(size, data_dir, seed)
+        # Work on a copy so write benchmarks don't change the cached dataset
+        work_path = path + ".work"
+        source, target = sqlite3.connect(path), sqlite3.connect(work_path)
+        source.backup(target)
+        source.close()
+        target.close()
+        repo = ExpenseRepository(work_path, password_iterations=datagen.GENERATED_PASSWORD_ITERATIONS)
+        try:
+            for name, case, setup in BENCHMARKS:
+                timing = time_case(repo, user_ids, case, setup, repeat)
+                results['benchmarks'].setdefault(name, {})[str(size)] = timing
+                print("  {:<28} {:>10.3f} ms".format(name, timing['median'] * 1000))
+        finally:
+            repo.close()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(work_path + suffix):
+                    os.remove(work_path + suffix)
+    return results
+
+def environment_metadata(seed):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'seed': seed,
+    }
+
+# Function to print the median-time ratio of each case between two result files
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    print("{:<28} {:>10} {:>12} {:>12} {:>8}".format("benchmark", "size", "old (ms)", "new (ms)", "ratio"))
+    for name, by_size in new['benchmarks'].items():
+        for size, timing in by_size.items():
+            previous = old['benchmarks'].get(name, {}).get(size)
+            if previous is None:
+                continue
+            ratio = timing['median'] / previous['median'] if previous['median'] else float('inf')
+            print("{:<28} {:>10} {:>12.3f} {:>12.3f} {:>7.2f}x".format(
+                name, size, previous['median'] * 1000, timing['median'] * 1000, ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the expense tracker data paths")
+    parser.add_argument('--sizes', default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated total expense counts (e.g. 1000,100000,10000000)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), "expense-tracker-bench"),
+                        help="where generated datasets are cached between runs")
+    parser.add_argument('--output', help="results file (default: benchmark-<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run(sizes, args.repeat, args.data_dir, args.seed)
+    output = args.output or "benchmark-{}.json".format(results['meta']['commit'] or "local")
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print("Results written to {}".format(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
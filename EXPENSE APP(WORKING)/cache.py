@@ -0,0 +1,54 @@
+# Small thread-safe LRU cache for query results. Entries are grouped by user so a write can drop
+# exactly the results it may have changed; the repository invalidates on every write it performs.
+import threading
+from collections import OrderedDict
+
+# Query results kept per repository
+QUERY_CACHE_SIZE = 64
+
+
+class QueryCache:
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # (user_id, key) -> result, least recently used first
+        self._lock = threading.Lock()
+        self._generations = {}  # Invalidation count per user, so a result computed across a write is not stored
+        self._epoch = 0         # Bumped by clear()
+        self.hits = 0
+        self.misses = 0
+
+    # Function to return the cached result for (user_id, key), computing and storing it with
+    # compute() on a miss. compute runs outside the lock so slow queries don't block other threads.
+    def get_or_compute(self, user_id, key, compute):
+        entry_key = (user_id, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return self._entries[entry_key]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(user_id, 0))
+        result = compute()
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(user_id, 0)):
+                return result  # Invalidated while computing; the result may already be stale
+            self._entries[entry_key] = result
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    # Function to drop every cached result for the given users
+    def invalidate(self, *user_ids):
+        user_ids = set(user_ids)
+        with self._lock:
+            for user_id in user_ids:
+                self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for entry_key in [entry_key for entry_key in self._entries if entry_key[0] in user_ids]:
+                del self._entries[entry_key]
+
+    # Function to drop every cached result
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
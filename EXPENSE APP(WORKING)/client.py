@@ -0,0 +1,187 @@
+# Client for server.py with the same methods as ExpenseRepository (the ones the Tk screens use), so
+# expenseApp.py can work against a shared server instead of opening the database file itself: set
+# EXPENSE_TRACKER_SERVER=http://host:port. The user_id arguments are accepted for compatibility but
+# ignored; the server acts for whoever last logged in through authenticate(). Errors the server
+# reports as user-facing are raised as ValueError, as the repository raises them.
+import http.client
+import json
+from urllib.parse import urlencode, urlsplit
+
+from repository import EXPENSE_PAGE_SIZE, SEARCH_PAGE_SIZE, USER_PAGE_SIZE
+
+# Seconds to wait for the server before giving up on a request
+REQUEST_TIMEOUT = 30.0
+
+
+# Function to encode an ExpenseFilter as the query parameters server.read_filter expects
+def filter_params(expense_filter):
+    if expense_filter is None:
+        return {}
+    return {
+        'start': expense_filter.start_date.isoformat() if expense_filter.start_date else None,
+        'end': expense_filter.end_date.isoformat() if expense_filter.end_date else None,
+        'category_ids': ",".join(str(category_id) for category_id in expense_filter.category_ids) if expense_filter.category_ids else None,
+        'min_amount': expense_filter.min_amount,
+        'max_amount': expense_filter.max_amount,
+    }
+
+
+class RemoteRepository:
+    def __init__(self, base_url, timeout=REQUEST_TIMEOUT):
+        url = urlsplit(base_url)
+        if url.scheme not in ('http', 'https') or not url.hostname:
+            raise ValueError("Invalid server address: {!r}".format(base_url))
+        self.base_url = base_url
+        self.timeout = timeout
+        self._connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self._host, self._port = url.hostname, url.port
+        self.token = None
+
+    # Function to send one request and return its decoded JSON response. The server closes each
+    # connection after one response, so a new one is opened per request (which also makes the
+    # client safe to share between worker threads).
+    def _request(self, method, path, params=None, body=None):
+        if params:
+            query = urlencode({name: value for name, value in params.items() if value is not None})
+            if query:
+                path += "?" + query
+        headers = {'Accept': 'application/json'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = "Bearer " + self.token
+        connection = self._connection_class(self._host, self._port, timeout=self.timeout)
+        try:
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            data = json.loads(response.read() or b'null')
+        except (OSError, http.client.HTTPException, ValueError) as error:
+            raise ConnectionError("Cannot reach the expense server at {}: {}".format(self.base_url, error)) from None
+        finally:
+            connection.close()
+        if response.status >= 400:
+            message = (data.get('error') if isinstance(data, dict) else None) or response.reason
+            if response.status in (401, 403):
+                raise PermissionError(message)
+            if response.status < 500:
+                raise ValueError(message)
+            raise RuntimeError(message)
+        return data
+
+    # Function to log out (if logged in)
+    def close(self):
+        if self.token:
+            try:
+                self._request('POST', '/api/logout')
+            except (ConnectionError, PermissionError):
+                pass
+            self.token = None
+
+    # ---- Users ----
+
+    def register_user(self, first_name, last_name, email, age, sex, contact_number, username, password):
+        return self._request('POST', '/api/register', body={
+            'first_name': first_name, 'last_name': last_name, 'email': email, 'age': age, 'sex': sex,
+            'contact_number': contact_number, 'username': username, 'password': password})['id']
+
+    # Function to log in; returns the user's id, or None if the credentials don't match
+    def authenticate(self, username, password):
+        self.token = None
+        try:
+            result = self._request('POST', '/api/login', body={'username': username, 'password': password})
+        except PermissionError:
+            return None
+        self.token = result['token']
+        return result['user_id']
+
+    def list_users_page(self, search=None, sort='id', descending=False, after=None, limit=USER_PAGE_SIZE):
+        result = self._request('GET', '/api/admin/users', {
+            'search': search, 'sort': sort, 'descending': 1 if descending else None,
+            'after': json.dumps(list(after)) if after else None, 'limit': limit})
+        return [tuple(row) for row in result['users']], tuple(result['next_key']) if result['next_key'] else None
+
+    def delete_users(self, user_ids):
+        return self._request('POST', '/api/admin/users/delete', body={'user_ids': [int(user_id) for user_id in user_ids]})['deleted']
+
+    def purge_orphans_and_vacuum(self):
+        result = self._request('POST', '/api/admin/cleanup')
+        return result['removed'], result['reclaimed']
+
+    # ---- Categories ----
+
+    def list_categories(self, user_id):
+        return [tuple(row) for row in self._request('GET', '/api/categories')['categories']]
+
+    def add_category(self, user_id, name):
+        return self._request('POST', '/api/categories', body={'name': name})['id']
+
+    # ---- Recurring expenses ----
+
+    def add_recurring_expense(self, user_id, amount_cents, category_id, frequency, start_date, end_date=None):
+        return self._request('POST', '/api/recurring', body={
+            'amount_cents': amount_cents, 'category_id': category_id, 'frequency': frequency,
+            'start_date': start_date.isoformat(), 'end_date': end_date.isoformat() if end_date else None})['id']
+
+    def list_recurring_expenses(self, user_id):
+        return [tuple(row) for row in self._request('GET', '/api/recurring')['recurring']]
+
+    def delete_recurring_expense(self, user_id, rule_id):
+        return self._request('DELETE', '/api/recurring/{}'.format(int(rule_id)))['deleted']
+
+    # Due dates are judged by the server's clock, so `today` is ignored
+    def materialize_recurring(self, user_id=None, today=None):
+        return self._request('POST', '/api/recurring/materialize')['created']
+
+    # ---- Budgets ----
+
+    def set_budget(self, user_id, category_id, limit_cents):
+        self._request('PUT', '/api/budgets/{}'.format(int(category_id)), body={'limit_cents': limit_cents})
+
+    def list_budgets(self, user_id, month):
+        return [tuple(row) for row in self._request('GET', '/api/budgets', {'month': month})['budgets']]
+
+    def budget_alerts(self, user_id, month, category_ids=None):
+        return [tuple(row) for row in self._request('GET', '/api/budgets/alerts', {
+            'month': month, 'category_ids': ",".join(str(category_id) for category_id in category_ids) if category_ids else None,
+        })['alerts']]
+
+    # ---- Expenses ----
+
+    def add_expense(self, user_id, amount_cents, category_id, date, merchant=None, note=None):
+        return self._request('POST', '/api/expenses', body={'amount_cents': amount_cents, 'category_id': category_id, 'date': date,
+                                                            'merchant': merchant, 'note': note})['id']
+
+    def delete_expense(self, expense_id, user_id=None):
+        expense = self._request('DELETE', '/api/expenses/{}'.format(int(expense_id)))['expense']
+        return tuple(expense) if expense else None
+
+    def fetch_expense_page(self, user_id, before=None, after=None, limit=EXPENSE_PAGE_SIZE, expense_filter=None):
+        params = filter_params(expense_filter)
+        params['limit'] = limit
+        if before:
+            params['before_date'], params['before_id'] = before
+        if after:
+            params['after_date'], params['after_id'] = after
+        return [tuple(row) for row in self._request('GET', '/api/expenses', params)['expenses']]
+
+    def search_expenses(self, user_id, text, offset=0, limit=SEARCH_PAGE_SIZE):
+        result = self._request('GET', '/api/expenses/search', {'q': text, 'offset': offset, 'limit': limit})
+        return [tuple(row) for row in result['expenses']], result['next_offset']
+
+    # ---- Statistics ----
+
+    def fetch_statistics(self, user_id, current_date=None):
+        return self._request('GET', '/api/statistics', {'date': current_date.isoformat() if current_date else None})['totals']
+
+    def fetch_filter_statistics(self, user_id, expense_filter):
+        statistics = self._request('GET', '/api/statistics/filtered', filter_params(expense_filter))['statistics']
+        statistics['categories'] = [tuple(row) for row in statistics['categories']]
+        return statistics
+
+    def rebuild_rollups(self):
+        self._request('POST', '/api/admin/rollups/rebuild')
+
+    def check_rollups(self):
+        return self._request('GET', '/api/admin/rollups/check')['problems']
@@ -0,0 +1,69 @@
+# SQLite connection management. Each thread gets its own connection (sqlite3 connections and
+# cursors must not be shared between threads), opened in WAL mode so background readers
+# (statistics, import, export) can run while the UI thread writes.
+import sqlite3
+import threading
+
+# Pragmas applied to every new connection
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',        # Readers don't block the writer and vice versa
+    'synchronous': 'NORMAL',      # Safe with WAL; fsync on checkpoint instead of every commit
+    'cache_size': -16384,         # 16 MB page cache per connection (negative = KiB)
+    'mmap_size': 268435456,       # Memory-map up to 256 MB of the database file
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+# Seconds to wait for a lock held by another connection before raising "database is locked"
+BUSY_TIMEOUT = 30.0
+
+# Prepared statements kept per connection (sqlite3's statement cache)
+STATEMENT_CACHE_SIZE = 256
+
+
+class ConnectionManager:
+    def __init__(self, db_path, pragmas=None, timeout=BUSY_TIMEOUT, factory=sqlite3.Connection):
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.timeout = timeout
+        self.factory = factory
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    # Function to get the calling thread's connection, opening it on first use
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self.open_connection()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    # Function to open and configure a new connection
+    def open_connection(self):
+        # check_same_thread is off only so close_all() can close connections from the main
+        # thread; each connection is otherwise only used by the thread that opened it.
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE, factory=self.factory)
+        for name, value in self.pragmas.items():
+            conn.execute("PRAGMA {} = {}".format(name, value))
+        return conn
+
+    # Function to close the calling thread's connection (e.g. when a worker thread exits)
+    def close_thread_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+            conn.close()
+
+    # Function to close every connection opened by this manager
+    def close_all(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
@@ -0,0 +1,124 @@
+# Deterministic synthetic data generator for benchmarks and scale testing.
+# Creates N users with M expenses each, spread over the app's categories with per-category
+# amount distributions and dates over the last few years (more spending on weekends and
+# around paydays), most with a merchant and some with a note, so search has realistic text to
+# index. The same seed always produces the same database.
+#
+# Usage: python datagen.py OUTPUT_DB --users N --expenses-per-user M [--seed S] [--years Y]
+import argparse
+import math
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from repository import ExpenseRepository, EXPENSE_CATEGORIES
+
+# Relative frequency and typical amount (median, spread of the log-normal) of each category
+CATEGORY_PROFILES = {
+    "Food": (30, 250.0, 0.6),
+    "Transportation": (20, 80.0, 0.7),
+    "Shopping": (12, 900.0, 0.9),
+    "Entertainment": (8, 500.0, 0.8),
+    "Utilities": (5, 2500.0, 0.4),
+    "Health": (5, 700.0, 1.0),
+    "Other": (20, 300.0, 1.1),
+}
+
+# Merchants generated for each category
+CATEGORY_MERCHANTS = {
+    "Food": ("Jollibee", "McDonald's", "Mang Inasal", "SM Supermarket", "Puregold", "7-Eleven", "Starbucks", "Chowking"),
+    "Transportation": ("Grab", "Angkas", "Petron", "Shell", "LRT-1", "MRT-3", "Cebu Pacific"),
+    "Shopping": ("SM Department Store", "Uniqlo", "Lazada", "Shopee", "National Book Store", "Ace Hardware"),
+    "Entertainment": ("Netflix", "Spotify", "SM Cinema", "Timezone", "Steam"),
+    "Utilities": ("Meralco", "Maynilad", "Manila Water", "PLDT", "Globe Telecom", "Converge"),
+    "Health": ("Mercury Drug", "Watsons", "The Generics Pharmacy", "St. Luke's Medical Center", "Hi-Precision Diagnostics"),
+    "Other": ("Cebuana Lhuillier", "LBC Express", "Barber shop", "Parish donation", "Laundry shop"),
+}
+
+# Share of generated expenses with a merchant, and with a note
+MERCHANT_RATE = 0.85
+NOTE_RATE = 0.15
+
+# Words generated notes are made from
+NOTE_WORDS = ("birthday", "gift", "weekly", "groceries", "refill", "vitamins", "medicine", "for mom", "for the kids",
+              "office", "reimbursable", "trip", "dinner", "lunch", "repair", "subscription", "rent", "school", "bills")
+
+# Rows inserted per transaction while generating
+GENERATOR_BATCH_SIZE = 50000
+
+# Password hashing work factor for generated users; the real one would make generating thousands of users take hours
+GENERATED_PASSWORD_ITERATIONS = 1000
+
+
+# Function to get the username and password of the n-th generated user
+def generated_credentials(n):
+    return "user{}".format(n), "password{}".format(n)
+
+# Function to register N users numbered from `first`; returns their ids in order
+def generate_users(repo, count, first=0):
+    user_ids = []
+    for n in range(first, first + count):
+        username, password = generated_credentials(n)
+        user_ids.append(repo.register_user("User", str(n), "{}@example.com".format(username), 30, "Male",
+                                           "09{:09d}".format(n), username, password))
+    return user_ids
+
+# Function to yield M deterministic (amount in centavos, category, date, merchant, note) expenses for one user
+def generate_expenses(rng, count, end_date, years):
+    categories = [category for category in EXPENSE_CATEGORIES if category in CATEGORY_PROFILES]
+    weights = [CATEGORY_PROFILES[category][0] for category in categories]
+    span = 365 * years
+    for category in rng.choices(categories, weights, k=count):
+        _, median, spread = CATEGORY_PROFILES[category]
+        day = end_date - timedelta(days=int(span * rng.random() ** 0.8))  # Skewed towards recent dates
+        if day.weekday() < 5 and rng.random() < 0.25:
+            day += timedelta(days=5 - day.weekday())  # Shift some weekday spending to the weekend
+            if day > end_date:
+                day = end_date
+        amount_cents = round(median * math.exp(rng.gauss(0, spread)) * 100)
+        merchant = rng.choice(CATEGORY_MERCHANTS[category]) if rng.random() < MERCHANT_RATE else None
+        note = " ".join(rng.sample(NOTE_WORDS, rng.randint(1, 3))) if rng.random() < NOTE_RATE else None
+        yield amount_cents, category, day.isoformat(), merchant, note
+
+# Function to fill a database with users and expenses; returns the generated user ids
+def generate(repo, users, expenses_per_user, seed=42, years=3, end_date=None):
+    rng = random.Random(seed)
+    end_date = end_date or date(2024, 12, 31)
+    user_ids = generate_users(repo, users)
+    category_ids = {name: category_id for category_id, name in repo.list_categories(None)}
+    batch = []
+    with repo.conn:
+        for user_id in user_ids:
+            for amount_cents, category, day, merchant, note in generate_expenses(rng, expenses_per_user, end_date, years):
+                batch.append((user_id, amount_cents, category_ids[category], day, merchant, note))
+                if len(batch) >= GENERATOR_BATCH_SIZE:
+                    repo.insert_expenses(batch)
+                    batch = []
+        if batch:
+            repo.insert_expenses(batch)
+    repo.query_cache.invalidate(*user_ids)
+    return user_ids
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic expense tracker database")
+    parser.add_argument('db')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--expenses-per-user', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--years', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    repo = ExpenseRepository(args.db, password_iterations=GENERATED_PASSWORD_ITERATIONS)
+    try:
+        generate(repo, args.users, args.expenses_per_user, args.seed, args.years)
+    finally:
+        repo.close()
+    print("Generated {} users x {} expenses in {:.1f}s".format(args.users, args.expenses_per_user, time.perf_counter() - started))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,81 @@
+import time
+STARTED_AT = time.perf_counter()  # Taken before the other imports, so startup timings include them
 import tkinter as tk
-from tkinter import messagebox, ttk
-import sqlite3
-from datetime import datetime
-from datetime import timedelta
-import re
-from tkcalendar import DateEntry
-import calendar
-from ttkthemes import ThemedTk
-
-# Database initialization
-conn = sqlite3.connect('expense_tracker.db')
-c = conn.cursor()
-
-# Create user table if not exists
-c.execute('''CREATE TABLE IF NOT EXISTS users
-             (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, email TEXT UNIQUE, age INTEGER, sex TEXT, contact_number TEXT, username TEXT UNIQUE, password TEXT)''')
-
-# Create expense table if not exists
-c.execute('''CREATE TABLE IF NOT EXISTS expenses
-             (id INTEGER PRIMARY KEY, user_id INTEGER, amount REAL, category TEXT, date TEXT)''')
-
-# Add admin account if not exists
-c.execute("SELECT * FROM users WHERE username='admin'")
-admin_exists = c.fetchone()
-if not admin_exists:
-    c.execute("INSERT INTO users (first_name, last_name, email, age, sex, contact_number, username, password) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-              ("Admin", "Admin", "admin@example.com", 0, "NA", "NA", "admin", "password"))
-    conn.commit()
+from tkinter import filedialog, messagebox, simpledialog, ttk
+import os
+import sys
+import threading
+from datetime import date, datetime
+from repository import (ExpenseRepository, ExpenseFilter, CATEGORY_PLACEHOLDER, EXPENSE_PAGE_SIZE, RECURRING_FREQUENCIES,
+                        normalize_date, validate_amount)
+from worker import TaskExecutor, shutdown_shared_pool
+from instrumentation import METRICS
+from money import format_amount, parse_amount
+from session import open_session
+
+# Database file, kept next to this script regardless of the working directory
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expense_tracker.db')
+
+# Query instrumentation is opt-in: set EXPENSE_TRACKER_METRICS=1 to record query timings, and
+# EXPENSE_TRACKER_SLOW_QUERY_MS to change the slow query log threshold
+INSTRUMENT_QUERIES = os.environ.get('EXPENSE_TRACKER_METRICS', '') not in ('', '0')
+SLOW_QUERY_MS = os.environ.get('EXPENSE_TRACKER_SLOW_QUERY_MS')
+
+# Set EXPENSE_TRACKER_SERVER=http://host:port to share a database through server.py instead of
+# opening DB_PATH directly
+SERVER_URL = os.environ.get('EXPENSE_TRACKER_SERVER')
+
+# Time to first frame is always recorded in METRICS (shown under Diagnostics) and printed to stderr
+# when instrumentation is on. Set EXPENSE_TRACKER_STARTUP_PROBE=1 to print it and exit right away,
+# for timing cold starts from a script.
+STARTUP_PROBE = os.environ.get('EXPENSE_TRACKER_STARTUP_PROBE', '') not in ('', '0')
+
+# ttk theme of the app's windows, applied when the first window with ttk widgets opens
+THEME = "plastik"
+
+# Modules only needed once a user has logged in (the date picker pulls in babel, and ttkthemes
+# loads dozens of theme files); imported in the background after the login screen is up
+DEFERRED_MODULES = ("tkcalendar", "ttkthemes")
+
+# Data-access layer; opened by main()
+repo = None
+
+# Registration window and its executor; built the first time the user goes to register
+register_window = None
+register_executor = None
+
+# ttkthemes style applied to the root window; set up by apply_theme()
+theme_style = None
+
+# Function to apply THEME to every ttk widget of the app (all windows share the login root)
+def apply_theme():
+    global theme_style
+    if theme_style is None:
+        from ttkthemes import ThemedStyle
+        theme_style = ThemedStyle(login_window)
+        theme_style.set_theme(THEME)
+
+# Function to import DEFERRED_MODULES on a background thread, so they are usually loaded by the time
+# the main screen needs them; a module that is missing is reported when that screen imports it
+def preload_deferred_modules():
+    def preload():
+        for name in DEFERRED_MODULES:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+    threading.Thread(target=preload, name="preload-imports", daemon=True).start()
+
+# Function to show an error from a background task
+def show_task_error(error):
+    messagebox.showerror("Error", str(error))
+
+# Function to create a busy indicator callback for a window: shows a status text and a wait cursor
+def make_busy_indicator(window, status_label):
+    def set_busy(busy):
+        status_label.config(text="Working..." if busy else "")
+        window.config(cursor="watch" if busy else "")
+    return set_busy
 
 # Function to handle user registration
 def register_user():
@@ -39,34 +88,13 @@ def register_user():
     username = register_username_entry.get()
     password = register_password_entry.get()
 
-    # Check if fields are empty
-    if not all([first_name, last_name, email, age, sex, contact_number, username, password]):
-        messagebox.showerror("Error", "All fields are required")
-        return
-
-    # Email validation using regex
-    if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
-        messagebox.showerror("Error", "Invalid email address")
-        return
-
-    # Contact number validation
-    if not contact_number.isdigit() or len(contact_number) != 11:
-        messagebox.showerror("Error", "Invalid contact number. Please enter 11 digits.")
-        return
-
-    # Check if username already exists
-    c.execute("SELECT * FROM users WHERE username=?", (username,))
-    if c.fetchone():
-        messagebox.showerror("Error", "Username already exists")
-        return
-
-    # Insert new user into the database
-    c.execute("INSERT INTO users (first_name, last_name, email, age, sex, contact_number, username, password) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-              (first_name, last_name, email, age, sex, contact_number, username, password))
-    conn.commit()
-    messagebox.showinfo("Success", "Registration successful")
-    # Clear fields after successful registration
-    clear_register_fields()
+    # Validate, hash the password and insert the new user on a worker thread
+    def on_registered(_):
+        messagebox.showinfo("Success", "Registration successful")
+        # Clear fields after successful registration
+        clear_register_fields()
+    register_executor.submit('register', repo.register_user, first_name, last_name, email, age, sex, contact_number,
+                             username, password, on_success=on_registered, on_error=show_task_error)
 
 # Function to clear registration fields
 def clear_register_fields():
@@ -89,18 +117,29 @@ def login():
         messagebox.showerror("Error", "Username and password are required")
         return
 
-    # Check if username and password match
-    c.execute("SELECT * FROM users WHERE username=? AND password=?", (username, password))
-    user = c.fetchone()
-    if user:
-        if username == 'admin':  # Check if the logged-in user is admin
+    # Check the credentials and load the session on a worker thread (password hashing is slow by design)
+    login_executor.submit('login', authenticate_and_open_session, username, password,
+                          on_success=on_login_result, on_error=show_task_error)
+
+# Function to check credentials and load the user's session; returns None if they don't match
+def authenticate_and_open_session(username, password):
+    user_id = repo.authenticate(username, password)
+    if user_id is None:
+        return None
+    return open_session(repo, user_id, username)
+
+# Function to continue after the login check finished
+def on_login_result(session):
+    if session:
+        if session.is_admin:  # Check if the logged-in user is admin
             # Proceed to admin dashboard
             messagebox.showinfo("Success", "Login successful as admin")
             admin_dashboard()
         else:
             # Proceed to main app screen for regular users
             messagebox.showinfo("Success", "Login successful")
-            main_app_screen(user[0])  # Pass user ID to main app screen function
+            main_app_screen(session)  # Pass the user's session to main app screen function
+            show_budget_alerts(session.budget_alerts)
         # Clear fields after successful login
         clear_login_fields()
     else:
@@ -120,6 +159,8 @@ def logout():
 
 # Function to switch to the registration page
 def switch_to_registration():
+    if register_window is None:
+        build_register_window()
     login_window.withdraw()
     register_window.deiconify()
 
@@ -130,13 +171,16 @@ def switch_to_login():
 
 
 # Function to display main app screen
-def main_app_screen(user_id):
+def main_app_screen(session):
+    from tkcalendar import DateEntry  # Deferred, see DEFERRED_MODULES
+    user_id = session.user_id
     # Close login window
     login_window.withdraw()
 
     # Create main app window
     global main_app_window
-    main_app_window = ThemedTk(theme="plastik")  # Apply theme to the main app window
+    apply_theme()
+    main_app_window = tk.Toplevel(login_window)
     main_app_window.title("Expense Tracker - Main App")
     main_app_window.attributes('-fullscreen', True)  # Set window to full screen
     main_app_window.geometry("800x600")  # Set window size
@@ -151,48 +195,218 @@ def main_app_screen(user_id):
             messagebox.showerror("Error", "Amount cannot be empty")
             return
         try:
-            amount = float(amount)
+            amount = parse_amount(amount)  # In centavos
         except ValueError:
             messagebox.showerror("Error", "Invalid amount. Please enter a valid number")
             return
-        category = category_var.get()  # Get selected category from dropdown menu
-        date = date_entry.get()  # Get selected date from DateEntry widget
-
-        # Insert expense into database
-        c.execute("INSERT INTO expenses (user_id, amount, category, date) VALUES (?, ?, ?, ?)", (user_id, amount, category, date))
-        conn.commit()
-        messagebox.showinfo("Success", "Expense added successfully")
+        category_id = session.category_id(category_var.get())  # Get selected category from dropdown menu
+        if category_id is None:
+            messagebox.showerror("Error", "Please choose a category")
+            return
+        date = date_entry.get_date().isoformat()  # Store the selected date as 'YYYY-MM-DD'
+        merchant = merchant_entry.get().strip() or None  # Optional, searchable with the search box
+        note = note_entry.get().strip() or None
+
+        # Insert expense into database on a worker thread
+        def on_added(expense_id):
+            session.apply_expense(amount, date)
+            messagebox.showinfo("Success", "Expense added successfully")
+            insert_expense_row((expense_id, user_id, amount, category_id, date, None, merchant, note))
+            clear_fields()
+            # The budget check reads the category's running monthly total, so it costs one lookup
+            executor.submit(None, repo.budget_alerts, user_id, date[:7], (category_id,),
+                            on_success=show_budget_alerts, on_error=show_task_error)
+        executor.submit(None, repo.add_expense, user_id, amount, category_id, date, merchant, note,
+                        on_success=on_added, on_error=show_task_error)
+
+    # Function to reload the list and statistics after recurring expenses were created
+    def on_recurring_change():
+        session.totals_date = None  # The cached totals may be missing the new expenses
         update_expense_list()
-        clear_fields()
+
+    # Function to add a user-defined category and offer it in the dropdown and the filter
+    def add_category():
+        name = simpledialog.askstring("Add Category", "Category name:", parent=main_app_window)
+        if name is None:
+            return
+        def on_category_added(category_id):
+            session.categories = session.categories + [(category_id, " ".join(name.split()))]
+            refresh_category_choices()
+            messagebox.showinfo("Success", "Category added successfully")
+        executor.submit(None, repo.add_category, user_id, name, on_success=on_category_added, on_error=show_task_error)
+
+    # Function to fill the category dropdown and the filter list from the session's categories
+    def refresh_category_choices():
+        menu = category_dropdown['menu']
+        menu.delete(0, tk.END)
+        for _, name in session.categories:
+            menu.add_command(label=name, command=lambda value=name: category_var.set(value))
+        filter_category_list.delete(0, tk.END)
+        filter_category_list.insert(tk.END, *[name for _, name in session.categories])
+
+    # The expense list is a window of at most MAX_LOADED_EXPENSES rows, ordered newest first by
+    # (date, id). Pages are fetched with keyset queries as the user scrolls, and rows scrolled far
+    # out of view are dropped, so memory stays bounded regardless of the user's history size.
+    # The list and the statistics overview only show expenses matching list_state['filter'].
+    list_state = {'has_older': False, 'has_newer': False, 'loading': False, 'filter': ExpenseFilter()}
+
+    # Function to get the (date, id) sort key of a loaded row
+    def row_key(item):
+        values = expense_tree.item(item, 'values')
+        return (values[4], int(values[0]))
+
+    # Function to insert an expense row into the treeview at the given index
+    def show_expense_row(expense, index):
+        # Format amount (stored in centavos) to display with 2 decimal places and Philippine peso symbol
+        formatted_amount = format_amount(expense[2])
+        category = session.category_names.get(expense[3], "")
+        expense_tree.insert('', index, iid=str(expense[0]), values=(expense[0], expense[1], formatted_amount, category, expense[4],
+                                                                    expense[6] or "", expense[7] or ""))
+
+    # Function to stop tracking a page load after it failed
+    def on_page_error(error):
+        list_state['loading'] = False
+        show_task_error(error)
+
+    # Function to request the next page of older expenses from a worker thread
+    def load_older_expenses():
+        items = expense_tree.get_children()
+        before = row_key(items[-1]) if items else None
+        list_state['loading'] = True
+        executor.submit('expense_page', repo.fetch_expense_page, user_id, before=before, expense_filter=list_state['filter'],
+                        on_success=show_older_expenses, on_error=on_page_error)
+
+    # Function to append a page of older expenses, dropping rows from the top if needed
+    def show_older_expenses(expenses):
+        list_state['loading'] = False
+        for expense in expenses:
+            if not expense_tree.exists(str(expense[0])):
+                show_expense_row(expense, 'end')
+        list_state['has_older'] = len(expenses) == EXPENSE_PAGE_SIZE
+        items = expense_tree.get_children()
+        if len(items) > MAX_LOADED_EXPENSES:
+            expense_tree.delete(*items[:len(items) - MAX_LOADED_EXPENSES])
+            list_state['has_newer'] = True
+
+    # Function to request the previous page of newer expenses from a worker thread
+    def load_newer_expenses():
+        items = expense_tree.get_children()
+        if not items:
+            return
+        list_state['loading'] = True
+        executor.submit('expense_page', repo.fetch_expense_page, user_id, after=row_key(items[0]),
+                        expense_filter=list_state['filter'], on_success=show_newer_expenses, on_error=on_page_error)
+
+    # Function to prepend a page of newer expenses, dropping rows from the bottom if needed
+    def show_newer_expenses(expenses):
+        list_state['loading'] = False
+        for expense in reversed(expenses):
+            if not expense_tree.exists(str(expense[0])):
+                show_expense_row(expense, 0)
+        list_state['has_newer'] = len(expenses) == EXPENSE_PAGE_SIZE
+        items = expense_tree.get_children()
+        if len(items) > MAX_LOADED_EXPENSES:
+            expense_tree.delete(*items[MAX_LOADED_EXPENSES:])
+            list_state['has_older'] = True
+
+    # Function to fetch more rows when the visible area gets close to either end of the window
+    def on_expense_scroll(first, last):
+        expense_scrollbar.set(first, last)
+        if list_state['loading']:
+            return
+        if float(last) >= 0.9 and list_state['has_older']:
+            load_older_expenses()
+        elif float(first) <= 0.1 and list_state['has_newer']:
+            load_newer_expenses()
+
+    # Function to insert a newly added expense in place, if it falls inside the loaded window
+    def insert_expense_row(expense):
+        if not list_state['filter'].matches(expense[2], expense[3], expense[4]):
+            return  # Hidden by the active filter
+        if expense_tree.exists(str(expense[0])):
+            return  # A page load that ran after the insert already showed it
+        key = (expense[4], expense[0])
+        items = expense_tree.get_children()
+        if items and key > row_key(items[0]) and list_state['has_newer']:
+            return  # Belongs to a page that is not loaded; it will be fetched on scroll
+        if items and key < row_key(items[-1]) and list_state['has_older']:
+            return
+        index = 0
+        while index < len(items) and row_key(items[index]) > key:
+            index += 1
+        show_expense_row(expense, index)
+        expense_tree.see(str(expense[0]))
 
     # Function to update expense list
     def update_expense_list():
-        # Clear current expense list
-        for row in expense_tree.get_children():
-            expense_tree.delete(row)
-        # Fetch and display expenses for the user
-        c.execute("SELECT * FROM expenses WHERE user_id=?", (user_id,))
-        expenses = c.fetchall()
-        for expense in expenses:
-            # Format amount to display with 2 decimal places and Philippine peso symbol
-            formatted_amount = "₱{:,.2f}".format(expense[2])
-            expense_tree.insert('', 'end', values=(expense[0], expense[1], formatted_amount, expense[3], expense[4]))
+        # Clear current expense list and load the newest page
+        expense_tree.delete(*expense_tree.get_children())
+        list_state['has_newer'] = False
+        load_older_expenses()
+
+    # Function to read the filter controls into an ExpenseFilter; raises ValueError with a user-facing message
+    def read_filter():
+        start_text, end_text = filter_start_entry.get().strip(), filter_end_entry.get().strip()
+        try:
+            start_date = date.fromisoformat(normalize_date(start_text)) if start_text else None
+            end_date = date.fromisoformat(normalize_date(end_text)) if end_text else None
+        except ValueError:
+            raise ValueError("Invalid date. Please enter dates as MM/DD/YYYY or YYYY-MM-DD")
+        if start_date and end_date and start_date > end_date:
+            raise ValueError("The start date must not be after the end date")
+        min_text, max_text = filter_min_entry.get().strip(), filter_max_entry.get().strip()
+        try:
+            min_amount = parse_amount(min_text) if min_text else None
+            max_amount = parse_amount(max_text) if max_text else None
+        except ValueError:
+            raise ValueError("Invalid amount. Please enter a valid number")
+        category_ids = tuple(session.categories[index][0] for index in filter_category_list.curselection()) or None
+        return ExpenseFilter(start_date, end_date, category_ids, min_amount, max_amount)
+
+    # Function to show only the expenses matching the filter controls
+    def apply_filter():
+        try:
+            list_state['filter'] = read_filter()
+        except ValueError as error:
+            messagebox.showerror("Error", str(error))
+            return
+        update_expense_list()
+
+    # Function to clear the filter controls and show all expenses again
+    def clear_filter():
+        for entry in (filter_start_entry, filter_end_entry, filter_min_entry, filter_max_entry):
+            entry.delete(0, tk.END)
+        filter_category_list.selection_clear(0, tk.END)
+        list_state['filter'] = ExpenseFilter()
+        update_expense_list()
+
+    # Function to search the user's expenses by merchant and note
+    def search_expenses():
+        text = search_entry.get().strip()
+        if not text:
+            messagebox.showerror("Error", "Please enter something to search for")
+            return
+        show_search_results(main_app_window, session, executor, text)
 
     # Function to delete selected expense
     def delete_expense():
         selected_item = expense_tree.selection()
         if selected_item:
             expense_id = expense_tree.item(selected_item, 'values')[0]
-            c.execute("DELETE FROM expenses WHERE id=?", (expense_id,))
-            conn.commit()
-            messagebox.showinfo("Success", "Expense deleted successfully")
-            update_expense_list()
+            def on_deleted(expense):
+                if expense:
+                    session.apply_expense(expense[3], expense[1], sign=-1)
+                messagebox.showinfo("Success", "Expense deleted successfully")
+                if expense_tree.exists(expense_id):
+                    expense_tree.delete(expense_id)
+            executor.submit(None, repo.delete_expense, expense_id, on_success=on_deleted, on_error=show_task_error)
         else:
             messagebox.showerror("Error", "Please select an expense to delete")
 
     # Function to handle user logout
     def logout_from_main_app():
-        # Close the main app window
+        # Stop background work, then close the main app window
+        executor.shutdown()
         main_app_window.destroy()
         # Re-display the login window
         login_window.deiconify()
@@ -200,59 +414,55 @@ def main_app_screen(user_id):
     # Function to clear entry fields
     def clear_fields():
         amount_entry.delete(0, tk.END)
-        category_var.set("Choose Category")  # Set default value in dropdown
+        merchant_entry.delete(0, tk.END)
+        note_entry.delete(0, tk.END)
+        category_var.set(CATEGORY_PLACEHOLDER)  # Set default value in dropdown
         date_entry.set_date(datetime.today())  # Set today's date in DateEntry widget
 
     # Function to display statistics overview
     def show_statistics():
-        # Get current date
-        current_date = datetime.today().date()
-
-        # Get start and end dates for this week, this month, and this year
-        start_of_week = current_date - timedelta(days=current_date.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        start_of_month = current_date.replace(day=1)
-        end_of_month = current_date.replace(day=calendar.monthrange(current_date.year, current_date.month)[1])
-        start_of_year = current_date.replace(month=1, day=1)
-        end_of_year = current_date.replace(month=12, day=31)
-
-        # Initialize variables to store total expenses
-        total_today_expense = 0
-        total_week_expense = 0
-        total_month_expense = 0
-        total_year_expense = 0
-
-        # Iterate through items in the expense treeview
-        for item in expense_tree.get_children():
-            values = expense_tree.item(item, 'values')
-            expense_date = datetime.strptime(values[4], '%m/%d/%Y').date()
-            expense_amount = float(values[2][1:].replace(',', ''))  # Remove currency symbol and comma
-            # Check if expense date falls within today
-            if expense_date == current_date:
-                total_today_expense += expense_amount
-            # Check if expense date falls within this week
-            if start_of_week <= expense_date <= end_of_week:
-                total_week_expense += expense_amount
-            # Check if expense date falls within this month
-            if start_of_month <= expense_date <= end_of_month:
-                total_month_expense += expense_amount
-            # Check if expense date falls within this year
-            if start_of_year <= expense_date <= end_of_year:
-                total_year_expense += expense_amount
-
-        # Format total expenses to display two decimal places
-        total_today_expense = "{:.2f}".format(total_today_expense)
-        total_week_expense = "{:.2f}".format(total_week_expense)
-        total_month_expense = "{:.2f}".format(total_month_expense)
-        total_year_expense = "{:.2f}".format(total_year_expense)
+        if not list_state['filter'].is_empty():
+            # Clicking again while a query is running supersedes the earlier one
+            executor.submit('statistics', repo.fetch_filter_statistics, user_id, list_state['filter'],
+                            on_success=display_filter_statistics, on_error=show_task_error)
+            return
+        # The session keeps today's totals up to date; only query again once the day has changed
+        if session.totals_current():
+            display_statistics(session.totals)
+            return
+        def refresh_statistics():
+            repo.materialize_recurring(user_id)  # Recurring expenses that fell due since the totals were loaded
+            return repo.fetch_statistics(user_id)
+        def on_statistics(totals):
+            session.totals, session.totals_date = totals, datetime.today().date()
+            display_statistics(totals)
+        # Clicking again while a query is running supersedes the earlier one
+        executor.submit('statistics', refresh_statistics, on_success=on_statistics, on_error=show_task_error)
+
+    # Function to display the statistics computed by show_statistics
+    def display_statistics(totals):
+        # Format total expenses (in centavos) to display two decimal places
+        total_today_expense = format_amount(totals['today'])
+        total_week_expense = format_amount(totals['week'])
+        total_month_expense = format_amount(totals['month'])
+        total_year_expense = format_amount(totals['year'])
 
         # Display statistics overview
         messagebox.showinfo(
             "Statistics Overview",
-            f"Total expense for today: ₱{total_today_expense}\n"
-            f"Total expense for this week: ₱{total_week_expense}\n"
-            f"Total expense for this month: ₱{total_month_expense}\n"
-            f"Total expense for this year: ₱{total_year_expense}"
+            f"Total expense for today: {total_today_expense}\n"
+            f"Total expense for this week: {total_week_expense}\n"
+            f"Total expense for this month: {total_month_expense}\n"
+            f"Total expense for this year: {total_year_expense}"
+        )
+
+    # Function to display the statistics of the filtered expenses
+    def display_filter_statistics(statistics):
+        lines = ["{}: {} ({} expenses)".format(category, format_amount(total), count) for category, total, count in statistics['categories']]
+        messagebox.showinfo(
+            "Statistics Overview (filtered)",
+            f"Total of the filtered expenses: {format_amount(statistics['total'])}\n"
+            f"Number of expenses: {statistics['count']}\n\n" + "\n".join(lines)
         )
 
     # Apply styling
@@ -271,30 +481,86 @@ def main_app_screen(user_id):
 
     # Dropdown menu for category selection with placeholder
     category_var = tk.StringVar(main_app_window)
-    category_var.set("Choose Category")  # Placeholder
-    category_options = ["", "Food", "Transportation", "Shopping", "Entertainment", "Utilities", "Health", "Other"]
+    category_var.set(CATEGORY_PLACEHOLDER)  # Placeholder
+    category_options = [CATEGORY_PLACEHOLDER] + [name for _, name in session.categories]  # The first option is the OptionMenu's initial value
     category_dropdown = ttk.OptionMenu(main_app_window, category_var, *category_options)
     category_dropdown.pack(padx=10, pady=5, anchor="center")
 
+    add_category_button = tk.Button(main_app_window, text="Add Category", command=add_category, bg="green", fg="white")  # Set background and foreground color
+    add_category_button.pack(padx=10, pady=5, anchor="center")
+
     date_label = tk.Label(main_app_window, text="Date:", bg="white")  # Set background color
     date_label.pack(padx=10, pady=5, anchor="center")
 
     date_entry = DateEntry(main_app_window, date_pattern='m/d/y')  # DateEntry widget for date input
     date_entry.pack(padx=10, pady=5, anchor="center")
 
+    # Optional merchant and note
+    details_frame = tk.Frame(main_app_window, bg="white")
+    details_frame.pack(padx=10, pady=5, anchor="center")
+    tk.Label(details_frame, text="Merchant:", bg="white").grid(row=0, column=0, padx=5, pady=2, sticky="e")
+    merchant_entry = tk.Entry(details_frame, width=30)
+    merchant_entry.grid(row=0, column=1, padx=5, pady=2)
+    tk.Label(details_frame, text="Note:", bg="white").grid(row=0, column=2, padx=5, pady=2, sticky="e")
+    note_entry = tk.Entry(details_frame, width=40)
+    note_entry.grid(row=0, column=3, padx=5, pady=2)
+
     add_expense_button = tk.Button(main_app_window, text="Add Expense", command=add_expense, bg="green", fg="white")  # Set background and foreground color
     add_expense_button.pack(padx=10, pady=5, anchor="center")
 
+    # Filter controls for the expense list and statistics (blank fields don't restrict anything)
+    filter_frame = tk.Frame(main_app_window, bg="white")
+    filter_frame.pack(padx=10, pady=5, anchor="center")
+    tk.Label(filter_frame, text="From:", bg="white").grid(row=0, column=0, padx=5, pady=2, sticky="e")
+    filter_start_entry = tk.Entry(filter_frame, width=12)
+    filter_start_entry.grid(row=0, column=1, padx=5, pady=2)
+    tk.Label(filter_frame, text="To:", bg="white").grid(row=1, column=0, padx=5, pady=2, sticky="e")
+    filter_end_entry = tk.Entry(filter_frame, width=12)
+    filter_end_entry.grid(row=1, column=1, padx=5, pady=2)
+    tk.Label(filter_frame, text="Min Amount:", bg="white").grid(row=0, column=2, padx=5, pady=2, sticky="e")
+    filter_min_entry = tk.Entry(filter_frame, width=12)
+    filter_min_entry.grid(row=0, column=3, padx=5, pady=2)
+    filter_min_entry.config(validate="key", validatecommand=(filter_min_entry.register(validate_amount), "%P"))
+    tk.Label(filter_frame, text="Max Amount:", bg="white").grid(row=1, column=2, padx=5, pady=2, sticky="e")
+    filter_max_entry = tk.Entry(filter_frame, width=12)
+    filter_max_entry.grid(row=1, column=3, padx=5, pady=2)
+    filter_max_entry.config(validate="key", validatecommand=(filter_max_entry.register(validate_amount), "%P"))
+    tk.Label(filter_frame, text="Categories:", bg="white").grid(row=0, column=4, padx=5, pady=2, sticky="ne")
+    filter_category_list = tk.Listbox(filter_frame, selectmode="multiple", height=4, exportselection=False)
+    filter_category_list.insert(tk.END, *[name for _, name in session.categories])
+    filter_category_list.grid(row=0, column=5, rowspan=2, padx=5, pady=2)
+    apply_filter_button = tk.Button(filter_frame, text="Apply Filter", command=apply_filter, bg="green", fg="white")
+    apply_filter_button.grid(row=0, column=6, padx=5, pady=2, sticky="ew")
+    clear_filter_button = tk.Button(filter_frame, text="Clear Filter", command=clear_filter, bg="green", fg="white")
+    clear_filter_button.grid(row=1, column=6, padx=5, pady=2, sticky="ew")
+
+    # Search box: ranked matches on merchant and note, shown in their own window
+    search_frame = tk.Frame(main_app_window, bg="white")
+    search_frame.pack(padx=10, pady=5, anchor="center")
+    tk.Label(search_frame, text="Search:", bg="white").pack(side="left", padx=5)
+    search_entry = tk.Entry(search_frame, width=40)
+    search_entry.pack(side="left", padx=5)
+    search_entry.bind("<Return>", lambda event: search_expenses())
+    search_button = tk.Button(search_frame, text="Search", command=search_expenses, bg="green", fg="white")
+    search_button.pack(side="left", padx=5)
+
     # Expense Treeview
     global expense_tree
-    expense_tree = ttk.Treeview(main_app_window, columns=('ID', 'User ID', 'Amount', 'Category', 'Date'), show='headings')
-    expense_tree.pack(padx=10, pady=5, anchor="center")
+    expense_frame = tk.Frame(main_app_window)
+    expense_frame.pack(padx=10, pady=5, anchor="center")
+    expense_tree = ttk.Treeview(expense_frame, columns=('ID', 'User ID', 'Amount', 'Category', 'Date', 'Merchant', 'Note'), show='headings')
+    expense_scrollbar = ttk.Scrollbar(expense_frame, orient="vertical", command=expense_tree.yview)
+    expense_tree.configure(yscrollcommand=on_expense_scroll)
+    expense_tree.pack(side="left")
+    expense_scrollbar.pack(side="right", fill="y")
 
     expense_tree.heading('ID', text='ID')
     expense_tree.heading('User ID', text='User ID')
     expense_tree.heading('Amount', text='Amount')
     expense_tree.heading('Category', text='Category')
     expense_tree.heading('Date', text='Date')
+    expense_tree.heading('Merchant', text='Merchant')
+    expense_tree.heading('Note', text='Note')
 
     # Create a frame below the expense tree view
     button_frame = tk.Frame(main_app_window)
@@ -311,50 +577,350 @@ def main_app_screen(user_id):
     stats_button = tk.Button(button_frame, text="Statistics Overview", command=show_statistics, bg="green", fg="white")  # Set background and foreground color
     stats_button.pack(side="left", padx=10)
 
+    # Recurring expenses and budgets buttons
+    recurring_button = tk.Button(button_frame, text="Recurring Expenses", bg="green", fg="white",
+                                 command=lambda: show_recurring_expenses(main_app_window, session, executor, on_recurring_change))
+    recurring_button.pack(side="left", padx=10)
+
+    budgets_button = tk.Button(button_frame, text="Budgets", command=lambda: show_budgets(main_app_window, session, executor), bg="green", fg="white")
+    budgets_button.pack(side="left", padx=10)
+
     # Logout button
     logout_button = tk.Button(button_frame, text="Logout", command=logout_from_main_app, bg="green", fg="white")  # Set background and foreground color
     logout_button.pack(side="left", padx=10)
 
+    # Busy indicator and background executor for database work
+    status_label = tk.Label(main_app_window, text="", bg="white")
+    status_label.pack(pady=5)
+    executor = TaskExecutor(main_app_window, on_busy_change=make_busy_indicator(main_app_window, status_label))
+
+    # Closing the window logs out
+    main_app_window.protocol("WM_DELETE_WINDOW", logout_from_main_app)
+
+    # Load the newest page of expenses
+    update_expense_list()
+
+
+# Most rows kept in the expense treeview at once
+MAX_LOADED_EXPENSES = 500
+
+# Function to show a user's recurring expense rules, with a form to add one and a button to delete one.
+# on_change is called after expenses were created or rules deleted, so the main window can reload.
+def show_recurring_expenses(parent, session, executor, on_change):
+    from tkcalendar import DateEntry  # Deferred, see DEFERRED_MODULES
+    recurring_window = tk.Toplevel(parent)
+    recurring_window.title("Recurring Expenses")
+
+    recurring_tree = ttk.Treeview(recurring_window, columns=('ID', 'Amount', 'Category', 'Frequency', 'Start', 'End', 'Next'), show='headings')
+    for column in ('ID', 'Amount', 'Category', 'Frequency', 'Start', 'End', 'Next'):
+        recurring_tree.heading(column, text=column)
+        recurring_tree.column(column, width=100)
+    recurring_tree.pack(padx=10, pady=5, fill="both", expand=True)
+
+    # Function to reload the list of rules
+    def refresh():
+        executor.submit('recurring_list', repo.list_recurring_expenses, session.user_id, on_success=show_rules, on_error=show_task_error)
+
+    # Function to display the rules fetched by refresh
+    def show_rules(rules):
+        if not recurring_window.winfo_exists():
+            return  # Closed while the rules were loading
+        recurring_tree.delete(*recurring_tree.get_children())
+        for rule_id, amount_cents, category, frequency, start_date, end_date, next_date in rules:
+            recurring_tree.insert('', 'end', values=(rule_id, format_amount(amount_cents), category, frequency.title(),
+                                                     start_date, end_date or "", next_date))
+
+    # Function to add a rule and create its expenses that are already due
+    def add_rule():
+        try:
+            amount = parse_amount(amount_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Invalid amount. Please enter a valid number", parent=recurring_window)
+            return
+        category_id = session.category_id(category_var.get())
+        if category_id is None:
+            messagebox.showerror("Error", "Please choose a category", parent=recurring_window)
+            return
+        def add_and_materialize(start_date):
+            repo.add_recurring_expense(session.user_id, amount, category_id, frequency_var.get(), start_date)
+            return repo.materialize_recurring(session.user_id)
+        def on_added(created):
+            messagebox.showinfo("Success", "Recurring expense added ({} expenses created)".format(created), parent=recurring_window)
+            refresh()
+            on_change()
+        executor.submit(None, add_and_materialize, start_entry.get_date(), on_success=on_added, on_error=show_task_error)
+
+    # Function to delete the selected rule (the expenses it already created are kept)
+    def delete_rule():
+        selected_item = recurring_tree.selection()
+        if not selected_item:
+            messagebox.showerror("Error", "Please select a recurring expense to delete", parent=recurring_window)
+            return
+        rule_id = recurring_tree.item(selected_item, 'values')[0]
+        executor.submit(None, repo.delete_recurring_expense, session.user_id, rule_id,
+                        on_success=lambda _: refresh(), on_error=show_task_error)
+
+    form_frame = tk.Frame(recurring_window)
+    form_frame.pack(padx=10, pady=5)
+    tk.Label(form_frame, text="Amount:").grid(row=0, column=0, padx=5, pady=2)
+    amount_entry = tk.Entry(form_frame, width=12)
+    amount_entry.grid(row=1, column=0, padx=5, pady=2)
+    amount_entry.config(validate="key", validatecommand=(amount_entry.register(validate_amount), "%P"))
+    tk.Label(form_frame, text="Category:").grid(row=0, column=1, padx=5, pady=2)
+    category_var = tk.StringVar(recurring_window, CATEGORY_PLACEHOLDER)
+    ttk.OptionMenu(form_frame, category_var, CATEGORY_PLACEHOLDER, *[name for _, name in session.categories]).grid(row=1, column=1, padx=5, pady=2)
+    tk.Label(form_frame, text="Frequency:").grid(row=0, column=2, padx=5, pady=2)
+    frequency_var = tk.StringVar(recurring_window, 'monthly')
+    ttk.OptionMenu(form_frame, frequency_var, 'monthly', *RECURRING_FREQUENCIES).grid(row=1, column=2, padx=5, pady=2)
+    tk.Label(form_frame, text="Starting:").grid(row=0, column=3, padx=5, pady=2)
+    start_entry = DateEntry(form_frame, date_pattern='m/d/y')
+    start_entry.grid(row=1, column=3, padx=5, pady=2)
+
+    button_frame = tk.Frame(recurring_window)
+    button_frame.pack(pady=5)
+    tk.Button(button_frame, text="Add Recurring Expense", command=add_rule, bg="green", fg="white").pack(side="left", padx=10)
+    tk.Button(button_frame, text="Delete Recurring Expense", command=delete_rule, bg="green", fg="white").pack(side="left", padx=10)
+    refresh()
+
+# Function to show the user's expenses whose merchant or note match `text`, best matches first, one
+# page of SEARCH_PAGE_SIZE at a time
+def show_search_results(parent, session, executor, text):
+    results_window = tk.Toplevel(parent)
+    results_window.title('Search: "{}"'.format(text))
+    task_key = ('search', str(results_window))  # Paging in one results window supersedes its own earlier page only
+
+    columns = ('ID', 'Amount', 'Category', 'Date', 'Merchant', 'Note')
+    results_tree = ttk.Treeview(results_window, columns=columns, show='headings', height=20)
+    for column in columns:
+        results_tree.heading(column, text=column)
+    results_tree.pack(padx=10, pady=5, fill="both", expand=True)
+    status_label = tk.Label(results_window, text="")
+    status_label.pack(pady=2)
+
+    # Offsets of the pages visited so far, so Previous Page can go back
+    state = {'offsets': [0], 'next_offset': None}
+
+    def load():
+        executor.submit(task_key, repo.search_expenses, session.user_id, text, state['offsets'][-1],
+                        on_success=show_page, on_error=show_task_error)
+
+    def show_page(page):
+        if not results_window.winfo_exists():
+            return
+        rows, state['next_offset'] = page
+        results_tree.delete(*results_tree.get_children())
+        category_names = session.category_names
+        for expense_id, _, amount_cents, category_id, expense_date, merchant, note in rows:
+            results_tree.insert('', 'end', values=(expense_id, format_amount(amount_cents), category_names.get(category_id, ""),
+                                                   expense_date, merchant or "", note or ""))
+        first = state['offsets'][-1] + 1
+        status_label.config(text="Matches {}-{}".format(first, first + len(rows) - 1) if rows else "No matches")
+        previous_button.config(state="normal" if len(state['offsets']) > 1 else "disabled")
+        next_button.config(state="normal" if state['next_offset'] is not None else "disabled")
+
+    def next_page():
+        if state['next_offset'] is not None:
+            state['offsets'].append(state['next_offset'])
+            load()
+
+    def previous_page():
+        if len(state['offsets']) > 1:
+            state['offsets'].pop()
+            load()
+
+    button_frame = tk.Frame(results_window)
+    button_frame.pack(pady=5)
+    previous_button = tk.Button(button_frame, text="Previous Page", command=previous_page, bg="green", fg="white", state="disabled")
+    previous_button.pack(side="left", padx=10)
+    next_button = tk.Button(button_frame, text="Next Page", command=next_page, bg="green", fg="white", state="disabled")
+    next_button.pack(side="left", padx=10)
+    load()
+
+# Function to show a user's monthly category budgets and this month's spending against them
+def show_budgets(parent, session, executor):
+    budgets_window = tk.Toplevel(parent)
+    budgets_window.title("Budgets")
+
+    budget_tree = ttk.Treeview(budgets_window, columns=('Category', 'Monthly Budget', 'Spent This Month', 'Remaining'), show='headings')
+    for column in ('Category', 'Monthly Budget', 'Spent This Month', 'Remaining'):
+        budget_tree.heading(column, text=column)
+    budget_tree.pack(padx=10, pady=5, fill="both", expand=True)
+
+    # Function to reload the budgets
+    def refresh():
+        executor.submit('budget_list', repo.list_budgets, session.user_id, date.today().isoformat()[:7],
+                        on_success=show_budget_rows, on_error=show_task_error)
+
+    # Function to display the budgets fetched by refresh
+    def show_budget_rows(budgets):
+        if not budgets_window.winfo_exists():
+            return  # Closed while the budgets were loading
+        budget_tree.delete(*budget_tree.get_children())
+        for _, category, limit_cents, spent_cents in budgets:
+            budget_tree.insert('', 'end', values=(category, format_amount(limit_cents), format_amount(spent_cents),
+                                                  format_amount(limit_cents - spent_cents)))
+
+    # Function to set (or, with a blank amount, remove) the budget of the chosen category
+    def save_budget():
+        category_id = session.category_id(category_var.get())
+        if category_id is None:
+            messagebox.showerror("Error", "Please choose a category", parent=budgets_window)
+            return
+        limit_text = limit_entry.get().strip()
+        try:
+            limit_cents = parse_amount(limit_text) if limit_text else None
+        except ValueError:
+            messagebox.showerror("Error", "Invalid amount. Please enter a valid number", parent=budgets_window)
+            return
+        executor.submit(None, repo.set_budget, session.user_id, category_id, limit_cents,
+                        on_success=lambda _: refresh(), on_error=show_task_error)
+
+    form_frame = tk.Frame(budgets_window)
+    form_frame.pack(padx=10, pady=5)
+    category_var = tk.StringVar(budgets_window, CATEGORY_PLACEHOLDER)
+    ttk.OptionMenu(form_frame, category_var, CATEGORY_PLACEHOLDER, *[name for _, name in session.categories]).pack(side="left", padx=5)
+    tk.Label(form_frame, text="Monthly budget (blank to remove):").pack(side="left", padx=5)
+    limit_entry = tk.Entry(form_frame, width=12)
+    limit_entry.pack(side="left", padx=5)
+    limit_entry.config(validate="key", validatecommand=(limit_entry.register(validate_amount), "%P"))
+    tk.Button(form_frame, text="Set Budget", command=save_budget, bg="green", fg="white").pack(side="left", padx=10)
+    refresh()
+
+# Function to warn about budgets that are over their limit
+def show_budget_alerts(alerts, parent=None):
+    if alerts:
+        messagebox.showwarning("Budget", "\n".join(
+            "{} is over budget: {} spent of {}".format(category, format_amount(spent_cents), format_amount(limit_cents))
+            for _, category, limit_cents, spent_cents in alerts), parent=parent)
+
+# Function to rebuild all rollup tables from the raw expenses
+def rebuild_all_rollups():
+    admin_executor.submit('rollups', repo.rebuild_rollups,
+                          on_success=lambda _: messagebox.showinfo("Success", "Rollups rebuilt successfully"),
+                          on_error=show_task_error)
+
+# Function to verify the rollup tables against the raw expenses
+def verify_rollups():
+    admin_executor.submit('rollups', repo.check_rollups, on_success=show_rollup_problems, on_error=show_task_error)
+
+# Function to display the result of verify_rollups
+def show_rollup_problems(problems):
+    if problems:
+        messagebox.showerror("Rollup Check", "{} mismatches found:\n{}".format(len(problems), "\n".join(problems[:20])))
+    else:
+        messagebox.showinfo("Rollup Check", "Rollups match the expense records")
 
-
-# Function to fetch expenses for a specific period
-def fetch_expenses_for_period(user_id, start_date, end_date):
-    # Convert start_date and end_date to the format used in the database ('m/d/y')
-    start_date_str = start_date.strftime('%m/%d/%Y')
-    end_date_str = end_date.strftime('%m/%d/%Y')
-    
-    # Execute SQL query to fetch expenses within the specified period
-    c.execute("SELECT * FROM expenses WHERE user_id=? AND date BETWEEN ? AND ?", (user_id, start_date_str, end_date_str))
-    
-    # Return fetched expenses
-    return c.fetchall()
-
-# Function to handle user deletion
+# Function to handle user deletion (all selected users; their expenses are deleted with them)
 def delete_user():
-    selected_item = user_tree.selection()
-    if selected_item:
-        user_id = user_tree.item(selected_item, 'values')[0]
-        c.execute("DELETE FROM users WHERE id=?", (user_id,))
-        conn.commit()
-        messagebox.showinfo("Success", "User deleted successfully")
-        update_user_list()
+    selected_items = user_tree.selection()
+    if selected_items:
+        user_ids = [user_tree.item(item, 'values')[0] for item in selected_items]
+        if not messagebox.askyesno("Confirm", "Delete {} user(s) and all of their expenses?".format(len(user_ids))):
+            return
+        def on_deleted(deleted):
+            messagebox.showinfo("Success", "{} user(s) deleted successfully".format(deleted))
+            update_user_list()
+        admin_executor.submit(None, repo.delete_users, user_ids, on_success=on_deleted, on_error=show_task_error)
     else:
         messagebox.showerror("Error", "Please select a user to delete")
 
-# Function to update user list
+# Function to remove orphaned expenses and compact the database file
+def cleanup_database():
+    def on_cleaned(result):
+        removed, reclaimed = result
+        messagebox.showinfo("Success", "Removed {} orphaned expenses and reclaimed {:,} bytes".format(removed, reclaimed))
+    admin_executor.submit('cleanup', repo.purge_orphans_and_vacuum, on_success=on_cleaned, on_error=show_task_error)
+
+# Admin user list state: search text, sort column and direction, and the keyset keys of the
+# pages visited so far (so Previous Page can go back without OFFSET scans)
+user_list_state = {'search': '', 'sort': 'id', 'descending': False, 'page_keys': [None], 'next_key': None}
+
+# Function to update user list (reloads the current page)
 def update_user_list():
+    state = user_list_state
+    admin_executor.submit('user_list', repo.list_users_page, state['search'], state['sort'], state['descending'],
+                          after=state['page_keys'][-1], on_success=show_user_list, on_error=show_task_error)
+
+# Function to display a page of user accounts fetched by update_user_list
+def show_user_list(page):
+    users, user_list_state['next_key'] = page
     # Clear current user list
-    for row in user_tree.get_children():
-        user_tree.delete(row)
-    # Fetch and display all user accounts
-    c.execute("SELECT * FROM users")
-    users = c.fetchall()
+    user_tree.delete(*user_tree.get_children())
     for user in users:
-        user_tree.insert('', 'end', values=user)
+        # Format total spent (in centavos) to display with 2 decimal places and Philippine peso symbol
+        user_tree.insert('', 'end', values=user[:-1] + (format_amount(user[-1]),))
+    page_label.config(text="Page {}".format(len(user_list_state['page_keys'])))
+
+# Function to restart the user list from the first page
+def reset_user_list():
+    user_list_state['page_keys'] = [None]
+    update_user_list()
+
+# Function to show the next page of users
+def next_user_page():
+    if user_list_state['next_key'] is not None:
+        user_list_state['page_keys'].append(user_list_state['next_key'])
+        update_user_list()
+
+# Function to show the previous page of users
+def previous_user_page():
+    if len(user_list_state['page_keys']) > 1:
+        user_list_state['page_keys'].pop()
+        update_user_list()
+
+# Function to filter the user list by the text in the search box
+def search_users(event=None):
+    user_list_state['search'] = user_search_entry.get().strip()
+    reset_user_list()
+
+# Function to sort the user list by a column; clicking the same heading again reverses the order
+def sort_users(column):
+    if user_list_state['sort'] == column:
+        user_list_state['descending'] = not user_list_state['descending']
+    else:
+        user_list_state['sort'], user_list_state['descending'] = column, False
+    reset_user_list()
+
+# Function to show the query diagnostics window
+def show_diagnostics(admin_window):
+    diagnostics_window = tk.Toplevel(admin_window)
+    diagnostics_window.title("Diagnostics")
+
+    diagnostics_text = tk.Text(diagnostics_window, width=140, height=35, font=("Courier", 10))
+    diagnostics_text.pack(fill="both", expand=True, padx=10, pady=5)
+
+    # Function to refresh the metrics report
+    def refresh():
+        diagnostics_text.delete("1.0", tk.END)
+        if not INSTRUMENT_QUERIES:
+            diagnostics_text.insert(tk.END, "Query instrumentation is disabled. Start the app with EXPENSE_TRACKER_METRICS=1 to enable it.\n")
+        diagnostics_text.insert(tk.END, METRICS.summary())
+
+    # Function to clear the collected metrics
+    def reset():
+        METRICS.reset()
+        refresh()
+
+    # Function to save the metrics as JSON or Prometheus text
+    def export(kind):
+        extension = ".json" if kind == "json" else ".prom"
+        path = filedialog.asksaveasfilename(parent=diagnostics_window, defaultextension=extension)
+        if path:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(METRICS.to_json() if kind == "json" else METRICS.to_prometheus())
+
+    button_frame = tk.Frame(diagnostics_window)
+    button_frame.pack(pady=5)
+    tk.Button(button_frame, text="Refresh", command=refresh, bg="green", fg="white").pack(side="left", padx=10)
+    tk.Button(button_frame, text="Reset", command=reset, bg="green", fg="white").pack(side="left", padx=10)
+    tk.Button(button_frame, text="Export JSON", command=lambda: export("json"), bg="green", fg="white").pack(side="left", padx=10)
+    tk.Button(button_frame, text="Export Prometheus", command=lambda: export("prometheus"), bg="green", fg="white").pack(side="left", padx=10)
+    refresh()
 
 # Function to handle admin logout
 def logout_admin(admin_window):
-    # Close the admin dashboard window
+    # Stop background work, then close the admin dashboard window
+    admin_executor.shutdown()
     admin_window.destroy()
     # Re-display the login window
     login_window.deiconify()
@@ -365,39 +931,66 @@ def admin_dashboard():
     login_window.withdraw()
 
     # Create admin dashboard window
-    admin_window = tk.Tk()  # Use Tk instead of Toplevel to ensure full-screen behavior
+    apply_theme()
+    admin_window = tk.Toplevel(login_window)
     admin_window.title("Admin Dashboard")
     admin_window.attributes('-fullscreen', True)  # Open window in full screen
-
-    # User Treeview
+    admin_window.protocol("WM_DELETE_WINDOW", lambda: logout_admin(admin_window))  # Closing the window logs out
+
+    # Busy indicator and background executor for database work
+    global admin_executor
+    status_label = tk.Label(admin_window, text="")
+    status_label.pack(side="bottom", pady=5)
+    admin_executor = TaskExecutor(admin_window, on_busy_change=make_busy_indicator(admin_window, status_label))
+
+    # Search box (prefix match on username, email, first or last name)
+    global user_search_entry
+    search_frame = tk.Frame(admin_window)
+    search_frame.pack(fill="x", padx=10, pady=5)
+    tk.Label(search_frame, text="Search:").pack(side="left")
+    user_search_entry = tk.Entry(search_frame, width=40)
+    user_search_entry.pack(side="left", padx=5)
+    user_search_entry.bind('<Return>', search_users)
+    search_button = tk.Button(search_frame, text="Search", command=search_users, bg="green", fg="white")  # Set background and foreground color
+    search_button.pack(side="left", padx=5)
+
+    # User Treeview; clicking a sortable heading sorts by that column
     global user_tree
-    user_tree = ttk.Treeview(admin_window, columns=('ID', 'First Name', 'Last Name', 'Email', 'Age', 'Sex', 'Contact Number', 'Username', 'Password'), show='headings')
+    columns = [
+        ('ID', 'id', 50),
+        ('First Name', 'first_name', 100),
+        ('Last Name', 'last_name', 100),
+        ('Email', 'email', 200),
+        ('Age', None, 50),
+        ('Sex', None, 50),
+        ('Contact Number', None, 150),
+        ('Username', 'username', 100),
+        ('Expenses', 'expense_count', 80),
+        ('Total Spent', 'total_spent', 120),
+    ]
+    user_tree = ttk.Treeview(admin_window, columns=[heading for heading, _, _ in columns], show='headings', selectmode='extended')
     user_tree.pack(fill="both", expand=True, padx=10, pady=5)
-
-    user_tree.heading('ID', text='ID')
-    user_tree.heading('First Name', text='First Name')
-    user_tree.heading('Last Name', text='Last Name')
-    user_tree.heading('Email', text='Email')
-    user_tree.heading('Age', text='Age')
-    user_tree.heading('Sex', text='Sex')
-    user_tree.heading('Contact Number', text='Contact Number')
-    user_tree.heading('Username', text='Username')
-    user_tree.heading('Password', text='Password')
-
-    # Adjusting column widths based on content
-    user_tree.column('ID', width=50)
-    user_tree.column('First Name', width=100)
-    user_tree.column('Last Name', width=100)
-    user_tree.column('Email', width=200)
-    user_tree.column('Age', width=50)
-    user_tree.column('Sex', width=50)
-    user_tree.column('Contact Number', width=150)
-    user_tree.column('Username', width=100)
-    user_tree.column('Password', width=100)
-
-
-    # Fetch and display all user accounts
-    update_user_list()
+    for heading, sort_key, width in columns:
+        if sort_key:
+            user_tree.heading(heading, text=heading, command=lambda sort_key=sort_key: sort_users(sort_key))
+        else:
+            user_tree.heading(heading, text=heading)
+        user_tree.column(heading, width=width)
+
+    # Pagination controls
+    global page_label
+    page_frame = tk.Frame(admin_window)
+    page_frame.pack(pady=5)
+    previous_page_button = tk.Button(page_frame, text="Previous Page", command=previous_user_page, bg="green", fg="white")  # Set background and foreground color
+    previous_page_button.pack(side="left", padx=10)
+    page_label = tk.Label(page_frame, text="Page 1")
+    page_label.pack(side="left", padx=10)
+    next_page_button = tk.Button(page_frame, text="Next Page", command=next_user_page, bg="green", fg="white")  # Set background and foreground color
+    next_page_button.pack(side="left", padx=10)
+
+    # Fetch and display the first page of user accounts
+    user_list_state['search'] = ''
+    reset_user_list()
 
     # Button Frame
     button_frame = tk.Frame(admin_window)
@@ -407,6 +1000,21 @@ def admin_dashboard():
     delete_user_button = tk.Button(button_frame, text="Delete User", command=delete_user, bg="green", fg="white")  # Set background and foreground color
     delete_user_button.pack(side="left", padx=10)
 
+    # Rollup maintenance buttons
+    rebuild_rollups_button = tk.Button(button_frame, text="Rebuild Rollups", command=rebuild_all_rollups, bg="green", fg="white")  # Set background and foreground color
+    rebuild_rollups_button.pack(side="left", padx=10)
+
+    check_rollups_button = tk.Button(button_frame, text="Check Rollups", command=verify_rollups, bg="green", fg="white")  # Set background and foreground color
+    check_rollups_button.pack(side="left", padx=10)
+
+    # Database cleanup button
+    cleanup_button = tk.Button(button_frame, text="Cleanup Database", command=cleanup_database, bg="green", fg="white")  # Set background and foreground color
+    cleanup_button.pack(side="left", padx=10)
+
+    # Diagnostics button
+    diagnostics_button = tk.Button(button_frame, text="Diagnostics", command=lambda: show_diagnostics(admin_window), bg="green", fg="white")  # Set background and foreground color
+    diagnostics_button.pack(side="left", padx=10)
+
     # Admin logout button
     logout_button = tk.Button(button_frame, text="Logout", command=lambda: logout_admin(admin_window), bg="green", fg="white")  # Set background and foreground color
     logout_button.pack(side="left", padx=10)
@@ -423,47 +1031,6 @@ def center_window(window):
     y = (height // 2) - (height // 2)
     window.geometry('{}x{}+{}+{}'.format(width, height, x, y))
 
-# Validation function for amount entry
-def validate_amount(value):
-    if value == "":
-        return True
-    try:
-        float(value)
-        return True
-    except ValueError:
-        return False
-
-# UI setup for login window
-login_window = ThemedTk(theme="plastik")  # Apply theme to the login window
-login_window.title("Expense Tracker - Login")
-login_window.configure(background="white")  # Set background color to white
-login_window.attributes('-fullscreen', True)  # Set window to full screen
-
-login_frame = tk.Frame(login_window, bg="white")  # Set background color
-login_frame.pack(expand=True)
-
-login_username_label = tk.Label(login_frame, text="Username:", bg="white", font=("Arial", 14))  # Set background color and font size
-login_username_label.grid(row=0, column=0, padx=10, pady=10, sticky="e")
-login_username_entry = tk.Entry(login_frame, width=40, font=("Arial", 14))  # Adjust width and font size of entry widget
-login_username_entry.grid(row=0, column=1, padx=10, pady=10, sticky="w")
-
-login_password_label = tk.Label(login_frame, text="Password:", bg="white", font=("Arial", 14))  # Set background color and font size
-login_password_label.grid(row=1, column=0, padx=10, pady=10, sticky="e")
-login_password_entry = tk.Entry(login_frame, show="*", width=40, font=("Arial", 14))  # Adjust width and font size of entry widget
-login_password_entry.grid(row=1, column=1, padx=10, pady=10, sticky="w")
-
-login_button = tk.Button(login_frame, text="Login", command=login, bg="green", fg="white", font=("Arial", 14), width=20)  # Adjust font size and width of button widget
-login_button.grid(row=2, column=0, columnspan=2, padx=10, pady=10)
-
-switch_to_register_button = tk.Button(login_frame, text="Go Register", command=switch_to_registration, bg="green", fg="white", font=("Arial", 14), width=20)  # Adjust font size and width of button widget
-switch_to_register_button.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
-
-# UI setup for registration window
-register_window = ThemedTk(theme="plastik")  # Apply theme to the registration window
-register_window.title("Expense Tracker - Register")
-register_window.attributes('-fullscreen', True)  # Set window to full screen
-register_window.configure(background="white")  # Set background color to white
-
 # Function to center window contents
 def center_window_content(window):
     width = window.winfo_reqwidth()
@@ -474,11 +1041,6 @@ def center_window_content(window):
     y = (screen_height // 2) - (height // 2)
     window.geometry('{}x{}+{}+{}'.format(width, height, x, y))
 
-# UI setup for registration frame
-register_frame = tk.Frame(register_window, bg="white")  # Set background color
-register_frame.pack(expand=True, fill="both")  # Make the frame expand to fill the entire window
-register_frame.place(relx=0.5, rely=0.5, anchor="center")  # Center the frame on the screen
-
 # Function to create labels and entries with consistent styling
 def create_entry_with_label(label_text, row, column):
     label = tk.Label(register_frame, text=label_text, bg="white", font=("Arial", 12))  # Set background color and font
@@ -487,39 +1049,134 @@ def create_entry_with_label(label_text, row, column):
     entry.grid(row=row, column=column + 1, padx=10, pady=5, sticky="w")
     return entry
 
-first_name_entry = create_entry_with_label("First Name:", 0, 0)
-last_name_entry = create_entry_with_label("Last Name:", 1, 0)
-email_entry = create_entry_with_label("Email:", 2, 0)
-age_entry = create_entry_with_label("Age:", 3, 0)
-contact_number_entry = create_entry_with_label("Contact Number:", 4, 0)
-register_username_entry = create_entry_with_label("Username:", 5, 0)
-register_password_entry = create_entry_with_label("Password:", 6, 0)
-
-# Radio buttons for sex selection
-sex_label = tk.Label(register_frame, text="Sex:", bg="white", font=("Arial", 12))  # Set background color and font
-sex_label.grid(row=7, column=0, padx=10, pady=5, sticky="e")
-sex_var = tk.StringVar(register_frame)
-sex_var.set("Male")  # Set default value for radio button
-sex_radio_male = tk.Radiobutton(register_frame, text="Male", variable=sex_var, value="Male", bg="white", font=("Arial", 12))  # Set background color and font
-sex_radio_male.grid(row=7, column=1, padx=10, pady=5, sticky="w")
-sex_radio_female = tk.Radiobutton(register_frame, text="Female", variable=sex_var, value="Female", bg="white", font=("Arial", 12))  # Set background color and font
-sex_radio_female.grid(row=7, column=2, padx=10, pady=5, sticky="w")
-
-# Register button
-register_button = tk.Button(register_frame, text="Register", command=register_user, bg="green", fg="white", font=("Arial", 12))  # Set background, foreground color, and font
-register_button.grid(row=8, column=0, columnspan=3, pady=10)
-
-# Switch to login button
-switch_to_login_button = tk.Button(register_frame, text="Go Login", command=switch_to_login, bg="green", fg="white", font=("Arial", 12))  # Set background, foreground color, and font
-switch_to_login_button.grid(row=9, column=0, columnspan=3, pady=10)
-
-
-# Center the login window initially
-center_window(login_window)
-
-# Start the tkinter event loop
-login_window.mainloop()
+# Function to build the login window
+def build_login_window():
+    global login_window, login_username_entry, login_password_entry
+    # UI setup for login window
+    login_window = tk.Tk()  # The app's only root; every other window is a Toplevel of it
+    login_window.title("Expense Tracker - Login")
+    login_window.configure(background="white")  # Set background color to white
+    login_window.attributes('-fullscreen', True)  # Set window to full screen
+
+    login_frame = tk.Frame(login_window, bg="white")  # Set background color
+    login_frame.pack(expand=True)
+
+    login_username_label = tk.Label(login_frame, text="Username:", bg="white", font=("Arial", 14))  # Set background color and font size
+    login_username_label.grid(row=0, column=0, padx=10, pady=10, sticky="e")
+    login_username_entry = tk.Entry(login_frame, width=40, font=("Arial", 14))  # Adjust width and font size of entry widget
+    login_username_entry.grid(row=0, column=1, padx=10, pady=10, sticky="w")
+
+    login_password_label = tk.Label(login_frame, text="Password:", bg="white", font=("Arial", 14))  # Set background color and font size
+    login_password_label.grid(row=1, column=0, padx=10, pady=10, sticky="e")
+    login_password_entry = tk.Entry(login_frame, show="*", width=40, font=("Arial", 14))  # Adjust width and font size of entry widget
+    login_password_entry.grid(row=1, column=1, padx=10, pady=10, sticky="w")
+
+    login_button = tk.Button(login_frame, text="Login", command=login, bg="green", fg="white", font=("Arial", 14), width=20)  # Adjust font size and width of button widget
+    login_button.grid(row=2, column=0, columnspan=2, padx=10, pady=10)
+
+    switch_to_register_button = tk.Button(login_frame, text="Go Register", command=switch_to_registration, bg="green", fg="white", font=("Arial", 14), width=20)  # Adjust font size and width of button widget
+    switch_to_register_button.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
+
+    # Busy indicator and background executor for login checks
+    global login_executor
+    login_status_label = tk.Label(login_frame, text="", bg="white", font=("Arial", 12))
+    login_status_label.grid(row=4, column=0, columnspan=2, pady=5)
+    login_executor = TaskExecutor(login_window, on_busy_change=make_busy_indicator(login_window, login_status_label))
+
+# Function to build the registration window (on first use)
+def build_register_window():
+    global register_window, register_frame, first_name_entry, last_name_entry, email_entry, age_entry
+    global contact_number_entry, register_username_entry, register_password_entry, sex_var
+    # UI setup for registration window
+    register_window = tk.Toplevel(login_window)
+    register_window.title("Expense Tracker - Register")
+    register_window.attributes('-fullscreen', True)  # Set window to full screen
+    register_window.configure(background="white")  # Set background color to white
+    register_window.protocol("WM_DELETE_WINDOW", switch_to_login)  # Closing the window goes back to login
+
+    # UI setup for registration frame
+    register_frame = tk.Frame(register_window, bg="white")  # Set background color
+    register_frame.pack(expand=True, fill="both")  # Make the frame expand to fill the entire window
+    register_frame.place(relx=0.5, rely=0.5, anchor="center")  # Center the frame on the screen
+
+    first_name_entry = create_entry_with_label("First Name:", 0, 0)
+    last_name_entry = create_entry_with_label("Last Name:", 1, 0)
+    email_entry = create_entry_with_label("Email:", 2, 0)
+    age_entry = create_entry_with_label("Age:", 3, 0)
+    contact_number_entry = create_entry_with_label("Contact Number:", 4, 0)
+    register_username_entry = create_entry_with_label("Username:", 5, 0)
+    register_password_entry = create_entry_with_label("Password:", 6, 0)
+
+    # Radio buttons for sex selection
+    sex_label = tk.Label(register_frame, text="Sex:", bg="white", font=("Arial", 12))  # Set background color and font
+    sex_label.grid(row=7, column=0, padx=10, pady=5, sticky="e")
+    sex_var = tk.StringVar(register_frame)
+    sex_var.set("Male")  # Set default value for radio button
+    sex_radio_male = tk.Radiobutton(register_frame, text="Male", variable=sex_var, value="Male", bg="white", font=("Arial", 12))  # Set background color and font
+    sex_radio_male.grid(row=7, column=1, padx=10, pady=5, sticky="w")
+    sex_radio_female = tk.Radiobutton(register_frame, text="Female", variable=sex_var, value="Female", bg="white", font=("Arial", 12))  # Set background color and font
+    sex_radio_female.grid(row=7, column=2, padx=10, pady=5, sticky="w")
+
+    # Register button
+    register_button = tk.Button(register_frame, text="Register", command=register_user, bg="green", fg="white", font=("Arial", 12))  # Set background, foreground color, and font
+    register_button.grid(row=8, column=0, columnspan=3, pady=10)
+
+    # Switch to login button
+    switch_to_login_button = tk.Button(register_frame, text="Go Login", command=switch_to_login, bg="green", fg="white", font=("Arial", 12))  # Set background, foreground color, and font
+    switch_to_login_button.grid(row=9, column=0, columnspan=3, pady=10)
+
+    # Busy indicator and background executor for registrations
+    global register_executor
+    register_status_label = tk.Label(register_frame, text="", bg="white", font=("Arial", 12))
+    register_status_label.grid(row=10, column=0, columnspan=3, pady=5)
+    register_executor = TaskExecutor(register_window, on_busy_change=make_busy_indicator(register_window, register_status_label))
+
+
+# Function to open the database (or connect to the server), build the windows and run the app
+def main():
+    global repo
+    METRICS.record_startup('imports', time.perf_counter() - STARTED_AT)
+    if SERVER_URL:
+        from client import RemoteRepository  # http.client is a sizeable import only server mode needs
+        repo = RemoteRepository(SERVER_URL)
+    else:
+        repo = ExpenseRepository(DB_PATH, instrument=INSTRUMENT_QUERIES,
+                                 slow_query_threshold=float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None)
+    METRICS.record_startup('database_open', time.perf_counter() - STARTED_AT)
+
+    # Only the login screen is built up front; the other screens are built when first shown
+    build_login_window()
+    login_window.bind('<Map>', on_first_frame)
+
+    # Center the login window initially
+    center_window(login_window)
+
+    # Start the tkinter event loop
+    login_window.mainloop()
+
+    # Stop the worker threads and close database connection
+    login_executor.shutdown()
+    if register_executor is not None:
+        register_executor.shutdown()
+    shutdown_shared_pool()
+    repo.close()
+
+# Function to record the time to the login screen's first frame: the root window has been mapped
+# and its pending redraws are done. Then loads the deferred modules in the background.
+def on_first_frame(event):
+    if event.widget is not login_window:
+        return  # Map events of the child widgets
+    login_window.unbind('<Map>')
+    login_window.update_idletasks()
+    first_frame = time.perf_counter() - STARTED_AT
+    METRICS.record_startup('first_frame', first_frame)
+    if INSTRUMENT_QUERIES or STARTUP_PROBE:
+        print("First frame after {:.0f} ms".format(first_frame * 1000), file=sys.stderr)
+    if STARTUP_PROBE:
+        login_window.after_idle(login_window.destroy)
+        return
+    preload_deferred_modules()
 
 
-# Close database connection
-conn.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Streaming export of a user's expenses to CSV, JSON Lines or Parquet.
+# Rows are read from the database in chunks and written as they arrive, so memory use does not
+# depend on how many expenses are exported. A summary (row count, grand total and totals per
+# category) is accumulated in the same pass and written as a footer.
+#
+# Usage: python exporter.py --user USERNAME OUTPUT [--format csv|jsonl|parquet] [--from DATE] [--to DATE] [--compress]
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+from datetime import date
+
+from money import amount_to_decimal
+from repository import ExpenseRepository, EXPORT_CHUNK_SIZE, normalize_date
+
+EXPORT_COLUMNS = ('id', 'amount', 'category', 'date', 'merchant', 'note')
+
+
+# Row count and totals of an export. Amounts are written in pesos, but totals are summed in
+# integer centavos so they are exact however many rows are exported.
+class ExportSummary:
+    def __init__(self):
+        self.row_count = 0
+        self.total_cents = 0
+        self.category_totals = {}  # Centavos per category
+
+    def add_rows(self, rows):
+        for _, amount_cents, category, *_ in rows:
+            self.total_cents += amount_cents
+            self.category_totals[category] = self.category_totals.get(category, 0) + amount_cents
+        self.row_count += len(rows)
+
+    @property
+    def total(self):
+        return amount_to_decimal(self.total_cents)
+
+    def as_dict(self):
+        return {
+            'rows': self.row_count,
+            'total': self.total_cents / 100,
+            'category_totals': {category: total / 100 for category, total in sorted(self.category_totals.items())},
+        }
+
+
+# Function to convert a chunk of (id, amount_cents, category, date, merchant, note) rows to export rows with Decimal amounts
+def to_export_rows(rows):
+    return [(expense_id, amount_to_decimal(amount_cents), category, date, merchant, note)
+            for expense_id, amount_cents, category, date, merchant, note in rows]
+
+
+# Function to open an output file for text formats, gzip-compressed if requested
+def open_text_output(path, compress):
+    if compress:
+        return gzip.open(path, 'wt', newline='', encoding='utf-8')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+# Function to write chunks as CSV; the summary footer is written as '#'-prefixed lines
+def write_csv(chunks, path, summary, compress=False):
+    with open_text_output(path, compress) as file:
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(to_export_rows(rows))
+            summary.add_rows(rows)
+        file.write("# summary: rows={} total={}\n".format(summary.row_count, summary.total))
+        for category, total in sorted(summary.category_totals.items()):
+            file.write("# category: {}={}\n".format(category, amount_to_decimal(total)))
+
+# Function to write chunks as JSON Lines; the summary footer is a final {"summary": ...} line.
+# Amounts are JSON numbers written from the centavo value, so the text is exact (e.g. 12.5, 1234.56).
+def write_jsonl(chunks, path, summary, compress=False):
+    with open_text_output(path, compress) as file:
+        for rows in chunks:
+            file.writelines(json.dumps({'id': expense_id, 'amount': amount_cents / 100, 'category': category, 'date': date,
+                                        'merchant': merchant, 'note': note}) + "\n"
+                            for expense_id, amount_cents, category, date, merchant, note in rows)
+            summary.add_rows(rows)
+        file.write(json.dumps({'summary': summary.as_dict()}) + "\n")
+
+# Function to write chunks as a Parquet file, one row group per chunk; the summary is stored in the
+# file's key-value metadata. Requires the optional pyarrow package.
+def write_parquet(chunks, path, summary, compress=False):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires the pyarrow package (pip install pyarrow)") from None
+    schema = pa.schema([('id', pa.int64()), ('amount', pa.decimal128(18, 2)), ('category', pa.string()), ('date', pa.string()),
+                        ('merchant', pa.string()), ('note', pa.string())])
+    with pq.ParquetWriter(path, schema, compression='zstd' if compress else 'snappy') as writer:
+        for rows in chunks:
+            columns = list(zip(*to_export_rows(rows)))
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema))
+            summary.add_rows(rows)
+        writer.add_key_value_metadata({'summary': json.dumps(summary.as_dict())})
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'parquet': write_parquet,
+}
+
+# Function to stream a user's expenses for an optional period to a file; returns the ExportSummary
+def export_expenses(repo, user_id, path, file_format='csv', start_date=None, end_date=None,
+                    compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    summary = ExportSummary()
+    chunks = repo.iter_expenses(user_id, start_date, end_date, chunk_size)
+    WRITERS[file_format](chunks, path, summary, compress)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a user's expenses")
+    parser.add_argument('output')
+    parser.add_argument('--user', required=True, help="username to export the expenses of")
+    parser.add_argument('--format', choices=sorted(WRITERS), help="output format (default: from file extension)")
+    parser.add_argument('--from', dest='start_date', help="first date to include")
+    parser.add_argument('--to', dest='end_date', help="last date to include")
+    parser.add_argument('--compress', action='store_true', help="gzip text formats, zstd for Parquet")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expense_tracker.db'))
+    args = parser.parse_args(argv)
+
+    file_format = args.format
+    if file_format is None:
+        extension = os.path.splitext(args.output[:-3] if args.output.endswith('.gz') else args.output)[1].lower().lstrip('.')
+        file_format = extension if extension in WRITERS else 'csv'
+    compress = args.compress or args.output.endswith('.gz')
+    try:
+        start_date = date.fromisoformat(normalize_date(args.start_date)) if args.start_date else None
+        end_date = date.fromisoformat(normalize_date(args.end_date)) if args.end_date else None
+    except ValueError as error:
+        parser.error(str(error))
+
+    repo = ExpenseRepository(args.db)
+    try:
+        user_id = repo.get_user_id(args.user)
+        if user_id is None:
+            parser.error("No such user: {}".format(args.user))
+        summary = export_expenses(repo, user_id, args.output, file_format, start_date, end_date, compress)
+    except RuntimeError as error:
+        print("Error: {}".format(error), file=sys.stderr)
+        return 1
+    finally:
+        repo.close()
+
+    print("Exported {} rows to {} (total {})".format(summary.row_count, args.output, summary.total))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# Streaming bulk importer for expenses exported from banks or other tools.
+# Reads CSV or JSON Lines one record at a time, validates amounts with the same rule as the
+# Add Expense form, normalizes dates to ISO-8601, and inserts with executemany in batches,
+# all inside a single transaction. Memory use does not depend on the size of the input file.
+# An import at least as big as the expenses table drops the table's indexes for the load and
+# builds them again at the end, which is cheaper than updating them row by row.
+#
+# Usage: python importer.py --user USERNAME FILE [--format csv|jsonl] [--batch-size N]
+import argparse
+import csv
+import json
+import operator
+import os
+import sys
+import time
+
+from money import parse_amount
+from repository import ExpenseRepository, MAX_MERCHANT_LENGTH, MAX_NOTE_LENGTH, clean_text_field, normalize_date
+
+# Rows inserted per executemany call
+IMPORT_BATCH_SIZE = 10000
+
+# Fields of a record, in the order the readers return them
+RECORD_FIELDS = ('amount', 'category', 'date', 'merchant', 'note')
+
+# Rejected rows kept in the report (all rejections are still counted)
+MAX_REPORTED_REJECTIONS = 100
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows_imported = 0
+        self.rows_rejected = 0
+        self.rejections = []  # (line number, reason) for the first MAX_REPORTED_REJECTIONS rejected rows
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_imported / self.elapsed if self.elapsed else 0.0
+
+    def reject(self, line_number, reason):
+        self.rows_rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append((line_number, reason))
+
+    def summary(self):
+        return "Imported {} rows, rejected {} rows in {:.2f}s ({:,.0f} rows/sec)".format(
+            self.rows_imported, self.rows_rejected, self.elapsed, self.rows_per_second)
+
+
+# Function to read records from a CSV file with a header row (amount, category, date, and optionally merchant and note).
+# Fields are picked out of each row by position, since building a dict per row costs as much as parsing it.
+def read_csv_records(file):
+    reader = csv.reader(file)
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = len(header)
+    # Fields the file has no column for are read from a None put after the header's columns
+    padded = not set(RECORD_FIELDS) <= set(header)
+    fields = operator.itemgetter(*(header.index(name) if name in header else columns for name in RECORD_FIELDS))
+    for row in reader:
+        if row:
+            if padded or len(row) < columns:
+                row = (row + [None] * columns)[:columns] + [None]
+            yield reader.line_num, fields(row)
+
+# Function to read records from a JSON Lines file, one object per line
+def read_jsonl_records(file):
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield line_number, None
+            continue
+        yield line_number, tuple(record.get(name) for name in RECORD_FIELDS) if isinstance(record, dict) else None
+
+READERS = {
+    'csv': read_csv_records,
+    'jsonl': read_jsonl_records,
+}
+
+# Function to validate one record; returns (amount_cents, category, date, merchant, note) or raises ValueError
+def parse_record(record):
+    if record is None:
+        raise ValueError("Malformed record")
+    amount, category, date, merchant, note = record
+    amount = "" if amount is None else str(amount).strip()
+    if not amount:
+        raise ValueError("Amount cannot be empty")
+    amount_cents = parse_amount(amount)
+    if not date:
+        raise ValueError("Date cannot be empty")
+    return (amount_cents, str(category or "").strip(), normalize_date(str(date)),
+            clean_text_field(merchant, MAX_MERCHANT_LENGTH, "Merchant") if merchant else None,
+            clean_text_field(note, MAX_NOTE_LENGTH, "Note") if note else None)
+
+# Function to stream-import a file of expenses for one user
+def import_expenses(repo, user_id, path, file_format=None, batch_size=IMPORT_BATCH_SIZE):
+    if file_format is None:
+        file_format = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json', '.ndjson') else 'csv'
+    read_records = READERS[file_format]
+
+    result = ImportResult()
+    started = time.perf_counter()
+    batch = []
+    category_ids = {}  # Category text -> id; unknown names become the user's own categories
+    dropped_indexes = None
+    with open(path, newline='', encoding='utf-8') as file, repo.bulk_load(user_id):
+        existing_rows = repo.estimated_expense_count()
+        for line_number, record in read_records(file):
+            try:
+                amount, category, date, merchant, note = parse_record(record)
+                category_id = category_ids.get(category)
+                if category_id is None:
+                    category_id = category_ids[category] = repo.get_or_create_category_id(user_id, category)
+            except ValueError as error:
+                result.reject(line_number, str(error))
+                continue
+            batch.append((user_id, amount, category_id, date, merchant, note))
+            if len(batch) >= batch_size:
+                if dropped_indexes is None and result.rows_imported + len(batch) >= existing_rows:
+                    dropped_indexes = repo.drop_expense_indexes()
+                repo.insert_expenses(batch)
+                result.rows_imported += len(batch)
+                batch = []
+        if batch:
+            repo.insert_expenses(batch)
+            result.rows_imported += len(batch)
+        if dropped_indexes:
+            repo.restore_expense_indexes(dropped_indexes)
+    repo.query_cache.invalidate(user_id)
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import expenses from CSV or JSON Lines")
+    parser.add_argument('file')
+    parser.add_argument('--user', required=True, help="username to import the expenses for")
+    parser.add_argument('--format', choices=sorted(READERS), help="input format (default: from file extension)")
+    parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expense_tracker.db'))
+    args = parser.parse_args(argv)
+
+    repo = ExpenseRepository(args.db)
+    try:
+        user_id = repo.get_user_id(args.user)
+        if user_id is None:
+            parser.error("No such user: {}".format(args.user))
+        result = import_expenses(repo, user_id, args.file, args.format, args.batch_size)
+    finally:
+        repo.close()
+
+    print(result.summary())
+    for line_number, reason in result.rejections:
+        print("  line {}: {}".format(line_number, reason))
+    return 0 if result.rows_rejected == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# Opt-in query instrumentation. When enabled, connections are created with InstrumentedConnection,
+# which times every execute/executemany, counts returned and affected rows and commits, and keeps
+# a log of slow statements. When disabled the plain sqlite3 classes are used, so there is no
+# overhead at all. Metrics can be exported as JSON or in the Prometheus text format. The app's
+# startup phases (imports, opening the database, first frame) are always recorded, as they cost
+# nothing to measure.
+import collections
+import json
+import re
+import sqlite3
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets; a final +Inf bucket is implied
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# Statements slower than this (seconds) are written to the slow query log
+DEFAULT_SLOW_QUERY_THRESHOLD = 0.05
+
+# Entries kept in the slow query log
+SLOW_QUERY_LOG_SIZE = 200
+
+
+# Function to normalize SQL text into a metric label (collapsed whitespace, bounded length)
+def statement_label(sql):
+    return re.sub(r"\s+", " ", sql).strip()[:200]
+
+
+class StatementStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    # Function to estimate a latency percentile as the upper bound of the bucket containing it
+    def percentile(self, fraction):
+        target = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max_time
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'total_seconds': self.total_time,
+            'mean_seconds': self.total_time / self.calls if self.calls else 0.0,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'max_seconds': self.max_time,
+            'rows': self.rows,
+            'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+class Metrics:
+    def __init__(self, slow_query_threshold=DEFAULT_SLOW_QUERY_THRESHOLD):
+        self.slow_query_threshold = slow_query_threshold
+        self._lock = threading.Lock()
+        self.startup = {}  # Startup phase -> seconds since process start; kept by reset()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.statements = collections.defaultdict(StatementStats)
+            self.commits = 0
+            self.slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def record_statement(self, sql, elapsed, rows):
+        label = statement_label(sql)
+        with self._lock:
+            stats = self.statements[label]
+            stats.record(elapsed)
+            stats.rows += rows
+            if elapsed >= self.slow_query_threshold:
+                self.slow_queries.append((time.strftime("%Y-%m-%d %H:%M:%S"), elapsed, label))
+
+    def record_rows(self, sql, rows):
+        with self._lock:
+            self.statements[statement_label(sql)].rows += rows
+
+    def record_commit(self):
+        with self._lock:
+            self.commits += 1
+
+    # Function to record that a startup phase finished `seconds` after the process started
+    def record_startup(self, phase, seconds):
+        with self._lock:
+            self.startup[phase] = seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'commits': self.commits,
+                'startup_seconds': dict(self.startup),
+                'slow_query_threshold_seconds': self.slow_query_threshold,
+                'statements': {label: stats.as_dict() for label, stats in self.statements.items()},
+                'slow_queries': [{'time': when, 'seconds': elapsed, 'statement': label}
+                                 for when, elapsed, label in self.slow_queries],
+            }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    # Function to render the metrics in the Prometheus text exposition format
+    def to_prometheus(self):
+        data = self.as_dict()
+        lines = [
+            "# HELP expense_tracker_commits_total Transactions committed; each one is a durable write to the database file or WAL.",
+            "# TYPE expense_tracker_commits_total counter",
+            "expense_tracker_commits_total {}".format(data['commits']),
+        ]
+        if data['startup_seconds']:
+            lines += [
+                "# HELP expense_tracker_startup_seconds Seconds from process start until each startup phase finished.",
+                "# TYPE expense_tracker_startup_seconds gauge",
+            ]
+            lines += ['expense_tracker_startup_seconds{{phase="{}"}} {}'.format(phase, seconds)
+                      for phase, seconds in data['startup_seconds'].items()]
+        lines += [
+            "# HELP expense_tracker_query_duration_seconds Statement latency.",
+            "# TYPE expense_tracker_query_duration_seconds histogram",
+        ]
+        rows = [
+            "# HELP expense_tracker_query_rows_total Rows returned or affected by statements.",
+            "# TYPE expense_tracker_query_rows_total counter",
+        ]
+        for label, stats in sorted(data['statements'].items()):
+            escaped = label.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in stats['buckets'].items():
+                cumulative += count
+                lines.append('expense_tracker_query_duration_seconds_bucket{{statement="{}",le="{}"}} {}'.format(escaped, bound, cumulative))
+            lines.append('expense_tracker_query_duration_seconds_sum{{statement="{}"}} {}'.format(escaped, stats['total_seconds']))
+            lines.append('expense_tracker_query_duration_seconds_count{{statement="{}"}} {}'.format(escaped, stats['calls']))
+            rows.append('expense_tracker_query_rows_total{{statement="{}"}} {}'.format(escaped, stats['rows']))
+        return "\n".join(lines + rows) + "\n"
+
+    # Function to render a short human-readable report, slowest statements (by total time) first
+    def summary(self, limit=20):
+        data = self.as_dict()
+        lines = ["Commits: {}".format(data['commits'])]
+        if data['startup_seconds']:
+            lines.append("Startup: " + ", ".join("{} after {:.0f} ms".format(phase.replace('_', ' '), seconds * 1000)
+                                                 for phase, seconds in data['startup_seconds'].items()))
+        lines += ["",
+                 "{:>8} {:>10} {:>10} {:>10} {:>10}  statement".format("calls", "total ms", "p50 ms", "p95 ms", "rows")]
+        ranked = sorted(data['statements'].items(), key=lambda item: item[1]['total_seconds'], reverse=True)
+        for label, stats in ranked[:limit]:
+            lines.append("{:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10}  {}".format(
+                stats['calls'], stats['total_seconds'] * 1000, stats['p50_seconds'] * 1000,
+                stats['p95_seconds'] * 1000, stats['rows'], label[:100]))
+        lines += ["", "Slow queries (>= {:.0f} ms):".format(data['slow_query_threshold_seconds'] * 1000)]
+        for entry in data['slow_queries'][-limit:]:
+            lines.append("  {} {:>8.1f} ms  {}".format(entry['time'], entry['seconds'] * 1000, entry['statement'][:100]))
+        return "\n".join(lines)
+
+
+# Process-wide metrics, filled in by connections opened while instrumentation is enabled
+METRICS = Metrics()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _last_sql = ""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._last_sql = sql
+            METRICS.record_statement(sql, time.perf_counter() - started, max(self.rowcount, 0))
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._last_sql = sql
+            METRICS.record_statement(sql, time.perf_counter() - started, max(self.rowcount, 0))
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            METRICS.record_rows(self._last_sql, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        METRICS.record_rows(self._last_sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        METRICS.record_rows(self._last_sql, len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # COMMITs issued by the sqlite3 module itself (including `with conn:`) only show up here
+        self.set_trace_callback(self._trace)
+
+    @staticmethod
+    def _trace(statement):
+        if statement.startswith("COMMIT"):
+            METRICS.record_commit()
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute does not go through cursor(), so route it explicitly
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Function to get the connection factory to use: instrumented if enabled, otherwise plain sqlite3
+def connection_factory(enabled, slow_query_threshold=None):
+    if not enabled:
+        return sqlite3.Connection
+    if slow_query_threshold is not None:
+        METRICS.slow_query_threshold = slow_query_threshold
+    return InstrumentedConnection
@@ -0,0 +1,160 @@
+# Load test for server.py: many concurrent clients on localhost, each registering an account, logging
+# in and then running a mix of expense adds, list pages, statistics and deletes through client.py.
+# Prints the latency percentiles of each operation, overall throughput and the server's write batching.
+#
+# Usage:
+#   python loadtest.py [--clients 200] [--requests 50]              # serves a temporary database itself
+#   python loadtest.py --url http://127.0.0.1:8765 --clients 200    # against a running server
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import datagen
+from client import RemoteRepository
+from repository import ExpenseRepository, ExpenseFilter
+from server import ExpenseServer, SERVER_WORKERS
+
+# Relative frequency of each operation after login
+OPERATION_WEIGHTS = {
+    'add_expense': 50,
+    'fetch_expense_page': 25,
+    'fetch_statistics': 10,
+    'fetch_filter_statistics': 5,
+    'delete_expense': 10,
+}
+
+# Expenses fetched per list page
+PAGE_SIZE = 50
+
+
+# Function to run one simulated client; records (operation, seconds) into timings and failures into errors
+def run_client(url, number, run_id, requests, seed, start, timings, errors):
+    rng = random.Random(seed + number)
+    repo = RemoteRepository(url)
+    record = timings.append
+
+    def timed(operation, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error:
+            errors.append((operation, repr(error)))
+            return None
+        record((operation, time.perf_counter() - started))
+        return result
+
+    username = "load-{}-{}".format(run_id, number)
+    start.wait()
+    timed('register_user', repo.register_user, "Load", "Test", username + "@example.com", "30", "Other", "09000000000",
+          username, "password")
+    user_id = timed('authenticate', repo.authenticate, username, "password")
+    if user_id is None:
+        return
+    categories = [category_id for category_id, _ in repo.list_categories(user_id)]
+    expense_ids = []
+    operations, weights = zip(*OPERATION_WEIGHTS.items())
+    for _ in range(requests):
+        operation = rng.choices(operations, weights)[0]
+        if operation == 'delete_expense' and not expense_ids:
+            operation = 'add_expense'
+        if operation == 'add_expense':
+            day = date.today() - timedelta(days=rng.randrange(365))
+            expense_id = timed(operation, repo.add_expense, user_id, rng.randrange(100, 500000), rng.choice(categories), day.isoformat())
+            if expense_id is not None:
+                expense_ids.append(expense_id)
+        elif operation == 'delete_expense':
+            timed(operation, repo.delete_expense, expense_ids.pop(rng.randrange(len(expense_ids))))
+        elif operation == 'fetch_expense_page':
+            timed(operation, repo.fetch_expense_page, user_id, limit=PAGE_SIZE)
+        elif operation == 'fetch_statistics':
+            timed(operation, repo.fetch_statistics, user_id)
+        else:
+            timed(operation, repo.fetch_filter_statistics, user_id,
+                  ExpenseFilter(start_date=date.today().replace(day=1), category_ids=(rng.choice(categories),)))
+    repo.close()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+# Function to run the load test against url; returns the results as a dict
+def run(url, clients, requests, seed):
+    timings, errors = [], []
+    start = threading.Barrier(clients + 1)
+    run_id = "{:x}".format(int(time.time() * 1000))
+    threads = [threading.Thread(target=run_client, args=(url, number, run_id, requests, seed, start, timings, errors))
+               for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    by_operation = defaultdict(list)
+    for operation, seconds in timings:
+        by_operation[operation].append(seconds)
+    results = {'clients': clients, 'requests_per_client': requests, 'elapsed': elapsed,
+               'throughput': len(timings) / elapsed, 'errors': len(errors), 'operations': {}}
+    print("{:<26} {:>8} {:>10} {:>10} {:>10}".format("operation", "count", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for operation, values in sorted(by_operation.items()):
+        values.sort()
+        summary = {'count': len(values), 'median': statistics.median(values),
+                   'p95': percentile(values, 0.95), 'p99': percentile(values, 0.99)}
+        results['operations'][operation] = summary
+        print("{:<26} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            operation, summary['count'], summary['median'] * 1000, summary['p95'] * 1000, summary['p99'] * 1000))
+    print("{} requests from {} clients in {:.1f}s ({:.0f} requests/s), {} errors".format(
+        len(timings), clients, elapsed, results['throughput'], len(errors)))
+    for operation, error in errors[:10]:
+        print("  {}: {}".format(operation, error))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the expense tracker server")
+    parser.add_argument('--url', help="server to test (default: start one on a temporary database)")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=50, help="requests per client after logging in")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="request threads of the temporary server")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    server = repo = None
+    url = args.url
+    if url is None:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="expense-tracker-load-"), "load.db")
+        repo = ExpenseRepository(db_path, password_iterations=datagen.GENERATED_PASSWORD_ITERATIONS)
+        server = ExpenseServer(('127.0.0.1', 0), repo, workers=args.workers)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}".format(server.server_address[1])
+        print("Serving {} on {} with {} workers".format(db_path, url, args.workers))
+    try:
+        results = run(url, args.clients, args.requests, args.seed)
+        if server is not None:
+            writer = server.writer
+            results['write_batches'], results['writes'] = writer.batches, writer.writes
+            print("{} expense writes committed in {} transactions ({:.1f} per commit)".format(
+                writer.writes, writer.batches, writer.writes / max(writer.batches, 1)))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            repo.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
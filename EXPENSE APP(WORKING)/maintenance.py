@@ -0,0 +1,66 @@
+# Database maintenance commands.
+#
+# Usage:
+#   python maintenance.py cleanup           # remove orphaned expenses and VACUUM the file
+#   python maintenance.py rebuild-rollups   # rebuild the rollup tables from the raw expenses
+#   python maintenance.py check-rollups     # verify the rollup tables against the raw expenses
+#   python maintenance.py materialize-recurring  # create due recurring expenses for all users (e.g. daily from cron)
+#   python maintenance.py optimize-search   # merge the search index into one segment (e.g. after a large import)
+import argparse
+import os
+import sys
+
+from repository import ExpenseRepository
+
+
+def cleanup(repo):
+    removed, reclaimed = repo.purge_orphans_and_vacuum()
+    print("Removed {} orphaned expenses and reclaimed {:,} bytes".format(removed, reclaimed))
+    return 0
+
+def rebuild_rollups(repo):
+    repo.rebuild_rollups()
+    print("Rollups rebuilt")
+    return 0
+
+def check_rollups(repo):
+    problems = repo.check_rollups()
+    for problem in problems:
+        print(problem)
+    print("{} mismatches found".format(len(problems)) if problems else "Rollups match the expense records")
+    return 1 if problems else 0
+
+def materialize_recurring(repo):
+    created = repo.materialize_recurring()
+    print("Created {} recurring expenses".format(created))
+    return 0
+
+def optimize_search(repo):
+    repo.optimize_search_index()
+    print("Search index optimized")
+    return 0
+
+COMMANDS = {
+    'cleanup': cleanup,
+    'rebuild-rollups': rebuild_rollups,
+    'check-rollups': check_rollups,
+    'materialize-recurring': materialize_recurring,
+    'optimize-search': optimize_search,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Expense tracker database maintenance")
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expense_tracker.db'))
+    args = parser.parse_args(argv)
+
+    repo = ExpenseRepository(args.db)
+    try:
+        return COMMANDS[args.command](repo)
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
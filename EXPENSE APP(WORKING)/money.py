@@ -0,0 +1,34 @@
+# Money values. Amounts are stored, summed and passed around as integer centavos (minor units), so
+# totals are exact at any size; they are parsed from text on input and formatted only for display.
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CURRENCY_SYMBOL = "₱"
+
+# Minor units per peso
+MINOR_UNITS = 100
+
+# Function to convert an amount ('12.5', 12.5, Decimal('12.50'), ...) to integer centavos, rounding
+# half up to the nearest centavo; raises ValueError if it is not a finite number
+def parse_amount(value):
+    text = str(value).strip()
+    # Fast path for plain 'digits[.dd]' text, which is nearly every value an import sees
+    negative = text.startswith('-')
+    whole, _, fraction = (text[1:] if negative else text).partition('.')
+    if whole.isdecimal() and len(fraction) <= 2 and (not fraction or fraction.isdecimal()):
+        cents = int(whole) * MINOR_UNITS + int(fraction.ljust(2, '0'))
+        return -cents if negative else cents
+    try:
+        amount = Decimal(text)
+    except InvalidOperation:
+        raise ValueError("Invalid amount: {!r}".format(value)) from None
+    if not amount.is_finite():
+        raise ValueError("Invalid amount: {!r}".format(value))
+    return int((amount * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+# Function to convert integer centavos to an exact Decimal in pesos (e.g. 1250 -> Decimal('12.50'))
+def amount_to_decimal(cents):
+    return Decimal(cents).scaleb(-2)
+
+# Function to format integer centavos for display, e.g. 123456 -> '₱1,234.56'
+def format_amount(cents):
+    return "{}{}{:,.2f}".format("-" if cents < 0 else "", CURRENCY_SYMBOL, amount_to_decimal(abs(cents)))
@@ -0,0 +1,37 @@
+# Salted password hashing with PBKDF2-HMAC-SHA256. Hashes are stored as
+# 'pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>', so the work factor can be raised later:
+# needs_rehash() tells the caller to re-hash a password with the current setting after login.
+import hashlib
+import hmac
+import os
+
+ALGORITHM = 'pbkdf2_sha256'
+
+# Default work factor; override with the EXPENSE_TRACKER_PASSWORD_ITERATIONS environment variable
+DEFAULT_ITERATIONS = int(os.environ.get('EXPENSE_TRACKER_PASSWORD_ITERATIONS', 600000))
+
+SALT_BYTES = 16
+
+
+# Function to hash a password with a fresh random salt
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return "{}${}${}${}".format(ALGORITHM, iterations, salt.hex(), digest.hex())
+
+# Function to check a password against a stored hash in constant time
+def verify_password(password, stored_hash):
+    try:
+        algorithm, iterations, salt, expected = stored_hash.split('$')
+        iterations = int(iterations)
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != ALGORITHM:
+        return False
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), bytes.fromhex(salt), iterations)
+    return hmac.compare_digest(digest.hex(), expected)
+
+# Function to tell whether a stored hash uses a different work factor than the current one
+def needs_rehash(stored_hash, iterations=DEFAULT_ITERATIONS):
+    parts = stored_hash.split('$')
+    return len(parts) != 4 or parts[0] != ALGORITHM or parts[1] != str(iterations)
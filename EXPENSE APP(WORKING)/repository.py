@@ -0,0 +1,1195 @@
+# Data-access layer for the expense tracker. Owns the SQLite connection, schema creation,
+# migrations and every query, and has no dependency on Tk, so it can be used headless
+# (scripts, benchmarks, importers) as well as by the GUI in expenseApp.py.
+import re
+import sqlite3
+import calendar
+import contextlib
+import functools
+from collections import namedtuple
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+from cache import QueryCache
+from connection import ConnectionManager
+from instrumentation import connection_factory
+from money import parse_amount
+from passwords import DEFAULT_ITERATIONS, hash_password, needs_rehash, verify_password
+
+# Built-in expense categories, shared by all users; users can add their own on top of these
+EXPENSE_CATEGORIES = ("Food", "Transportation", "Shopping", "Entertainment", "Utilities", "Health", "Other")
+
+# Placeholder shown in the Add Expense form's category dropdown; never a valid category name
+CATEGORY_PLACEHOLDER = "Choose Category"
+
+# Longest allowed name for a user-defined category
+MAX_CATEGORY_NAME_LENGTH = 40
+
+# Number of expenses fetched per page by fetch_expense_page
+EXPENSE_PAGE_SIZE = 100
+
+# Number of users fetched per page by list_users_page
+USER_PAGE_SIZE = 50
+
+# Columns the admin user list can be sorted by, and the SQL expression for each. Text columns sort
+# case-insensitively, in the order of their idx_users_*_nocase indexes; the totals sort in the order of
+# their idx_user_expense_totals_* indexes (see list_users_page).
+USER_SORT_COLUMNS = {
+    'id': "u.id",
+    'first_name': "u.first_name COLLATE NOCASE",
+    'last_name': "u.last_name COLLATE NOCASE",
+    'email': "u.email COLLATE NOCASE",
+    'username': "u.username COLLATE NOCASE",
+    'expense_count': "t.expense_count",
+    'total_spent': "t.total_cents",
+}
+
+# Sorts by a user_expense_totals column; users without expenses have no row there and sort as 0
+USER_TOTAL_SORTS = ('expense_count', 'total_spent')
+
+# Expenses deleted per transaction when purging a user's data, so the write lock is released between chunks
+PURGE_CHUNK_SIZE = 5000
+
+# Number of rows fetched per chunk by iter_expenses
+EXPORT_CHUNK_SIZE = 5000
+
+# How often a recurring expense repeats
+RECURRING_FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+# Recurring expense rules caught up per transaction by materialize_recurring
+RECURRING_BATCH_SIZE = 200
+
+# Longest allowed merchant name and note on an expense
+MAX_MERCHANT_LENGTH = 80
+MAX_NOTE_LENGTH = 500
+
+# Number of hits fetched per page by search_expenses
+SEARCH_PAGE_SIZE = 50
+
+# Validation function for amount entry (an empty value is allowed while typing)
+def validate_amount(value):
+    if value == "":
+        return True
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+# Function to normalize a date string to ISO-8601 'YYYY-MM-DD'; raises ValueError if unrecognized.
+# Accepts 'YYYY-MM-DD', 'm/d/Y' and 'm/d/y' (two-digit years follow strptime's %y rule).
+# Cached because imports and migrations see the same few thousand dates over and over.
+@functools.lru_cache(maxsize=8192)
+def normalize_date(text):
+    text = text.strip()
+    try:
+        return date.fromisoformat(text).isoformat()
+    except ValueError:
+        pass
+    parts = text.split('/')
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        month, day, year = (int(part) for part in parts)
+        if len(parts[2]) <= 2:
+            year += 2000 if year < 69 else 1900
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            pass
+    raise ValueError("Unrecognized date: {!r}".format(text))
+
+# Function to tidy an optional free-text field of an expense (merchant, note): collapses whitespace and
+# returns None if blank. Raises ValueError with a user-facing message if it is longer than max_length.
+def clean_text_field(value, max_length, label):
+    text = " ".join(str(value).split()) if value is not None else ""
+    if len(text) > max_length:
+        raise ValueError("{} can be at most {} characters".format(label, max_length))
+    return text or None
+
+# Function to build the FTS5 query for a user's search text: each word must match the start of a word
+# in the merchant or note (so hits narrow as the user types), within the user's own expenses. Words
+# are quoted, so operators and column filters typed by the user are taken literally. Returns None if
+# the text has no words.
+def search_match_expression(user_id, text):
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return "user_id : {} AND {{merchant note}} : ({})".format(int(user_id), " ".join('"{}"*'.format(word) for word in words))
+
+# Filter for the main window's expense list and statistics. Every field may be None (unrestricted);
+# start_date and end_date are dates, category_ids a tuple, so a filter can be used as a cache key.
+# min_amount and max_amount are in centavos.
+class ExpenseFilter(namedtuple('ExpenseFilter', 'start_date end_date category_ids min_amount max_amount',
+                               defaults=(None, None, None, None, None))):
+    __slots__ = ()
+
+    # Function to tell whether the filter restricts anything at all
+    def is_empty(self):
+        return all(value is None for value in self)
+
+    # Function to build the SQL conditions and parameters for the filter, ANDed onto a WHERE clause.
+    # The date range (and category_ids, via idx_expenses_user_category_date) is what the query seeks
+    # on; the amount range is checked per row.
+    def clause(self):
+        conditions, params = [], []
+        if self.start_date is not None:
+            conditions.append("date >= ?")
+            params.append(self.start_date.isoformat())
+        if self.end_date is not None:
+            conditions.append("date <= ?")
+            params.append(self.end_date.isoformat())
+        if self.category_ids:
+            conditions.append("category_id IN ({})".format(", ".join("?" * len(self.category_ids))))
+            params.extend(self.category_ids)
+        if self.min_amount is not None:
+            conditions.append("amount_cents >= ?")
+            params.append(self.min_amount)
+        if self.max_amount is not None:
+            conditions.append("amount_cents <= ?")
+            params.append(self.max_amount)
+        return "".join(" AND " + condition for condition in conditions), params
+
+    # Function to check a single expense against the filter, e.g. one that was just added
+    def matches(self, amount, category_id, expense_date):
+        return ((self.start_date is None or expense_date >= self.start_date.isoformat())
+                and (self.end_date is None or expense_date <= self.end_date.isoformat())
+                and (not self.category_ids or category_id in self.category_ids)
+                and (self.min_amount is None or amount >= self.min_amount)
+                and (self.max_amount is None or amount <= self.max_amount))
+
+# Base schema, as created by the first version of the app
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, email TEXT UNIQUE, age INTEGER, sex TEXT, contact_number TEXT, username TEXT UNIQUE, password TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS expenses
+       (id INTEGER PRIMARY KEY, user_id INTEGER, amount REAL, category TEXT, date TEXT)''',
+]
+
+# Rollup maintenance. Every write to expenses goes through apply_rollup_deltas in the
+# same transaction, with (user_id, date, category_id, amount_cents, count) tuples; deletes pass
+# negative amounts and counts. Deltas are pre-aggregated so batches cost one upsert per key.
+ROLLUP_UPSERTS = {
+    'daily': "INSERT INTO expense_daily_totals (user_id, day, total_cents, expense_count) VALUES (?, ?, ?, ?) "
+             "ON CONFLICT (user_id, day) DO UPDATE SET total_cents=total_cents+excluded.total_cents, expense_count=expense_count+excluded.expense_count",
+    'monthly': "INSERT INTO expense_monthly_totals (user_id, month, total_cents, expense_count) VALUES (?, ?, ?, ?) "
+               "ON CONFLICT (user_id, month) DO UPDATE SET total_cents=total_cents+excluded.total_cents, expense_count=expense_count+excluded.expense_count",
+    'category': "INSERT INTO expense_category_totals (user_id, month, category_id, total_cents, expense_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, month, category_id) DO UPDATE SET total_cents=total_cents+excluded.total_cents, expense_count=expense_count+excluded.expense_count",
+    'user': "INSERT INTO user_expense_totals (user_id, total_cents, expense_count) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET total_cents=total_cents+excluded.total_cents, expense_count=expense_count+excluded.expense_count",
+}
+
+# Rollup tables, in the order they are maintained
+ROLLUP_TABLES = ('expense_daily_totals', 'expense_monthly_totals', 'expense_category_totals', 'user_expense_totals')
+
+# Deletes of a single rollup key once its last expense is gone, by primary key so they never scan
+ROLLUP_DELETES = {
+    'daily': "DELETE FROM expense_daily_totals WHERE user_id=? AND day=? AND expense_count <= 0",
+    'monthly': "DELETE FROM expense_monthly_totals WHERE user_id=? AND month=? AND expense_count <= 0",
+    'category': "DELETE FROM expense_category_totals WHERE user_id=? AND month=? AND category_id=? AND expense_count <= 0",
+    'user': "DELETE FROM user_expense_totals WHERE user_id=? AND expense_count <= 0",
+}
+
+def apply_rollup_deltas(cursor, deltas):
+    # Collapse to one entry per (user, day, category) first; that set is small even for big batches
+    by_day_category = {}
+    for user_id, date, category, amount, count in deltas:
+        key = (user_id, date, category)
+        total, total_count = by_day_category.get(key, (0, 0))
+        by_day_category[key] = (total + amount, total_count + count)
+    daily, monthly, by_category, by_user = {}, {}, {}, {}
+    for (user_id, date, category), (amount, count) in by_day_category.items():
+        month = date[:7]
+        for table, key in ((daily, (user_id, date)), (monthly, (user_id, month)), (by_category, (user_id, month, category)),
+                           (by_user, (user_id,))):
+            total, total_count = table.get(key, (0, 0))
+            table[key] = (total + amount, total_count + count)
+    for name, table in (('daily', daily), ('monthly', monthly), ('category', by_category), ('user', by_user)):
+        cursor.executemany(ROLLUP_UPSERTS[name], [key + value for key, value in table.items()])
+        # Drop the keys this batch removed the last expense of, so the rollups stay as small as the data.
+        # Only keys with a negative count delta can have reached zero.
+        cursor.executemany(ROLLUP_DELETES[name], [key for key, (_, count) in table.items() if count < 0])
+
+# Rollup definitions in terms of the raw expenses table
+ROLLUP_QUERIES = {
+    'expense_daily_totals': ("user_id, day, total_cents, expense_count",
+                             "SELECT user_id, date, SUM(amount_cents), COUNT(*) FROM expenses {where} GROUP BY user_id, date"),
+    'expense_monthly_totals': ("user_id, month, total_cents, expense_count",
+                               "SELECT user_id, substr(date, 1, 7), SUM(amount_cents), COUNT(*) FROM expenses {where} "
+                               "GROUP BY user_id, substr(date, 1, 7)"),
+    'expense_category_totals': ("user_id, month, category_id, total_cents, expense_count",
+                                "SELECT user_id, substr(date, 1, 7), category_id, SUM(amount_cents), COUNT(*) FROM expenses {where} "
+                                "GROUP BY user_id, substr(date, 1, 7), category_id"),
+    'user_expense_totals': ("user_id, total_cents, expense_count",
+                            "SELECT user_id, SUM(amount_cents), COUNT(*) FROM expenses {where} GROUP BY user_id"),
+}
+
+# Query wrapper that puts category names on per-category_id totals; the inner query must return
+# category_id, total and expense_count columns. Grouping on the small integer id, then looking up
+# the names of the few resulting rows, is cheaper than grouping on the names.
+CATEGORY_TOTALS_WITH_NAMES = ("SELECT c.name, t.total, t.expense_count FROM ({}) t JOIN categories c ON c.id = t.category_id "
+                              "ORDER BY t.total DESC")
+
+# Function to rebuild the rollup tables from the raw expenses (all users, or a single user)
+def rebuild_rollups(cursor, user_id=None):
+    where = "WHERE user_id=?" if user_id is not None else ""
+    params = (user_id,) if user_id is not None else ()
+    for table, (columns, query) in ROLLUP_QUERIES.items():
+        cursor.execute("DELETE FROM {} {}".format(table, where), params)
+        cursor.execute("INSERT INTO {} ({}) {}".format(table, columns, query.format(where=where)), params)
+
+# Condition on expenses that holds for a date that is not a real day written as 'YYYY-MM-DD'
+INVALID_DATE_CONDITION = "date IS NULL OR date(date, '+0 days') IS NOT date"  # The modifier rolls Feb 30 over to March
+
+# Function to compare the rollup tables with the raw expenses; returns a list of mismatch descriptions.
+# Totals are integer centavos, so they must match exactly. Expenses with an invalid date, which the
+# rollups cannot place, and those set aside by migrate_set_aside_invalid_dates are reported as well.
+def check_rollups(cursor):
+    problems = []
+    invalid = cursor.execute("SELECT COUNT(*) FROM expenses WHERE {}".format(INVALID_DATE_CONDITION)).fetchone()[0]
+    if invalid:
+        problems.append("expenses: {} rows have a date that is not YYYY-MM-DD".format(invalid))
+    set_aside = cursor.execute("SELECT COUNT(*) FROM expenses_invalid_dates").fetchone()[0]
+    if set_aside:
+        problems.append("expenses_invalid_dates: {} expenses with unreadable dates need fixing by hand".format(set_aside))
+    for table, (columns, query) in ROLLUP_QUERIES.items():
+        key_columns = columns.split(", ")[:-2]
+        keys = " AND ".join("r.{0} = e.{0}".format(column) for column in key_columns)
+        cursor.execute(
+            "WITH e ({columns}) AS ({query}) "
+            "SELECT {key_list}, e.total_cents, r.total_cents, e.expense_count, r.expense_count FROM e LEFT JOIN {table} r ON {keys} "
+            "WHERE r.total_cents IS NULL OR r.total_cents != e.total_cents OR r.expense_count != e.expense_count "
+            "UNION ALL "
+            "SELECT {r_key_list}, NULL, r.total_cents, NULL, r.expense_count FROM {table} r "
+            "WHERE NOT EXISTS (SELECT 1 FROM e WHERE {keys})".format(
+                columns=columns, query=query.format(where=""), table=table, keys=keys,
+                key_list=", ".join("e." + column for column in key_columns),
+                r_key_list=", ".join("r." + column for column in key_columns)))
+        for row in cursor.fetchall():
+            key = row[:len(key_columns)]
+            expected_total, actual_total, expected_count, actual_count = row[len(key_columns):]
+            problems.append("{} {}: expected total={} count={}, found total={} count={}".format(
+                table, key, expected_total, expected_count, actual_total, actual_count))
+    return problems
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+def migrate_dates_to_iso(cursor):
+    # Dates used to be stored as 'm/d/Y' text, which does not sort in date order.
+    # Rewrite them as ISO-8601 'YYYY-MM-DD' so range queries compare correctly.
+    cursor.execute("SELECT id, date FROM expenses WHERE date NOT LIKE '____-__-__'")
+    updates = []
+    for expense_id, date_text in cursor.fetchall():
+        try:
+            iso_date = datetime.strptime(date_text, '%m/%d/%Y').date().isoformat()
+        except (TypeError, ValueError):
+            continue  # Moved out of expenses by migrate_set_aside_invalid_dates
+        updates.append((iso_date, expense_id))
+    cursor.executemany("UPDATE expenses SET date=? WHERE id=?", updates)
+    # Composite index so per-user period queries become index range scans
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_expenses_user_date ON expenses (user_id, date)")
+
+def migrate_create_rollups(cursor):
+    # Per-user rollup tables so dashboard totals are constant-time lookups
+    cursor.execute('''CREATE TABLE IF NOT EXISTS expense_daily_totals
+                      (user_id INTEGER, day TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, day)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS expense_monthly_totals
+                      (user_id INTEGER, month TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, month)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS expense_category_totals
+                      (user_id INTEGER, month TEXT, category TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, month, category)) WITHOUT ROWID''')
+    return True
+
+def migrate_admin_user_list(cursor):
+    # Per-user totals for the admin dashboard, and case-insensitive indexes for prefix search
+    cursor.execute('''CREATE TABLE IF NOT EXISTS user_expense_totals
+                      (user_id INTEGER PRIMARY KEY, total REAL, expense_count INTEGER)''')
+    for column in ('username', 'email', 'first_name', 'last_name'):
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_{0}_nocase ON users ({0} COLLATE NOCASE)".format(column))
+    return True
+
+def migrate_cascade_user_deletes(cursor):
+    # Deleting a user used to leave their expenses behind. Remove existing orphans, then rebuild
+    # expenses and the rollup tables with foreign keys that cascade user deletes (SQLite cannot
+    # add a foreign key to an existing table). NOT EXISTS, unlike NOT IN, also catches a NULL user_id.
+    cursor.execute("DELETE FROM expenses WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.id = expenses.user_id)")
+    cursor.execute('''CREATE TABLE expenses_new
+                      (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                       amount REAL, category TEXT, date TEXT)''')
+    cursor.execute("INSERT INTO expenses_new (id, user_id, amount, category, date) SELECT id, user_id, amount, category, date FROM expenses")
+    cursor.execute("DROP TABLE expenses")
+    cursor.execute("ALTER TABLE expenses_new RENAME TO expenses")
+    cursor.execute("CREATE INDEX idx_expenses_user_date ON expenses (user_id, date)")
+    for table in ROLLUP_TABLES:
+        cursor.execute("DROP TABLE {}".format(table))
+    cursor.execute('''CREATE TABLE expense_daily_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, day TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, day)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE expense_monthly_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, month TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, month)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE expense_category_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, month TEXT, category TEXT, total REAL, expense_count INTEGER,
+                       PRIMARY KEY (user_id, month, category)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE user_expense_totals
+                      (user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE, total REAL, expense_count INTEGER)''')
+    return True
+
+# PBKDF2 work factor for the passwords hashed by migrate_hash_passwords. Hashing every account at the full
+# work factor would hold the upgrade (and the write lock) for hours on a large database; authenticate
+# re-hashes each one with the current work factor at its next login, as needs_rehash reports.
+MIGRATED_PASSWORD_ITERATIONS = 1000
+
+def migrate_hash_passwords(cursor):
+    # Passwords were stored in plaintext. Replace them with salted hashes, and add a covering
+    # index so the login lookup by username never touches the table itself.
+    cursor.execute("ALTER TABLE users RENAME COLUMN password TO password_hash")
+    cursor.execute("SELECT id, password_hash FROM users")
+    cursor.executemany("UPDATE users SET password_hash=? WHERE id=?",
+                       [(hash_password(password or "", MIGRATED_PASSWORD_ITERATIONS), user_id)
+                        for user_id, password in cursor.fetchall()])
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_login ON users (username, id, password_hash)")
+
+def migrate_amounts_to_cents(cursor):
+    # Amounts were REAL pesos, so sums drifted and large totals lost centavos. Store them as
+    # INTEGER centavos instead, in expenses and in every rollup total. Converted in Python
+    # (rounding half up on the decimal text) since ROUND(amount * 100) misrounds values like 1.005.
+    cursor.connection.create_function("to_cents", 1, lambda amount: parse_amount(str(amount)) if amount is not None else 0,
+                                      deterministic=True)
+    cursor.execute('''CREATE TABLE expenses_new
+                      (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                       amount_cents INTEGER NOT NULL, category TEXT, date TEXT)''')
+    cursor.execute("INSERT INTO expenses_new (id, user_id, amount_cents, category, date) "
+                   "SELECT id, user_id, to_cents(amount), category, date FROM expenses")
+    cursor.execute("DROP TABLE expenses")
+    cursor.execute("ALTER TABLE expenses_new RENAME TO expenses")
+    cursor.execute("CREATE INDEX idx_expenses_user_date ON expenses (user_id, date)")
+    for table in ROLLUP_TABLES:
+        cursor.execute("DROP TABLE {}".format(table))
+    cursor.execute('''CREATE TABLE expense_daily_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, day TEXT, total_cents INTEGER, expense_count INTEGER,
+                       PRIMARY KEY (user_id, day)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE expense_monthly_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, month TEXT, total_cents INTEGER, expense_count INTEGER,
+                       PRIMARY KEY (user_id, month)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE expense_category_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, month TEXT, category TEXT, total_cents INTEGER,
+                       expense_count INTEGER, PRIMARY KEY (user_id, month, category)) WITHOUT ROWID''')
+    cursor.execute('''CREATE TABLE user_expense_totals
+                      (user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE, total_cents INTEGER, expense_count INTEGER)''')
+    return True
+
+def migrate_normalize_categories(cursor):
+    # Categories were free text on every row, including the form's "" and "Choose Category"
+    # placeholders. Move them to a categories table: the built-in ones are shared (user_id NULL),
+    # any other text already in use becomes a category of the user who used it, and the
+    # placeholders become "Other". Expenses then reference categories by integer id.
+    cursor.execute('''CREATE TABLE categories
+                      (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, name TEXT NOT NULL)''')
+    cursor.execute("CREATE UNIQUE INDEX idx_categories_owner_name ON categories (IFNULL(user_id, 0), name COLLATE NOCASE)")
+    cursor.executemany("INSERT INTO categories (user_id, name) VALUES (NULL, ?)", [(name,) for name in EXPENSE_CATEGORIES])
+    cursor.execute("INSERT INTO categories (user_id, name) "
+                   "SELECT user_id, MIN(trim(category)) FROM expenses "
+                   "WHERE trim(IFNULL(category, '')) NOT IN ('', ?) "
+                   "AND trim(category) COLLATE NOCASE NOT IN (SELECT name FROM categories WHERE user_id IS NULL) "
+                   "GROUP BY user_id, trim(category) COLLATE NOCASE", (CATEGORY_PLACEHOLDER,))
+    cursor.execute('''CREATE TABLE expenses_new
+                      (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                       amount_cents INTEGER NOT NULL, category_id INTEGER NOT NULL REFERENCES categories (id), date TEXT)''')
+    cursor.execute("INSERT INTO expenses_new (id, user_id, amount_cents, category_id, date) "
+                   "SELECT e.id, e.user_id, e.amount_cents, "
+                   "COALESCE((SELECT c.id FROM categories c WHERE c.name = trim(e.category) COLLATE NOCASE "
+                   "          AND (c.user_id IS NULL OR c.user_id = e.user_id) ORDER BY c.user_id IS NOT NULL LIMIT 1), "
+                   "         (SELECT id FROM categories WHERE user_id IS NULL AND name = 'Other')), e.date "
+                   "FROM expenses e")
+    cursor.execute("DROP TABLE expenses")
+    cursor.execute("ALTER TABLE expenses_new RENAME TO expenses")
+    cursor.execute("CREATE INDEX idx_expenses_user_date ON expenses (user_id, date)")
+    cursor.execute("CREATE INDEX idx_expenses_user_category_date ON expenses (user_id, category_id, date)")
+    cursor.execute("DROP TABLE expense_category_totals")
+    cursor.execute('''CREATE TABLE expense_category_totals
+                      (user_id INTEGER REFERENCES users (id) ON DELETE CASCADE, month TEXT, category_id INTEGER, total_cents INTEGER,
+                       expense_count INTEGER, PRIMARY KEY (user_id, month, category_id)) WITHOUT ROWID''')
+    return True
+
+def migrate_recurring_and_budgets(cursor):
+    # Recurring expense rules, materialized into expenses up to the current date. Each materialized
+    # expense remembers its rule; the unique (recurring_id, date) index makes re-running a no-op.
+    cursor.execute('''CREATE TABLE recurring_expenses
+                      (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                       amount_cents INTEGER NOT NULL, category_id INTEGER NOT NULL REFERENCES categories (id),
+                       frequency TEXT NOT NULL CHECK (frequency IN ('daily', 'weekly', 'monthly')),
+                       start_date TEXT NOT NULL, end_date TEXT, next_date TEXT NOT NULL)''')
+    cursor.execute("CREATE INDEX idx_recurring_expenses_next_date ON recurring_expenses (next_date)")
+    cursor.execute("CREATE INDEX idx_recurring_expenses_user ON recurring_expenses (user_id, next_date)")
+    cursor.execute("ALTER TABLE expenses ADD COLUMN recurring_id INTEGER REFERENCES recurring_expenses (id) ON DELETE SET NULL")
+    cursor.execute("CREATE UNIQUE INDEX idx_expenses_recurring_date ON expenses (recurring_id, date) WHERE recurring_id IS NOT NULL")
+    # Monthly spending limit per category, checked against the expense_category_totals rollup
+    cursor.execute('''CREATE TABLE budgets
+                      (user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+                       category_id INTEGER NOT NULL REFERENCES categories (id) ON DELETE CASCADE,
+                       limit_cents INTEGER NOT NULL, PRIMARY KEY (user_id, category_id)) WITHOUT ROWID''')
+
+def migrate_expense_search(cursor):
+    # Optional merchant and note on expenses, searchable through an FTS5 index. The index is an
+    # external-content table (it keeps only the index and reads text from expenses) maintained by the
+    # triggers below; rows with neither field are never indexed. user_id is indexed as well, so a
+    # search only walks the searching user's postings. Because of the triggers' WHEN clauses the index
+    # must not be rebuilt with FTS5's 'rebuild' command, which would index every row.
+    cursor.execute("ALTER TABLE expenses ADD COLUMN merchant TEXT")
+    cursor.execute("ALTER TABLE expenses ADD COLUMN note TEXT")
+    cursor.execute('''CREATE VIRTUAL TABLE expense_search USING fts5
+                      (user_id, merchant, note, content='expenses', content_rowid='id',
+                       tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+    # Best matches first by BM25, ignoring user_id; a merchant match weighs twice a note match
+    cursor.execute("INSERT INTO expense_search (expense_search, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)')")
+    cursor.execute('''CREATE TRIGGER expenses_search_insert AFTER INSERT ON expenses
+                      WHEN new.merchant IS NOT NULL OR new.note IS NOT NULL BEGIN
+                          INSERT INTO expense_search (rowid, user_id, merchant, note) VALUES (new.id, new.user_id, new.merchant, new.note);
+                      END''')
+    cursor.execute('''CREATE TRIGGER expenses_search_delete AFTER DELETE ON expenses
+                      WHEN old.merchant IS NOT NULL OR old.note IS NOT NULL BEGIN
+                          INSERT INTO expense_search (expense_search, rowid, user_id, merchant, note)
+                          VALUES ('delete', old.id, old.user_id, old.merchant, old.note);
+                      END''')
+    cursor.execute('''CREATE TRIGGER expenses_search_update AFTER UPDATE OF user_id, merchant, note ON expenses BEGIN
+                          INSERT INTO expense_search (expense_search, rowid, user_id, merchant, note)
+                          SELECT 'delete', old.id, old.user_id, old.merchant, old.note WHERE old.merchant IS NOT NULL OR old.note IS NOT NULL;
+                          INSERT INTO expense_search (rowid, user_id, merchant, note)
+                          SELECT new.id, new.user_id, new.merchant, new.note WHERE new.merchant IS NOT NULL OR new.note IS NOT NULL;
+                      END''')
+
+def migrate_user_total_indexes(cursor):
+    # Let the admin user list page through users by expense count or total in index order
+    cursor.execute("CREATE INDEX idx_user_expense_totals_total ON user_expense_totals (total_cents, user_id)")
+    cursor.execute("CREATE INDEX idx_user_expense_totals_count ON user_expense_totals (expense_count, user_id)")
+
+# Statement that adds the expenses with ids in a range to the search index, if they have a merchant or
+# note; insert_expense and insert_expenses run it after inserting
+SEARCH_INDEX_RANGE = ("INSERT INTO expense_search (rowid, user_id, merchant, note) SELECT id, user_id, merchant, note FROM expenses "
+                      "WHERE id BETWEEN ? AND ? AND (merchant IS NOT NULL OR note IS NOT NULL)")
+
+def migrate_index_search_from_inserts(cursor):
+    # New expenses are added to the search index by the code that inserts them (SEARCH_INDEX_RANGE), one
+    # statement per batch; an insert trigger runs for every row, even when its WHEN clause is false, and
+    # cost bulk inserts nearly as much as the inserts themselves. Deletes and updates keep their triggers.
+    cursor.execute("DROP TRIGGER expenses_search_insert")
+
+def migrate_set_aside_invalid_dates(cursor):
+    # migrate_dates_to_iso could only rewrite 'm/d/Y' dates and left anything else in place, where it was
+    # summed into rollup rows for months that don't exist and never matched a date range. Move those
+    # expenses to a table of their own with the columns they have now (CREATE TABLE ... AS keeps no
+    # constraints, so rows of deleted users are kept too), for someone to fix by hand; check_rollups
+    # reports them until they are dealt with.
+    cursor.execute("CREATE TABLE expenses_invalid_dates AS SELECT * FROM expenses WHERE 0")
+    cursor.execute("INSERT INTO expenses_invalid_dates SELECT * FROM expenses WHERE {}".format(INVALID_DATE_CONDITION))
+    if cursor.rowcount == 0:
+        return False
+    cursor.execute("DELETE FROM expenses WHERE {}".format(INVALID_DATE_CONDITION))
+    return True
+
+# Each migration returns True if the rollup tables must be rebuilt afterwards
+MIGRATIONS = [
+    migrate_dates_to_iso,
+    migrate_create_rollups,
+    migrate_admin_user_list,
+    migrate_cascade_user_deletes,
+    migrate_hash_passwords,
+    migrate_amounts_to_cents,
+    migrate_normalize_categories,
+    migrate_recurring_and_budgets,
+    migrate_expense_search,
+    migrate_user_total_indexes,
+    migrate_index_search_from_inserts,
+    migrate_set_aside_invalid_dates,
+]
+
+# Function to create the base schema and run all pending migrations in one transaction, rebuilding the
+# rollups once at the end if needed. The version is read again once the write lock is held, so when two
+# processes open an old database at once, the second finds the migrations done and skips them.
+def apply_migrations(connection):
+    cursor = connection.cursor()
+    if cursor.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    # Foreign keys must be off while tables are rebuilt; the pragma has no effect inside a transaction
+    foreign_keys = cursor.execute("PRAGMA foreign_keys").fetchone()[0]
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    cursor.execute("BEGIN IMMEDIATE")  # Explicit, since sqlite3 does not open a transaction for DDL
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            return  # Another process migrated the database while this one waited for the lock
+        if version == 0:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+        needs_rollup_rebuild = False
+        for migration in MIGRATIONS[version:]:
+            needs_rollup_rebuild = migration(cursor) or needs_rollup_rebuild
+        if needs_rollup_rebuild:
+            rebuild_rollups(cursor)
+        if cursor.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError("Migration left rows that violate foreign keys")
+        cursor.execute("PRAGMA user_version = {}".format(len(MIGRATIONS)))
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        if connection.in_transaction:
+            connection.commit()
+        cursor.execute("PRAGMA foreign_keys = {}".format(foreign_keys))
+
+# Function to get the occurrence of a recurring expense that follows `current`. Monthly rules keep
+# the day of month of their start date, clamped to shorter months (Jan 31, Feb 29, Mar 31, ...).
+def next_occurrence(frequency, start_date, current):
+    if frequency == 'daily':
+        return current + timedelta(days=1)
+    if frequency == 'weekly':
+        return current + timedelta(days=7)
+    year, month = (current.year + 1, 1) if current.month == 12 else (current.year, current.month + 1)
+    return date(year, month, min(start_date.day, calendar.monthrange(year, month)[1]))
+
+# Function to get the start and end dates of today, this week, this month and this year
+def get_period_bounds(current_date):
+    start_of_week = current_date - timedelta(days=current_date.weekday())
+    end_of_week = start_of_week + timedelta(days=6)
+    start_of_month = current_date.replace(day=1)
+    end_of_month = current_date.replace(day=calendar.monthrange(current_date.year, current_date.month)[1])
+    start_of_year = current_date.replace(month=1, day=1)
+    end_of_year = current_date.replace(month=12, day=31)
+    return {
+        'today': (current_date, current_date),
+        'week': (start_of_week, end_of_week),
+        'month': (start_of_month, end_of_month),
+        'year': (start_of_year, end_of_year),
+    }
+
+
+# Function to get a hash to check against when a username doesn't exist (computed once per work factor)
+@functools.lru_cache(maxsize=None)
+def dummy_password_hash(iterations):
+    return hash_password("", iterations)
+
+
+class ExpenseRepository:
+    # Pass instrument=True to record query metrics in instrumentation.METRICS. password_iterations
+    # is the PBKDF2 work factor for new and re-hashed passwords.
+    def __init__(self, db_path, connections=None, instrument=False, slow_query_threshold=None,
+                 password_iterations=DEFAULT_ITERATIONS):
+        self.db_path = db_path
+        self.password_iterations = password_iterations
+        self.connections = connections or ConnectionManager(db_path, factory=connection_factory(instrument, slow_query_threshold))
+        self.query_cache = QueryCache()  # Filtered expense pages and statistics; invalidated by every write below
+        self.create_schema()
+
+    # The calling thread's connection; every method opens its own cursor on it, so the
+    # repository can be shared between the UI thread and background workers.
+    @property
+    def conn(self):
+        return self.connections.connection()
+
+    # Function to create the tables, run pending migrations and seed the admin account. A database
+    # already at the current schema version (the usual case) skips the DDL and goes straight to the
+    # admin check, so opening it costs one pragma read.
+    def create_schema(self):
+        c = self.conn.cursor()
+        apply_migrations(self.conn)
+        # Add admin account if not exists (OR IGNORE: another process may add it first)
+        c.execute("SELECT id FROM users WHERE username='admin'")
+        if not c.fetchone():
+            with self.conn:
+                c.execute("INSERT OR IGNORE INTO users (first_name, last_name, email, age, sex, contact_number, username, password_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          ("Admin", "Admin", "admin@example.com", 0, "NA", "NA", "admin", hash_password("password", self.password_iterations)))
+
+    def close(self):
+        self.connections.close_all()
+
+    # ---- Users ----
+
+    # Function to validate and register a new user; raises ValueError with a user-facing message
+    def register_user(self, first_name, last_name, email, age, sex, contact_number, username, password):
+        c = self.conn.cursor()
+        # Check if fields are empty
+        if not all([first_name, last_name, email, age, sex, contact_number, username, password]):
+            raise ValueError("All fields are required")
+
+        # Email validation using regex
+        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+            raise ValueError("Invalid email address")
+
+        # Contact number validation
+        if not contact_number.isdigit() or len(contact_number) != 11:
+            raise ValueError("Invalid contact number. Please enter 11 digits.")
+
+        # Insert new user into the database; the UNIQUE constraints reject duplicates atomically
+        password_hash = hash_password(password, self.password_iterations)
+        try:
+            with self.conn:
+                c.execute("INSERT INTO users (first_name, last_name, email, age, sex, contact_number, username, password_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (first_name, last_name, email, age, sex, contact_number, username, password_hash))
+        except sqlite3.IntegrityError as error:
+            if "users.username" in str(error):
+                raise ValueError("Username already exists") from None
+            if "users.email" in str(error):
+                raise ValueError("Email already exists") from None
+            raise
+        return c.lastrowid
+
+    # Function to check a user's credentials; returns the user's id or None. Uses the covering
+    # idx_users_login index, and re-hashes the password if the work factor has changed.
+    def authenticate(self, username, password):
+        c = self.conn.cursor()
+        c.execute("SELECT id, password_hash FROM users WHERE username=?", (username,))
+        row = c.fetchone()
+        if row is None:
+            # Spend the same time as a real check so response time doesn't reveal valid usernames
+            verify_password(password, dummy_password_hash(self.password_iterations))
+            return None
+        user_id, password_hash = row
+        if not verify_password(password, password_hash):
+            return None
+        if needs_rehash(password_hash, self.password_iterations):
+            with self.conn:
+                c.execute("UPDATE users SET password_hash=? WHERE id=?", (hash_password(password, self.password_iterations), user_id))
+        return user_id
+
+    # Function to get a user's id by username; returns None if there is no such user
+    def get_user_id(self, username):
+        c = self.conn.cursor()
+        c.execute("SELECT id FROM users WHERE username=?", (username,))
+        row = c.fetchone()
+        return row[0] if row else None
+
+    # Function to fetch one page of user accounts for the admin list, with per-user expense count and
+    # total from the user_expense_totals rollup. search matches a case-insensitive prefix of username,
+    # email, first or last name; sort is a key of USER_SORT_COLUMNS. Pagination is keyset-based: pass
+    # the next_key returned with one page as after= to get the next. Returns (rows, next_key).
+    # Every sort reads users in the order of an index, so a page costs the same wherever it is in the list.
+    def list_users_page(self, search=None, sort='id', descending=False, after=None, limit=USER_PAGE_SIZE):
+        sort_expression = USER_SORT_COLUMNS[sort]
+        comparison, direction = ("<", "DESC") if descending else (">", "ASC")
+        conditions = []
+        params = []
+        if search:
+            pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append("(" + " OR ".join("u.{} LIKE ? ESCAPE '\\'".format(column)
+                                                for column in ('username', 'email', 'first_name', 'last_name')) + ")")
+            params.extend([pattern] * 4)
+        columns = "u.id, u.first_name, u.last_name, u.email, u.age, u.sex, u.contact_number, u.username"
+        c = self.conn.cursor()
+        if sort in USER_TOTAL_SORTS:
+            # Users without expenses (sort key 0, read in id order) and the user_expense_totals rows (read in
+            # index order) are fetched separately and merged; a LEFT JOIN sorted on COALESCE(...) would have
+            # to sort every user instead
+            zero_conditions, zero_params = conditions + ["NOT EXISTS (SELECT 1 FROM user_expense_totals t WHERE t.user_id = u.id)"], list(params)
+            if after is not None:
+                key, after_id = after
+                conditions.append("({}, t.user_id) {} (?, ?)".format(sort_expression, comparison))
+                params.extend(after)
+                if key == 0:
+                    zero_conditions.append("u.id {} ?".format(comparison))
+                    zero_params.append(after_id)
+                elif (key > 0) != descending:
+                    zero_conditions.append("0")  # The users without expenses all come before the key
+            c.execute("SELECT {columns}, 0, 0, 0 FROM users u WHERE {where} ORDER BY u.id {direction} LIMIT ?".format(
+                          columns=columns, direction=direction, where=" AND ".join(zero_conditions)),
+                      zero_params + [limit + 1])
+            rows = c.fetchall()
+            c.execute("SELECT {columns}, t.expense_count, t.total_cents, {sort} FROM user_expense_totals t JOIN users u ON u.id = t.user_id "
+                      "{where} ORDER BY {sort} {direction}, t.user_id {direction} LIMIT ?".format(
+                          columns=columns.replace("u.id", "t.user_id", 1), sort=sort_expression, direction=direction,
+                          where="WHERE " + " AND ".join(conditions) if conditions else ""),
+                      params + [limit + 1])
+            rows = sorted(rows + c.fetchall(), key=lambda row: (row[-1], row[0]), reverse=descending)[:limit + 1]
+        else:
+            if after is not None:
+                conditions.append("({}, u.id) {} (?, ?)".format(sort_expression, comparison))
+                params.extend(after)
+            c.execute("SELECT {columns}, COALESCE(t.expense_count, 0), COALESCE(t.total_cents, 0), {sort} "
+                      "FROM users u LEFT JOIN user_expense_totals t ON t.user_id = u.id "
+                      "{where} ORDER BY {sort} {direction}, u.id {direction} LIMIT ?".format(
+                          columns=columns, sort=sort_expression, direction=direction,
+                          where="WHERE " + " AND ".join(conditions) if conditions else ""),
+                      params + [limit + 1])
+            rows = c.fetchall()
+        next_key = (rows[limit - 1][-1], rows[limit - 1][0]) if len(rows) > limit else None
+        return [row[:-1] for row in rows[:limit]], next_key
+
+    # Function to delete a user account
+    # Small accounts are removed in one transaction by ON DELETE CASCADE; large ones have their
+    # expenses purged in chunks of PURGE_CHUNK_SIZE first (keeping the rollups in step), so other
+    # writers are never blocked for long. Returns False if the user did not exist.
+    def delete_user(self, user_id):
+        c = self.conn.cursor()
+        while True:
+            with self.conn:
+                # Deltas are taken from the rows the DELETE returns, i.e. only ones no concurrent delete got to first
+                c.execute("DELETE FROM expenses WHERE id IN (SELECT id FROM expenses WHERE user_id=? LIMIT ?) "
+                          "RETURNING date, category_id, amount_cents", (user_id, PURGE_CHUNK_SIZE))
+                rows = c.fetchall()
+                if len(rows) < PURGE_CHUNK_SIZE:
+                    # That was the last chunk; the user's rollup rows go with the user by cascade
+                    c.execute("DELETE FROM expenses_invalid_dates WHERE user_id=?", (user_id,))
+                    c.execute("DELETE FROM users WHERE id=?", (user_id,))
+                    deleted = c.rowcount > 0
+                    if not deleted:
+                        apply_rollup_deltas(c, [(user_id, date, category_id, -amount_cents, -1) for date, category_id, amount_cents in rows])
+                    break
+                apply_rollup_deltas(c, [(user_id, date, category_id, -amount_cents, -1) for date, category_id, amount_cents in rows])
+        self.query_cache.invalidate(int(user_id))
+        return deleted
+
+    # Function to delete several user accounts; returns the number deleted
+    def delete_users(self, user_ids):
+        return sum(1 for user_id in user_ids if self.delete_user(user_id))
+
+    # Function to remove expenses (set-aside ones too) and rollup rows that belong to no user, then VACUUM to
+    # give the space back to the file system. Returns (orphaned expenses removed, bytes reclaimed).
+    def purge_orphans_and_vacuum(self):
+        c = self.conn.cursor()
+        with self.conn:
+            # NOT EXISTS rather than NOT IN, which would skip rows whose user_id is NULL
+            c.execute("DELETE FROM expenses WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.id = expenses.user_id)")
+            removed = c.rowcount
+            for table in ROLLUP_TABLES + ('expenses_invalid_dates',):
+                c.execute("DELETE FROM {0} WHERE NOT EXISTS (SELECT 1 FROM users WHERE users.id = {0}.user_id)".format(table))
+        self.query_cache.clear()
+        size_before = self.database_size()
+        c.execute("VACUUM")
+        return removed, size_before - self.database_size()
+
+    # Function to get the size of the database in bytes
+    def database_size(self):
+        c = self.conn.cursor()
+        page_count = c.execute("PRAGMA page_count").fetchone()[0]
+        page_size = c.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    # ---- Categories ----
+
+    # Function to list the categories a user can choose from as (id, name): the built-in ones in their
+    # usual order, then the user's own alphabetically
+    def list_categories(self, user_id):
+        c = self.conn.cursor()
+        c.execute("SELECT id, name FROM categories WHERE user_id IS NULL OR user_id=? "
+                  "ORDER BY user_id IS NOT NULL, CASE WHEN user_id IS NULL THEN id END, name COLLATE NOCASE", (user_id,))
+        return c.fetchall()
+
+    # Function to add a user-defined category; returns its id. Raises ValueError with a user-facing message.
+    def add_category(self, user_id, name):
+        with self.conn:
+            return self.get_or_create_category_id(user_id, name, create_only=True)
+
+    # Function to get the id of the category a user calls `name` (case-insensitive), creating it as one
+    # of the user's own categories if needed. Does not commit, so the importer can use it mid-batch.
+    def get_or_create_category_id(self, user_id, name, create_only=False):
+        c = self.conn.cursor()
+        name = " ".join(str(name).split())
+        if not name or name == CATEGORY_PLACEHOLDER:
+            raise ValueError("Category cannot be empty")
+        if len(name) > MAX_CATEGORY_NAME_LENGTH:
+            raise ValueError("Category names can be at most {} characters".format(MAX_CATEGORY_NAME_LENGTH))
+        c.execute("SELECT id FROM categories WHERE name=? COLLATE NOCASE AND (user_id IS NULL OR user_id=?) "
+                  "ORDER BY user_id IS NOT NULL LIMIT 1", (name, user_id))
+        row = c.fetchone()
+        if row:
+            if create_only:
+                raise ValueError("Category already exists")
+            return row[0]
+        c.execute("INSERT INTO categories (user_id, name) VALUES (?, ?)", (user_id, name))
+        return c.lastrowid
+
+    # ---- Recurring expenses ----
+
+    # Function to add a recurring expense rule (amount in centavos, dates as date objects); returns its id.
+    # Nothing is materialized until materialize_recurring runs. Raises ValueError with a user-facing message.
+    def add_recurring_expense(self, user_id, amount_cents, category_id, frequency, start_date, end_date=None):
+        if frequency not in RECURRING_FREQUENCIES:
+            raise ValueError("Invalid frequency: {!r}".format(frequency))
+        if end_date is not None and end_date < start_date:
+            raise ValueError("The end date must not be before the start date")
+        c = self.conn.cursor()
+        with self.conn:
+            c.execute("INSERT INTO recurring_expenses (user_id, amount_cents, category_id, frequency, start_date, end_date, next_date) "
+                      "SELECT ?, ?, id, ?, ?, ?, ? FROM categories WHERE id=? AND (user_id IS NULL OR user_id=?)",
+                      (user_id, amount_cents, frequency, start_date.isoformat(), end_date.isoformat() if end_date else None,
+                       start_date.isoformat(), category_id, user_id))
+            if c.rowcount != 1:
+                raise ValueError("Please choose a category")
+        return c.lastrowid
+
+    # Function to list a user's recurring expense rules as
+    # (id, amount_cents, category name, frequency, start_date, end_date, next_date)
+    def list_recurring_expenses(self, user_id):
+        c = self.conn.cursor()
+        c.execute("SELECT r.id, r.amount_cents, c.name, r.frequency, r.start_date, r.end_date, r.next_date "
+                  "FROM recurring_expenses r JOIN categories c ON c.id = r.category_id WHERE r.user_id=? ORDER BY r.id",
+                  (user_id,))
+        return c.fetchall()
+
+    # Function to delete a user's recurring expense rule; expenses it already created are kept.
+    # Returns False if there was no such rule.
+    def delete_recurring_expense(self, user_id, rule_id):
+        c = self.conn.cursor()
+        with self.conn:
+            c.execute("DELETE FROM recurring_expenses WHERE id=? AND user_id=?", (rule_id, user_id))
+        return c.rowcount > 0
+
+    # Function to create the expenses of every due recurring rule (of one user, or of all users) up to
+    # `today`, RECURRING_BATCH_SIZE rules per transaction; returns the number of expenses created.
+    # Each rule's next_date moves forward in the same transaction as its expenses, and the unique
+    # (recurring_id, date) index drops any occurrence that already exists, so running this again, or
+    # from two processes at once, never creates duplicates.
+    def materialize_recurring(self, user_id=None, today=None, batch_size=RECURRING_BATCH_SIZE):
+        today = (today or date.today()).isoformat()
+        query = ("SELECT id, user_id, amount_cents, category_id, frequency, start_date, end_date, next_date "
+                 "FROM recurring_expenses WHERE next_date <= ? AND (end_date IS NULL OR next_date <= end_date)")
+        params = [today]
+        if user_id is not None:
+            query += " AND user_id=?"
+            params.append(user_id)
+        c = self.conn.cursor()
+        created = 0
+        while True:
+            with self.conn:
+                c.execute(query + " ORDER BY id LIMIT ?", params + [batch_size])
+                rules = c.fetchall()
+                if not rules:
+                    break
+                deltas = []
+                for rule_id, owner_id, amount_cents, category_id, frequency, start_date, end_date, next_date in rules:
+                    last_date = min(today, end_date) if end_date else today
+                    start_date, day = date.fromisoformat(start_date), date.fromisoformat(next_date)
+                    while day.isoformat() <= last_date:
+                        c.execute("INSERT OR IGNORE INTO expenses (user_id, amount_cents, category_id, date, recurring_id) "
+                                  "VALUES (?, ?, ?, ?, ?)", (owner_id, amount_cents, category_id, day.isoformat(), rule_id))
+                        if c.rowcount == 1:
+                            deltas.append((owner_id, day.isoformat(), category_id, amount_cents, 1))
+                        day = next_occurrence(frequency, start_date, day)
+                    c.execute("UPDATE recurring_expenses SET next_date=? WHERE id=?", (day.isoformat(), rule_id))
+                apply_rollup_deltas(c, deltas)
+            self.query_cache.invalidate(*{rule[1] for rule in rules})
+            created += len(deltas)
+        return created
+
+    # ---- Budgets ----
+
+    # Function to set a user's monthly budget for a category in centavos, or remove it with None.
+    # Raises ValueError with a user-facing message.
+    def set_budget(self, user_id, category_id, limit_cents):
+        if limit_cents is not None and limit_cents <= 0:
+            raise ValueError("The budget must be more than zero")
+        c = self.conn.cursor()
+        with self.conn:
+            if limit_cents is None:
+                c.execute("DELETE FROM budgets WHERE user_id=? AND category_id=?", (user_id, category_id))
+                return
+            c.execute("INSERT INTO budgets (user_id, category_id, limit_cents) "
+                      "SELECT ?, id, ? FROM categories WHERE id=? AND (user_id IS NULL OR user_id=?) "
+                      "ON CONFLICT (user_id, category_id) DO UPDATE SET limit_cents=excluded.limit_cents",
+                      (user_id, limit_cents, category_id, user_id))
+            if c.rowcount != 1:
+                raise ValueError("Please choose a category")
+
+    # Function to list a user's budgets with the amount spent in `month` ('YYYY-MM'), as
+    # (category_id, category name, limit_cents, spent_cents). Spending is read from the running
+    # totals in expense_category_totals, so this never scans the user's expenses.
+    def list_budgets(self, user_id, month):
+        c = self.conn.cursor()
+        c.execute("SELECT b.category_id, c.name, b.limit_cents, COALESCE(t.total_cents, 0) FROM budgets b "
+                  "JOIN categories c ON c.id = b.category_id "
+                  "LEFT JOIN expense_category_totals t ON t.user_id = b.user_id AND t.month = ? AND t.category_id = b.category_id "
+                  "WHERE b.user_id=? ORDER BY c.name COLLATE NOCASE", (month, user_id))
+        return c.fetchall()
+
+    # Function to list the budgets a user has gone over in `month`, optionally only for some categories
+    # (e.g. the one an expense was just added to); same row shape as list_budgets
+    def budget_alerts(self, user_id, month, category_ids=None):
+        return [budget for budget in self.list_budgets(user_id, month)
+                if budget[3] > budget[2] and (category_ids is None or budget[0] in category_ids)]
+
+    # ---- Expenses ----
+
+    # Function to add an expense (amount in centavos, optional merchant and note) and update the rollups
+    # in the same transaction; returns the new id. Raises ValueError with a user-facing message if the
+    # category is not one the user can use or a text field is too long.
+    def add_expense(self, user_id, amount_cents, category_id, date, merchant=None, note=None):
+        with self.conn:
+            expense_id = self.insert_expense(user_id, amount_cents, category_id, date, merchant, note)
+        self.query_cache.invalidate(user_id)
+        return expense_id
+
+    # Function to insert one expense and its rollup deltas; returns its id. Raises ValueError (having
+    # changed nothing) as add_expense does. Does not commit, so the server's write batcher can group
+    # many users' writes into one transaction.
+    def insert_expense(self, user_id, amount_cents, category_id, date, merchant=None, note=None):
+        merchant = clean_text_field(merchant, MAX_MERCHANT_LENGTH, "Merchant")
+        note = clean_text_field(note, MAX_NOTE_LENGTH, "Note")
+        c = self.conn.cursor()
+        c.execute("INSERT INTO expenses (user_id, amount_cents, category_id, date, merchant, note) "
+                  "SELECT ?, ?, id, ?, ?, ? FROM categories WHERE id=? AND (user_id IS NULL OR user_id=?)",
+                  (user_id, amount_cents, date, merchant, note, category_id, user_id))
+        if c.rowcount != 1:
+            raise ValueError("Please choose a category")
+        expense_id = c.lastrowid
+        if merchant is not None or note is not None:
+            c.execute(SEARCH_INDEX_RANGE, (expense_id, expense_id))
+        apply_rollup_deltas(c, [(user_id, date, category_id, amount_cents, 1)])
+        return expense_id
+
+    # Function to insert many (user_id, amount_cents, category_id, date, merchant, note) rows and their
+    # rollup deltas; merchant and note may be None and must already be cleaned with clean_text_field.
+    # Does not commit, so callers can group several batches into one transaction; they must invalidate
+    # query_cache for the users once it has committed (before then a reader could cache the old results).
+    def insert_expenses(self, rows):
+        if not rows:
+            return
+        c = self.conn.cursor()
+        c.executemany("INSERT INTO expenses (user_id, amount_cents, category_id, date, merchant, note) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        if any(row[4] is not None or row[5] is not None for row in rows):
+            # The batch holds the write lock from its first row, so its ids are the ones up to the last
+            last_id = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+            c.execute(SEARCH_INDEX_RANGE, (last_id - len(rows) + 1, last_id))
+        apply_rollup_deltas(c, [(row[0], row[3], row[2], row[1], 1) for row in rows])
+
+    # Context manager for a bulk load of one user's expenses in a single transaction that holds the write
+    # lock from the start. Foreign key checks are off for the load, since they cost two lookups per row;
+    # the user is checked here instead, and the loader must take category ids from get_or_create_category_id.
+    # Commits at the end, or rolls back if the load raises. Raises ValueError if there is no such user.
+    @contextlib.contextmanager
+    def bulk_load(self, user_id):
+        c = self.conn.cursor()
+        foreign_keys = c.execute("PRAGMA foreign_keys").fetchone()[0]
+        c.execute("PRAGMA foreign_keys = OFF")  # Has no effect inside a transaction, so set it first
+        try:
+            with self.conn:
+                c.execute("BEGIN IMMEDIATE")  # Explicit, so DDL such as drop_expense_indexes is part of the load
+                if c.execute("SELECT 1 FROM users WHERE id=?", (user_id,)).fetchone() is None:
+                    raise ValueError("No such user")
+                yield
+        finally:
+            c.execute("PRAGMA foreign_keys = {}".format(foreign_keys))
+
+    # Function to get a quick upper bound on the number of expenses (deleted ids are counted too)
+    def estimated_expense_count(self):
+        c = self.conn.cursor()
+        return c.execute("SELECT COALESCE(MAX(id), 0) FROM expenses").fetchone()[0]
+
+    # Function to drop the secondary indexes on expenses ahead of a bulk load; returns their CREATE INDEX
+    # statements for restore_expense_indexes. Sorting the whole table into each index once is cheaper than
+    # updating them row by row when the load is about as big as the table. Call it inside bulk_load,
+    # so a failed load rolls the drop back as well.
+    def drop_expense_indexes(self):
+        c = self.conn.cursor()
+        c.execute("SELECT name, sql FROM sqlite_master WHERE type='index' AND tbl_name='expenses' AND sql IS NOT NULL")
+        indexes = c.fetchall()
+        for name, _ in indexes:
+            c.execute('DROP INDEX "{}"'.format(name))
+        return [sql for _, sql in indexes]
+
+    # Function to re-create the indexes drop_expense_indexes dropped
+    def restore_expense_indexes(self, statements):
+        c = self.conn.cursor()
+        for statement in statements:
+            c.execute(statement)
+
+    # Function to delete an expense and update the rollups; returns the deleted (user_id, date, category_id,
+    # amount_cents), or None if it did not exist. Pass user_id to only delete it if that user owns it.
+    def delete_expense(self, expense_id, user_id=None):
+        with self.conn:
+            expense = self.remove_expense(expense_id, user_id)
+        if expense:
+            self.query_cache.invalidate(expense[0])
+        return expense
+
+    # Function to delete an expense and apply its rollup deltas, returning it as delete_expense does.
+    # Does not commit, like insert_expense.
+    def remove_expense(self, expense_id, user_id=None):
+        # The deltas come from the row the DELETE actually removed, so two concurrent deletes of the
+        # same expense (e.g. a double-clicked Delete) only take it out of the rollups once
+        c = self.conn.cursor()
+        if user_id is None:
+            c.execute("DELETE FROM expenses WHERE id=? RETURNING user_id, date, category_id, amount_cents", (expense_id,))
+        else:
+            c.execute("DELETE FROM expenses WHERE id=? AND user_id=? RETURNING user_id, date, category_id, amount_cents",
+                      (expense_id, user_id))
+        rows = c.fetchall()
+        if not rows:
+            return None
+        expense = rows[0]
+        apply_rollup_deltas(c, [(expense[0], expense[1], expense[2], -expense[3], -1)])
+        return expense
+
+    # Function to fetch one page of a user's expenses, newest first, using keyset pagination on (date, id).
+    # Pass before=(date, id) for the page of older rows, or after=(date, id) for the page of newer rows.
+    # With an ExpenseFilter only matching rows are returned, and the page is served from the query cache.
+    def fetch_expense_page(self, user_id, before=None, after=None, limit=EXPENSE_PAGE_SIZE, expense_filter=None):
+        if expense_filter is not None and not expense_filter.is_empty():
+            return self.query_cache.get_or_compute(
+                user_id, ('page', expense_filter, before, after, limit),
+                lambda: self._fetch_expense_page(user_id, before, after, limit, expense_filter))
+        return self._fetch_expense_page(user_id, before, after, limit, None)
+
+    def _fetch_expense_page(self, user_id, before, after, limit, expense_filter):
+        c = self.conn.cursor()
+        conditions, params = expense_filter.clause() if expense_filter is not None else ("", [])
+        if after is not None:
+            c.execute("SELECT * FROM expenses WHERE user_id=? AND (date, id) > (?, ?)" + conditions +
+                      " ORDER BY date, id LIMIT ?", [user_id, after[0], after[1]] + params + [limit])
+            return c.fetchall()[::-1]
+        if before is not None:
+            c.execute("SELECT * FROM expenses WHERE user_id=? AND (date, id) < (?, ?)" + conditions +
+                      " ORDER BY date DESC, id DESC LIMIT ?", [user_id, before[0], before[1]] + params + [limit])
+        else:
+            c.execute("SELECT * FROM expenses WHERE user_id=?" + conditions + " ORDER BY date DESC, id DESC LIMIT ?",
+                      [user_id] + params + [limit])
+        return c.fetchall()
+
+    # Function to search a user's expenses by merchant and note with the expense_search FTS5 index, best
+    # matches first, a page at a time (see search_match_expression for how the text is matched). Returns
+    # (rows, next_offset): rows are (id, user_id, amount_cents, category_id, date, merchant, note), and
+    # next_offset is the offset of the following page, or None on the last one. Served from the query cache.
+    def search_expenses(self, user_id, text, offset=0, limit=SEARCH_PAGE_SIZE):
+        expression = search_match_expression(user_id, text)
+        if expression is None:
+            return [], None
+        return self.query_cache.get_or_compute(user_id, ('search', expression, offset, limit),
+                                               lambda: self._search_expenses(user_id, expression, offset, limit))
+
+    def _search_expenses(self, user_id, expression, offset, limit):
+        c = self.conn.cursor()
+        # Ranking happens inside the FTS5 subquery, so only the page's rows are looked up in expenses
+        c.execute("SELECT e.id, e.user_id, e.amount_cents, e.category_id, e.date, e.merchant, e.note "
+                  "FROM (SELECT rowid, rank FROM expense_search WHERE expense_search MATCH ? ORDER BY rank LIMIT ? OFFSET ?) s "
+                  "JOIN expenses e ON e.id = s.rowid WHERE e.user_id=? ORDER BY s.rank",
+                  (expression, limit + 1, offset, user_id))
+        rows = c.fetchall()
+        return rows[:limit], offset + limit if len(rows) > limit else None
+
+    # Function to merge the search index's segments into one, for faster searches after a large import
+    def optimize_search_index(self):
+        with self.conn:
+            self.conn.execute("INSERT INTO expense_search (expense_search) VALUES ('optimize')")
+
+    # Function to fetch expenses for a specific period, optionally restricted to some categories and an
+    # amount range in centavos (uses idx_expenses_user_date)
+    def fetch_expenses_for_period(self, user_id, start_date, end_date, category_ids=None, min_amount=None, max_amount=None):
+        c = self.conn.cursor()
+        conditions, params = ExpenseFilter(start_date, end_date, category_ids, min_amount, max_amount).clause()
+        c.execute("SELECT * FROM expenses WHERE user_id=?" + conditions + " ORDER BY date", [user_id] + params)
+        return c.fetchall()
+
+    # Function to stream a user's expenses as (id, amount_cents, category name, date, merchant, note) in date order,
+    # optionally within a period, in chunks. Uses its own cursor so other queries can run while the
+    # caller is iterating.
+    def iter_expenses(self, user_id, start_date=None, end_date=None, chunk_size=EXPORT_CHUNK_SIZE):
+        query = ("SELECT e.id, e.amount_cents, c.name, e.date, e.merchant, e.note "
+                 "FROM expenses e JOIN categories c ON c.id = e.category_id WHERE e.user_id=?")
+        params = [user_id]
+        if start_date is not None:
+            query += " AND e.date >= ?"
+            params.append(start_date.isoformat())
+        if end_date is not None:
+            query += " AND e.date <= ?"
+            params.append(end_date.isoformat())
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query + " ORDER BY e.date, e.id", params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    # ---- Statistics ----
+
+    # Function to compute today/week/month/year totals (in centavos) for a user from the rollup tables
+    def fetch_statistics(self, user_id, current_date=None):
+        c = self.conn.cursor()
+        if current_date is None:
+            current_date = datetime.today().date()
+        bounds = get_period_bounds(current_date)
+        week_start, week_end = bounds['week']
+        c.execute(
+            "SELECT "
+            "(SELECT COALESCE(SUM(total_cents), 0) FROM expense_daily_totals WHERE user_id=? AND day=?), "
+            "(SELECT COALESCE(SUM(total_cents), 0) FROM expense_daily_totals WHERE user_id=? AND day BETWEEN ? AND ?), "
+            "(SELECT COALESCE(SUM(total_cents), 0) FROM expense_monthly_totals WHERE user_id=? AND month=?), "
+            "(SELECT COALESCE(SUM(total_cents), 0) FROM expense_monthly_totals WHERE user_id=? AND month BETWEEN ? AND ?)",
+            (user_id, current_date.isoformat(),
+             user_id, week_start.isoformat(), week_end.isoformat(),
+             user_id, current_date.isoformat()[:7],
+             user_id, "{}-01".format(current_date.year), "{}-12".format(current_date.year)))
+        today, week, month, year = c.fetchone()
+        return {'today': today, 'week': week, 'month': month, 'year': year}
+
+    # Function to compute per-category totals (in centavos) for a user within a period
+    def fetch_category_totals(self, user_id, start_date, end_date):
+        c = self.conn.cursor()
+        whole_months = start_date.day == 1 and end_date.day == calendar.monthrange(end_date.year, end_date.month)[1]
+        if whole_months:
+            # Month-aligned periods are answered from the category rollup
+            c.execute(CATEGORY_TOTALS_WITH_NAMES.format(
+                      "SELECT category_id, SUM(total_cents) AS total, SUM(expense_count) AS expense_count "
+                      "FROM expense_category_totals WHERE user_id=? AND month BETWEEN ? AND ? GROUP BY category_id"),
+                      (user_id, start_date.isoformat()[:7], end_date.isoformat()[:7]))
+        else:
+            c.execute(CATEGORY_TOTALS_WITH_NAMES.format(
+                      "SELECT category_id, SUM(amount_cents) AS total, COUNT(*) AS expense_count "
+                      "FROM expenses WHERE user_id=? AND date BETWEEN ? AND ? GROUP BY category_id"),
+                      (user_id, start_date.isoformat(), end_date.isoformat()))
+        return c.fetchall()
+
+    # Function to compute the total, count and per-category totals (in centavos) of the expenses matching a filter;
+    # served from the query cache. Returns {'total': ..., 'count': ..., 'categories': [(category, total, count)]}.
+    def fetch_filter_statistics(self, user_id, expense_filter):
+        return self.query_cache.get_or_compute(user_id, ('statistics', expense_filter),
+                                               lambda: self._fetch_filter_statistics(user_id, expense_filter))
+
+    def _fetch_filter_statistics(self, user_id, expense_filter):
+        c = self.conn.cursor()
+        start_date, end_date = expense_filter.start_date, expense_filter.end_date
+        whole_months = ((start_date is None or start_date.day == 1) and
+                        (end_date is None or end_date.day == calendar.monthrange(end_date.year, end_date.month)[1]))
+        if whole_months and expense_filter.min_amount is None and expense_filter.max_amount is None:
+            # Month-aligned filters without an amount range are answered from the category rollup
+            query = ("SELECT category_id, SUM(total_cents) AS total, SUM(expense_count) AS expense_count "
+                     "FROM expense_category_totals WHERE user_id=?")
+            params = [user_id]
+            if start_date is not None:
+                query += " AND month >= ?"
+                params.append(start_date.isoformat()[:7])
+            if end_date is not None:
+                query += " AND month <= ?"
+                params.append(end_date.isoformat()[:7])
+            if expense_filter.category_ids:
+                query += " AND category_id IN ({})".format(", ".join("?" * len(expense_filter.category_ids)))
+                params.extend(expense_filter.category_ids)
+            c.execute(CATEGORY_TOTALS_WITH_NAMES.format(query + " GROUP BY category_id HAVING SUM(expense_count) > 0"), params)
+        else:
+            conditions, params = expense_filter.clause()
+            c.execute(CATEGORY_TOTALS_WITH_NAMES.format(
+                      "SELECT category_id, SUM(amount_cents) AS total, COUNT(*) AS expense_count FROM expenses WHERE user_id=?" +
+                      conditions + " GROUP BY category_id"), [user_id] + params)
+        categories = c.fetchall()
+        return {'total': sum(row[1] for row in categories), 'count': sum(row[2] for row in categories),
+                'categories': categories}
+
+    # Function to compute per-day totals (in centavos) for a user within a period
+    def fetch_daily_totals(self, user_id, start_date, end_date):
+        c = self.conn.cursor()
+        c.execute("SELECT day, total_cents, expense_count FROM expense_daily_totals WHERE user_id=? AND day BETWEEN ? AND ? ORDER BY day",
+                  (user_id, start_date.isoformat(), end_date.isoformat()))
+        return c.fetchall()
+
+    # Function to rebuild all rollup tables from the raw expenses
+    def rebuild_rollups(self, user_id=None):
+        with self.conn:
+            rebuild_rollups(self.conn.cursor(), user_id)
+        self.query_cache.clear()
+
+    # Function to verify the rollup tables against the raw expenses; returns a list of mismatches
+    def check_rollups(self):
+        return check_rollups(self.conn.cursor())
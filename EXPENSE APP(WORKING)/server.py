@@ -0,0 +1,548 @@
+# Optional multi-user server: the repository behind a small HTTP/JSON API, so several people can
+# share one database (each running expenseApp.py with EXPENSE_TRACKER_SERVER set, see client.py).
+#
+# Usage:
+#   python server.py [--host 127.0.0.1] [--port 8765] [--db expense_tracker.db] [--workers 16]
+#
+# Requests are handled by a fixed pool of worker threads, each with its own SQLite connection, so the
+# number of open connections stays bounded however many clients connect; extra connections wait
+# until a worker is free. Expense adds and deletes from every client go through one writer thread
+# that commits whatever has queued up in a single transaction (group commit), so a burst of writes
+# costs a few commits rather than one each. Clients log in with POST /api/login and send the returned
+# token as "Authorization: Bearer <token>"; the user id always comes from the token.
+import argparse
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from passwords import DEFAULT_ITERATIONS
+from repository import (ExpenseRepository, ExpenseFilter, EXPENSE_PAGE_SIZE, SEARCH_PAGE_SIZE, USER_PAGE_SIZE,
+                        USER_SORT_COLUMNS, USER_TOTAL_SORTS, normalize_date)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Request handler threads, and so the most SQLite connections open at once (plus the writer's)
+SERVER_WORKERS = 16
+
+# Listen backlog for connections not yet accepted
+REQUEST_QUEUE_SIZE = 1024
+
+# Most queued expense writes committed in one transaction
+WRITE_BATCH_SIZE = 256
+
+# Seconds a login token stays valid after its last use
+SESSION_TTL = 12 * 60 * 60
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 64 * 1024
+
+# Most expenses or users returned by one page request
+MAX_PAGE_SIZE = 1000
+
+# Fields of POST /api/register, in ExpenseRepository.register_user's argument order
+REGISTER_FIELDS = ('first_name', 'last_name', 'email', 'age', 'sex', 'contact_number', 'username', 'password')
+
+
+# Logged-in clients: token -> (user id, username), each token expiring SESSION_TTL after its last use
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = {}  # token -> [user_id, username, expiry]
+        self._lock = threading.Lock()
+        self._next_prune = time.monotonic() + ttl
+
+    # Function to start a session for a user who has just logged in; returns its token
+    def create(self, user_id, username):
+        token = secrets.token_urlsafe(32)
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                for expired in [key for key, entry in self._sessions.items() if entry[2] < now]:
+                    del self._sessions[expired]
+                self._next_prune = now + self.ttl
+            self._sessions[token] = [user_id, username, now + self.ttl]
+        return token
+
+    # Function to get the (user id, username) of a token, extending its session; returns None if
+    # the token is unknown or expired
+    def lookup(self, token):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None:
+                return None
+            if entry[2] < now:
+                del self._sessions[token]
+                return None
+            entry[2] = now + self.ttl
+            return entry[0], entry[1]
+
+    # Function to end a session
+    def discard(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    # Function to end every session of the given users (e.g. deleted accounts)
+    def discard_users(self, user_ids):
+        user_ids = set(user_ids)
+        with self._lock:
+            for token in [key for key, entry in self._sessions.items() if entry[0] in user_ids]:
+                del self._sessions[token]
+
+
+# Single writer thread for expense adds and deletes. Handler threads queue a write and wait for its
+# result; the writer takes everything queued so far (up to WRITE_BATCH_SIZE) and runs it in one
+# transaction, so the batch size grows by itself under load and an idle server adds no delay.
+class WriteBatcher:
+    def __init__(self, repo, batch_size=WRITE_BATCH_SIZE):
+        self.repo = repo
+        self.batch_size = batch_size
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="write-batcher", daemon=True)
+        self._thread.start()
+
+    # Function to run repo.<method>(*args), a write that does not commit (insert_expense,
+    # remove_expense), in the next batch on behalf of user_id; returns its result or raises its error
+    def submit(self, user_id, method, *args):
+        future = Future()
+        self._queue.put((user_id, method, args, future))
+        return future.result()
+
+    # Function to finish the queued writes and stop the writer thread
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._commit(batch)
+        self.repo.connections.close_thread_connection()
+
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.repo.conn:
+                for user_id, method, args, future in batch:
+                    try:
+                        results.append((future, getattr(self.repo, method)(*args), None))
+                    except ValueError as error:
+                        # Rejected before changing anything; the rest of the batch still commits
+                        results.append((future, None, error))
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0][3].set_exception(error)
+                return
+            # The whole batch was rolled back; retry each write on its own so one failure can't fail the others
+            for item in batch:
+                self._commit([item])
+            return
+        self.repo.query_cache.invalidate(*{item[0] for item in batch})
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+# Function to read an integer from a JSON body or query string; raises ValueError naming the field
+def as_int(value, name):
+    if isinstance(value, (bool, float)):
+        raise ValueError("Invalid {}".format(name))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid {}".format(name)) from None
+
+# Function to read an optional ISO date from a query string or JSON body
+def as_date(value, name):
+    if value in (None, ""):
+        return None
+    try:
+        return date.fromisoformat(normalize_date(str(value)))
+    except ValueError:
+        raise ValueError("Invalid {}".format(name)) from None
+
+# Function to read the expense filter of a list or statistics request (start, end, category_ids,
+# min_amount and max_amount in centavos; all optional)
+def read_filter(params):
+    category_ids = params.get('category_ids')
+    return ExpenseFilter(
+        as_date(params.get('start'), 'start'),
+        as_date(params.get('end'), 'end'),
+        tuple(as_int(value, 'category_ids') for value in category_ids.split(',')) if category_ids else None,
+        as_int(params['min_amount'], 'min_amount') if params.get('min_amount') else None,
+        as_int(params['max_amount'], 'max_amount') if params.get('max_amount') else None)
+
+# Function to read a (date, id) keyset key from query parameters such as before_date/before_id
+def read_page_key(params, prefix):
+    if not params.get(prefix + '_date'):
+        return None
+    return normalize_date(params[prefix + '_date']), as_int(params.get(prefix + '_id'), prefix + '_id')
+
+# Function to read the after= key of a user list page: the JSON [sort value, user id] pair that a previous
+# page returned as next_key. The sort value is an integer for the id and total sorts and text otherwise.
+def read_user_page_key(params, sort):
+    if not params.get('after'):
+        return None
+    try:
+        key = json.loads(params['after'])
+    except ValueError:
+        raise ValueError("Invalid after") from None
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError("Invalid after")
+    value, user_id = key
+    if sort == 'id' or sort in USER_TOTAL_SORTS:
+        value = as_int(value, 'after')
+    elif not isinstance(value, str):
+        raise ValueError("Invalid after")
+    return value, as_int(user_id, 'after')
+
+# Function to read a 'YYYY-MM' month parameter, defaulting to the current month
+def read_month(params):
+    month = params.get('month') or date.today().isoformat()[:7]
+    as_date(month + "-01", 'month')
+    return month
+
+def read_limit(params, default):
+    limit = as_int(params.get('limit', default), 'limit')
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+    return limit
+
+
+# A parsed API request: the logged-in user (None for public routes), query parameters (first value
+# of each), JSON body and the numeric id from the path, if the route has one
+ApiRequest = namedtuple('ApiRequest', 'user_id username token params body path_id')
+
+# ---- Handlers: each takes (server, request) and returns the JSON response ----
+
+def handle_health(server, request):
+    return {'status': 'ok', 'write_batches': server.writer.batches, 'writes': server.writer.writes}
+
+def handle_register(server, request):
+    fields = [str(request.body.get(field) or "") for field in REGISTER_FIELDS]
+    return {'id': server.repo.register_user(*fields)}
+
+def handle_login(server, request):
+    username, password = str(request.body.get('username') or ""), str(request.body.get('password') or "")
+    user_id = server.repo.authenticate(username, password) if username and password else None
+    if user_id is None:
+        raise PermissionError("Invalid username or password")
+    return {'token': server.sessions.create(user_id, username), 'user_id': user_id, 'username': username}
+
+def handle_logout(server, request):
+    server.sessions.discard(request.token)
+    return {}
+
+def handle_list_categories(server, request):
+    return {'categories': server.repo.list_categories(request.user_id)}
+
+def handle_add_category(server, request):
+    return {'id': server.repo.add_category(request.user_id, str(request.body.get('name') or ""))}
+
+def handle_list_expenses(server, request):
+    params = request.params
+    expense_filter = read_filter(params)
+    return {'expenses': server.repo.fetch_expense_page(
+        request.user_id, before=read_page_key(params, 'before'), after=read_page_key(params, 'after'),
+        limit=read_limit(params, EXPENSE_PAGE_SIZE), expense_filter=None if expense_filter.is_empty() else expense_filter)}
+
+def handle_add_expense(server, request):
+    body = request.body
+    amount_cents = as_int(body.get('amount_cents'), 'amount_cents')
+    expense_date = normalize_date(str(body.get('date') or ""))
+    return {'id': server.writer.submit(request.user_id, 'insert_expense', request.user_id, amount_cents,
+                                       as_int(body.get('category_id'), 'category_id'), expense_date,
+                                       body.get('merchant'), body.get('note'))}
+
+def handle_delete_expense(server, request):
+    return {'expense': server.writer.submit(request.user_id, 'remove_expense', request.path_id, request.user_id)}
+
+def handle_search_expenses(server, request):
+    params = request.params
+    expenses, next_offset = server.repo.search_expenses(request.user_id, params.get('q', ""), as_int(params.get('offset', 0), 'offset'),
+                                                        read_limit(params, SEARCH_PAGE_SIZE))
+    return {'expenses': expenses, 'next_offset': next_offset}
+
+def handle_statistics(server, request):
+    return {'totals': server.repo.fetch_statistics(request.user_id, as_date(request.params.get('date'), 'date'))}
+
+def handle_filter_statistics(server, request):
+    return {'statistics': server.repo.fetch_filter_statistics(request.user_id, read_filter(request.params))}
+
+def handle_list_recurring(server, request):
+    return {'recurring': server.repo.list_recurring_expenses(request.user_id)}
+
+def handle_add_recurring(server, request):
+    body = request.body
+    start_date = as_date(body.get('start_date'), 'start_date')
+    if start_date is None:
+        raise ValueError("Invalid start_date")
+    return {'id': server.repo.add_recurring_expense(
+        request.user_id, as_int(body.get('amount_cents'), 'amount_cents'), as_int(body.get('category_id'), 'category_id'),
+        body.get('frequency'), start_date, as_date(body.get('end_date'), 'end_date'))}
+
+def handle_delete_recurring(server, request):
+    return {'deleted': server.repo.delete_recurring_expense(request.user_id, request.path_id)}
+
+def handle_materialize_recurring(server, request):
+    # Due dates are always judged by the server's clock
+    return {'created': server.repo.materialize_recurring(request.user_id)}
+
+def handle_list_budgets(server, request):
+    return {'budgets': server.repo.list_budgets(request.user_id, read_month(request.params))}
+
+def handle_set_budget(server, request):
+    limit_cents = request.body.get('limit_cents')
+    server.repo.set_budget(request.user_id, request.path_id, None if limit_cents is None else as_int(limit_cents, 'limit_cents'))
+    return {}
+
+def handle_budget_alerts(server, request):
+    category_ids = request.params.get('category_ids')
+    return {'alerts': server.repo.budget_alerts(
+        request.user_id, read_month(request.params),
+        tuple(as_int(value, 'category_ids') for value in category_ids.split(',')) if category_ids else None)}
+
+def handle_list_users(server, request):
+    params = request.params
+    sort = params.get('sort', 'id')
+    if sort not in USER_SORT_COLUMNS:
+        raise ValueError("Invalid sort")
+    users, next_key = server.repo.list_users_page(params.get('search') or None, sort, params.get('descending') == '1',
+                                                  read_user_page_key(params, sort), read_limit(params, USER_PAGE_SIZE))
+    return {'users': users, 'next_key': next_key}
+
+def handle_delete_users(server, request):
+    user_ids = [as_int(user_id, 'user_ids') for user_id in request.body.get('user_ids') or ()]
+    deleted = server.repo.delete_users(user_ids)
+    server.sessions.discard_users(user_ids)
+    return {'deleted': deleted}
+
+def handle_rebuild_rollups(server, request):
+    server.repo.rebuild_rollups()
+    return {}
+
+def handle_check_rollups(server, request):
+    return {'problems': server.repo.check_rollups()}
+
+def handle_cleanup(server, request):
+    removed, reclaimed = server.repo.purge_orphans_and_vacuum()
+    return {'removed': removed, 'reclaimed': reclaimed}
+
+# Who may call a route
+PUBLIC, USER, ADMIN = 'public', 'user', 'admin'
+
+# (method, path, access, handler); an {id} path segment must be a number and is passed as request.path_id
+ROUTES = [
+    ('GET', '/api/health', PUBLIC, handle_health),
+    ('POST', '/api/register', PUBLIC, handle_register),
+    ('POST', '/api/login', PUBLIC, handle_login),
+    ('POST', '/api/logout', USER, handle_logout),
+    ('GET', '/api/categories', USER, handle_list_categories),
+    ('POST', '/api/categories', USER, handle_add_category),
+    ('GET', '/api/expenses', USER, handle_list_expenses),
+    ('POST', '/api/expenses', USER, handle_add_expense),
+    ('DELETE', '/api/expenses/{id}', USER, handle_delete_expense),
+    ('GET', '/api/expenses/search', USER, handle_search_expenses),
+    ('GET', '/api/statistics', USER, handle_statistics),
+    ('GET', '/api/statistics/filtered', USER, handle_filter_statistics),
+    ('GET', '/api/recurring', USER, handle_list_recurring),
+    ('POST', '/api/recurring', USER, handle_add_recurring),
+    ('DELETE', '/api/recurring/{id}', USER, handle_delete_recurring),
+    ('POST', '/api/recurring/materialize', USER, handle_materialize_recurring),
+    ('GET', '/api/budgets', USER, handle_list_budgets),
+    ('GET', '/api/budgets/alerts', USER, handle_budget_alerts),
+    ('PUT', '/api/budgets/{id}', USER, handle_set_budget),
+    ('GET', '/api/admin/users', ADMIN, handle_list_users),
+    ('POST', '/api/admin/users/delete', ADMIN, handle_delete_users),
+    ('POST', '/api/admin/rollups/rebuild', ADMIN, handle_rebuild_rollups),
+    ('GET', '/api/admin/rollups/check', ADMIN, handle_check_rollups),
+    ('POST', '/api/admin/cleanup', ADMIN, handle_cleanup),
+]
+
+# Function to find the route for a request; returns (access, handler, path id) or None
+def match_route(method, path):
+    segments = path.rstrip('/').split('/')
+    for route_method, route_path, access, handler in ROUTES:
+        route_segments = route_path.split('/')
+        if route_method != method or len(route_segments) != len(segments):
+            continue
+        path_id = None
+        for route_segment, segment in zip(route_segments, segments):
+            if route_segment == '{id}' and segment.isdigit():
+                path_id = int(segment)
+            elif route_segment != segment:
+                break
+        else:
+            return access, handler, path_id
+    return None
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "ExpenseTracker/1.0"
+    # One request per connection, so idle clients never hold on to a worker thread
+    protocol_version = "HTTP/1.0"
+    # Seconds a client may take to send its request
+    timeout = 30
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        route = match_route(method, url.path)
+        if route is None:
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': "Not found"})
+            return
+        access, handler, path_id = route
+        try:
+            user_id = username = token = None
+            if access != PUBLIC:
+                token = self.headers.get('Authorization', '').partition('Bearer ')[2].strip()
+                user = self.server.sessions.lookup(token) if token else None
+                if user is None:
+                    self.send_json(HTTPStatus.UNAUTHORIZED, {'error': "Please log in again"})
+                    return
+                user_id, username = user
+                if access == ADMIN and username != 'admin':
+                    self.send_json(HTTPStatus.FORBIDDEN, {'error': "Only the admin can do this"})
+                    return
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            request = ApiRequest(user_id, username, token, params, self.read_body(), path_id)
+            status, result = HTTPStatus.OK, handler(self.server, request)
+        except PermissionError as error:
+            status, result = HTTPStatus.UNAUTHORIZED, {'error': str(error)}
+        except ValueError as error:
+            # ValueError carries a user-facing message, as everywhere in the repository
+            status, result = HTTPStatus.BAD_REQUEST, {'error': str(error)}
+        except Exception as error:
+            self.log_error("%s %s failed: %r", method, url.path, error)
+            status, result = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': "Internal server error"}
+        self.send_json(status, result)
+
+    # Function to read and decode the JSON body ({} if there is none); raises ValueError if it is not a JSON object
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ValueError("Request body is not valid JSON") from None
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def send_json(self, status, result):
+        payload = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        if self.server.log_requests:
+            super().log_message(format, *args)
+
+    def log_error(self, format, *args):
+        super().log_message(format, *args)
+
+
+# HTTP server that hands each connection to a fixed pool of worker threads rather than starting a
+# thread per connection; the workers' per-thread SQLite connections are the connection pool.
+class ExpenseServer(HTTPServer):
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def __init__(self, address, repo, workers=SERVER_WORKERS, log_requests=False):
+        super().__init__(address, RequestHandler)
+        self.repo = repo
+        self.log_requests = log_requests
+        self.sessions = SessionStore()
+        self.writer = WriteBatcher(repo)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http-worker")
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    # Function to stop accepting connections, finish the ones in progress and the queued writes
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=True)
+        self.writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the expense tracker database over HTTP/JSON")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'expense_tracker.db'))
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="request threads (and database connections)")
+    parser.add_argument('--password-iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help="PBKDF2 work factor for new passwords (lower only for load testing)")
+    parser.add_argument('--log-requests', action='store_true', help="log every request to stderr")
+    args = parser.parse_args(argv)
+
+    repo = ExpenseRepository(args.db, password_iterations=args.password_iterations)
+    server = ExpenseServer((args.host, args.port), repo, workers=args.workers, log_requests=args.log_requests)
+    print("Serving {} on http://{}:{}".format(args.db, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        repo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
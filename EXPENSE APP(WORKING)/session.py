@@ -0,0 +1,53 @@
+# In-memory state for a logged-in user, loaded once at login and kept current by the main window,
+# so opening the main screen or the statistics overview doesn't re-query data it already has.
+from datetime import date
+
+from repository import get_period_bounds
+
+
+class Session:
+    def __init__(self, user_id, username, categories, totals, totals_date, budget_alerts=()):
+        self.user_id = user_id
+        self.username = username
+        self.categories = categories    # [(id, name)] the user can choose from, built-in ones first
+        self.totals = totals            # Centavos: {'today': ..., 'week': ..., 'month': ..., 'year': ...}
+        self.totals_date = totals_date  # The day the totals were computed for, or None once they are stale
+        self.budget_alerts = budget_alerts  # Budgets already over their limit this month, as from repo.budget_alerts
+
+    @property
+    def is_admin(self):
+        return self.username == 'admin'
+
+    @property
+    def category_names(self):
+        return dict(self.categories)
+
+    # Function to get the id of one of the user's categories by name; returns None if there is none
+    def category_id(self, name):
+        for category_id, category_name in self.categories:
+            if category_name == name:
+                return category_id
+        return None
+
+    # Function to tell whether the cached totals still describe the current day's periods
+    def totals_current(self, today=None):
+        return (today or date.today()) == self.totals_date
+
+    # Function to fold an added (sign=1) or deleted (sign=-1) expense into the cached totals. Totals
+    # marked stale (totals_date None) are left alone; they are re-read, expense included, before use.
+    def apply_expense(self, amount_cents, expense_date, sign=1):
+        if self.totals_date is None:
+            return
+        day = date.fromisoformat(expense_date)
+        for period, (start, end) in get_period_bounds(self.totals_date).items():
+            if start <= day <= end:
+                self.totals[period] += sign * amount_cents
+
+
+# Function to load a session for a user who has just logged in, first creating any recurring
+# expenses that fell due since their last session
+def open_session(repo, user_id, username):
+    today = date.today()
+    repo.materialize_recurring(user_id, today)
+    return Session(user_id, username, repo.list_categories(user_id), repo.fetch_statistics(user_id, today), today,
+                   repo.budget_alerts(user_id, today.isoformat()[:7]))
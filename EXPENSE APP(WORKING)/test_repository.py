@@ -0,0 +1,283 @@
+# Tests for the data-access layer: schema migrations, rollup consistency and keyset pagination.
+# Each test works on its own database file in a temporary directory.
+#
+# Usage: python -m unittest test_repository
+import contextlib
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import repository
+from importer import import_expenses
+from repository import ExpenseRepository, MIGRATIONS
+
+# Cheap work factor so registering and migrating users doesn't dominate the run time
+TEST_PASSWORD_ITERATIONS = 1000
+
+
+# Function to create a database the way the original single-file app did: plaintext passwords,
+# REAL peso amounts, category names and 'm/d/Y' dates
+def create_baseline_database(path, users, expenses):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users
+                        (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT, email TEXT UNIQUE, age INTEGER, sex TEXT, contact_number TEXT, username TEXT UNIQUE, password TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS expenses
+                        (id INTEGER PRIMARY KEY, user_id INTEGER, amount REAL, category TEXT, date TEXT)''')
+        conn.executemany("INSERT INTO users (id, first_name, last_name, email, age, sex, contact_number, username, password) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", users)
+        conn.executemany("INSERT INTO expenses (user_id, amount, category, date) VALUES (?, ?, ?, ?)", expenses)
+    conn.close()
+
+
+class RepositoryTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_path = os.path.join(directory.name, 'expense_tracker.db')
+
+    # Function to open the test database (creating or migrating it), closed again after the test
+    def open_repository(self):
+        repo = ExpenseRepository(self.db_path, password_iterations=TEST_PASSWORD_ITERATIONS)
+        self.addCleanup(repo.close)
+        return repo
+
+    # Function to register a user with valid details; returns the user's id
+    def register(self, repo, username):
+        return repo.register_user("Test", username.title(), "{}@example.com".format(username), 30, "Female", "09171234567",
+                                  username, "password")
+
+    # Function to write CSV text to a file next to the test database; returns its path
+    def write_csv(self, text):
+        path = os.path.join(os.path.dirname(self.db_path), 'import.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        return path
+
+
+class MigrationTest(RepositoryTestCase):
+    def test_baseline_database_migrates_to_latest_version(self):
+        create_baseline_database(self.db_path, [
+            (1, "Admin", "Admin", "admin@example.com", 0, "NA", "NA", "admin", "password"),
+            (2, "Ana", "Cruz", "ana@example.com", 30, "Female", "09171234567", "ana", "secret"),
+        ], [
+            (2, 120.5, "Food", "01/15/2024"),
+            (2, 30.0, "Food", "01/31/2024"),
+            (2, 0.1, "Transportation", "02/01/2024"),
+            (2, 1999.99, "Gym", "02/29/2024"),
+            (2, 5.0, "Food", "sometime"),      # Unreadable date: set aside, not summed
+            (7, 10.0, "Food", "03/01/2024"),   # User no longer exists
+            (None, 10.0, "Food", "03/01/2024"),
+        ])
+        repo = self.open_repository()
+        c = repo.conn.cursor()
+
+        self.assertEqual(c.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+        self.assertEqual(c.execute("SELECT user_id, amount_cents, date FROM expenses ORDER BY id").fetchall(), [
+            (2, 12050, "2024-01-15"), (2, 3000, "2024-01-31"), (2, 10, "2024-02-01"), (2, 199999, "2024-02-29")])
+        self.assertEqual(c.execute("SELECT date FROM expenses_invalid_dates").fetchall(), [("sometime",)])
+        self.assertEqual(repo.check_rollups(), ["expenses_invalid_dates: 1 expenses with unreadable dates need fixing by hand"])
+        self.assertEqual(c.execute("SELECT total_cents, expense_count FROM user_expense_totals WHERE user_id=2").fetchone(), (215059, 4))
+        self.assertIn((2, "Gym"), c.execute("SELECT user_id, name FROM categories").fetchall())
+        self.assertEqual(c.execute("PRAGMA foreign_key_check").fetchall(), [])
+        self.assertEqual(repo.authenticate("ana", "secret"), 2)
+        self.assertEqual(repo.authenticate("admin", "password"), 1)
+
+    def test_migrated_database_opens_without_changes(self):
+        self.open_repository().close()
+        with contextlib.closing(sqlite3.connect(self.db_path)) as conn:
+            schema = conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+        repo = self.open_repository()
+        self.assertEqual(repo.conn.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall(), schema)
+        self.assertEqual(repo.check_rollups(), [])
+
+
+class RollupTest(RepositoryTestCase):
+    def setUp(self):
+        super().setUp()
+        self.repo = self.open_repository()
+        self.user_id = self.register(self.repo, "ana")
+        self.other_user_id = self.register(self.repo, "ben")
+        self.food = self.repo.get_or_create_category_id(None, "Food")
+        self.health = self.repo.get_or_create_category_id(None, "Health")
+
+    def test_add_and_delete(self):
+        first = self.repo.add_expense(self.user_id, 12050, self.food, "2024-01-15")
+        self.repo.add_expense(self.user_id, 99, self.food, "2024-01-15", merchant="Jollibee")
+        self.repo.add_expense(self.user_id, 500, self.health, "2024-02-01")
+        self.repo.add_expense(self.other_user_id, 700, self.food, "2024-01-15")
+        self.assertEqual(self.repo.check_rollups(), [])
+
+        self.assertIsNotNone(self.repo.delete_expense(first, self.user_id))
+        self.assertIsNone(self.repo.delete_expense(first, self.user_id))  # Already gone: no second delta
+        self.assertEqual(self.repo.check_rollups(), [])
+        self.assertEqual(self.repo.fetch_daily_totals(self.user_id, date(2024, 1, 1), date(2024, 1, 31)), [("2024-01-15", 99, 1)])
+
+    def test_deleting_last_expense_of_a_key_removes_its_rows(self):
+        expense_id = self.repo.add_expense(self.user_id, 500, self.health, "2024-02-01")
+        self.repo.delete_expense(expense_id)
+        self.assertEqual(self.repo.check_rollups(), [])
+        c = self.repo.conn.cursor()
+        for table in repository.ROLLUP_TABLES:
+            self.assertEqual(c.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0], 0, table)
+
+    def test_import(self):
+        self.repo.add_expense(self.user_id, 100, self.food, "2024-01-01")
+        path = self.write_csv("amount,category,date,merchant\n"
+                              "12.50,Food,2024-01-02,Jollibee\n"
+                              "abc,Food,2024-01-02,\n"        # Rejected
+                              "3,Books,01/05/2024,\n"         # New category for the user
+                              "4.25,health,2024-02-29,\n")
+        result = import_expenses(self.repo, self.user_id, path, batch_size=2)
+        self.assertEqual((result.rows_imported, result.rows_rejected), (3, 1))
+        self.assertEqual(self.repo.check_rollups(), [])
+        self.assertEqual(self.repo.search_expenses(self.user_id, "jolli")[0][0][2], 1250)
+
+    def test_large_import_restores_indexes(self):
+        c = self.repo.conn.cursor()
+        indexes = c.execute("SELECT name, sql FROM sqlite_master WHERE tbl_name='expenses' AND type='index'").fetchall()
+        path = self.write_csv("amount,category,date\n" + "".join(
+            "{}.{:02},Food,2024-{:02}-{:02}\n".format(n, n % 100, n % 12 + 1, n % 28 + 1) for n in range(1, 501)))
+        result = import_expenses(self.repo, self.user_id, path, batch_size=100)
+        self.assertEqual(result.rows_imported, 500)
+        self.assertEqual(self.repo.check_rollups(), [])
+        self.assertEqual(c.execute("SELECT name, sql FROM sqlite_master WHERE tbl_name='expenses' AND type='index'").fetchall(), indexes)
+        self.assertEqual(c.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+
+    def test_failed_import_changes_nothing(self):
+        path = self.write_csv("amount,category,date\n1,Food,2024-01-01\n")
+        with self.assertRaises(ValueError):
+            import_expenses(self.repo, 999, path)
+        self.assertEqual(self.repo.conn.execute("SELECT COUNT(*) FROM expenses").fetchone()[0], 0)
+        self.assertEqual(self.repo.check_rollups(), [])
+
+    def test_recurring_expenses(self):
+        self.repo.add_recurring_expense(self.user_id, 15000, self.health, 'monthly', date(2024, 1, 31))
+        self.assertEqual(self.repo.materialize_recurring(today=date(2024, 4, 30)), 4)
+        self.assertEqual(self.repo.materialize_recurring(today=date(2024, 4, 30)), 0)
+        self.assertEqual(self.repo.check_rollups(), [])
+
+    def test_delete_user_in_chunks(self):
+        with self.repo.conn:
+            self.repo.insert_expenses([(self.user_id, 100 + n, self.food if n % 2 else self.health, "2024-01-{:02}".format(n % 28 + 1),
+                                        None, "note {}".format(n)) for n in range(25)])
+        self.repo.add_expense(self.other_user_id, 700, self.food, "2024-01-15", note="note")
+        with mock.patch.object(repository, 'PURGE_CHUNK_SIZE', 10):
+            self.assertTrue(self.repo.delete_user(self.user_id))
+        self.assertFalse(self.repo.delete_user(self.user_id))
+        self.assertEqual(self.repo.check_rollups(), [])
+        c = self.repo.conn.cursor()
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM expenses WHERE user_id=?", (self.user_id,)).fetchone()[0], 0)
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM expense_search WHERE expense_search MATCH 'note'").fetchone()[0], 1)
+
+    def test_purge_orphans(self):
+        self.repo.add_expense(self.user_id, 100, self.food, "2024-01-01")
+        c = self.repo.conn.cursor()
+        # Rows left behind with foreign key checks off, as by the app before user deletes cascaded
+        c.execute("PRAGMA foreign_keys = OFF")
+        with self.repo.conn:
+            c.execute("INSERT INTO expenses (user_id, amount_cents, category_id, date) VALUES (999, 100, ?, '2024-01-01')", (self.food,))
+            c.execute("INSERT INTO expense_daily_totals (user_id, day, total_cents, expense_count) VALUES (999, '2024-01-01', 100, 1)")
+        c.execute("PRAGMA foreign_keys = ON")
+        removed, _ = self.repo.purge_orphans_and_vacuum()
+        self.assertEqual(removed, 1)
+        self.assertEqual(c.execute("SELECT COUNT(*) FROM expenses").fetchone()[0], 1)
+        self.assertEqual(self.repo.check_rollups(), [])
+
+
+class PaginationTest(RepositoryTestCase):
+    PAGE_SIZE = 4
+
+    def setUp(self):
+        super().setUp()
+        self.repo = self.open_repository()
+        food = self.repo.get_or_create_category_id(None, "Food")
+        first_names = ["ana", "Ana", "ben", "Carla", "carla", "Dan"]
+        self.user_ids = []
+        for n in range(23):
+            user_id = self.repo.register_user(first_names[n % len(first_names)], "Last{}".format(n % 5), "u{}@example.com".format(n),
+                                              30, "Female", "09171234567", "user{:02}".format(22 - n), "password")
+            self.user_ids.append(user_id)
+            # A third of the users have no expenses, and several share a count or a total
+            with self.repo.conn:
+                self.repo.insert_expenses([(user_id, 100 * (n % 4), food, "2024-01-{:02}".format(day + 1), None, None)
+                                           for day in range(n % 3 * (n % 4))])
+            self.repo.query_cache.invalidate(user_id)
+
+    # Function to page through list_users_page with next_key; returns the user ids in the order they came
+    def keyset_user_ids(self, search, sort, descending):
+        user_ids, after = [], None
+        while True:
+            rows, after = self.repo.list_users_page(search, sort, descending, after, self.PAGE_SIZE)
+            self.assertLessEqual(len(rows), self.PAGE_SIZE)
+            user_ids.extend(row[0] for row in rows)
+            if after is None:
+                return user_ids
+
+    # Function to page through the same list with LIMIT/OFFSET, sorting users without expenses as 0
+    def offset_user_ids(self, search, sort, descending):
+        sort_expression = repository.USER_SORT_COLUMNS[sort]
+        if sort in repository.USER_TOTAL_SORTS:
+            sort_expression = "COALESCE({}, 0)".format(sort_expression)
+        direction = "DESC" if descending else "ASC"
+        where, params = "", []
+        if search:
+            where = "WHERE u.username LIKE ? OR u.email LIKE ? OR u.first_name LIKE ? OR u.last_name LIKE ?"
+            params = [search + "%"] * 4
+        user_ids, offset = [], 0
+        while True:
+            page = self.repo.conn.execute(
+                "SELECT u.id FROM users u LEFT JOIN user_expense_totals t ON t.user_id = u.id {} "
+                "ORDER BY {sort} {direction}, u.id {direction} LIMIT ? OFFSET ?".format(where, sort=sort_expression, direction=direction),
+                params + [self.PAGE_SIZE, offset]).fetchall()
+            user_ids.extend(row[0] for row in page)
+            offset += self.PAGE_SIZE
+            if len(page) < self.PAGE_SIZE:
+                return user_ids
+
+    def test_user_list_matches_offset_paging(self):
+        for sort in repository.USER_SORT_COLUMNS:
+            for descending in (False, True):
+                for search in (None, "ca", "last3"):
+                    with self.subTest(sort=sort, descending=descending, search=search):
+                        self.assertEqual(self.keyset_user_ids(search, sort, descending), self.offset_user_ids(search, sort, descending))
+
+    def test_user_list_reports_totals(self):
+        rows, _ = self.repo.list_users_page(None, 'total_spent', True, None, 1)
+        user_id, *_, expense_count, total_cents = rows[0]
+        self.assertEqual(self.repo.conn.execute("SELECT COUNT(*), SUM(amount_cents) FROM expenses WHERE user_id=?", (user_id,)).fetchone(),
+                         (expense_count, total_cents))
+
+    def test_expense_pages_match_offset_paging(self):
+        user_id = self.user_ids[0]
+        food = self.repo.get_or_create_category_id(None, "Food")
+        with self.repo.conn:
+            # Several expenses per day, so pages break between rows with the same date
+            self.repo.insert_expenses([(user_id, 100 + n, food, "2024-03-{:02}".format(n % 5 + 1), None, None) for n in range(15)])
+        expected = [row[0] for row in self.repo.conn.execute(
+            "SELECT id FROM expenses WHERE user_id=? ORDER BY date DESC, id DESC", (user_id,))]
+        older, before = [], None
+        while True:
+            page = self.repo.fetch_expense_page(user_id, before=before, limit=self.PAGE_SIZE)
+            older.extend(row[0] for row in page)
+            if len(page) < self.PAGE_SIZE:
+                break
+            before = (page[-1][4], page[-1][0])
+        self.assertEqual(older, expected)
+        # Walking back up with after= returns the same pages, each still newest first
+        last = self.repo.conn.execute("SELECT date, id FROM expenses WHERE id=?", (expected[-1],)).fetchone()
+        newer, after = [], last
+        while True:
+            page = self.repo.fetch_expense_page(user_id, after=after, limit=self.PAGE_SIZE)
+            newer = [row[0] for row in page] + newer
+            if len(page) < self.PAGE_SIZE:
+                break
+            after = (page[0][4], page[0][0])
+        self.assertEqual(newer, expected[:-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+# Background task executor for the Tk screens. Database work runs on a small thread pool so the
+# Tk event loop never waits on a query; results are handed back to the UI thread by polling a
+# queue with after(), since Tk widgets may only be touched from the thread running mainloop.
+# Every screen's executor shares one pool for the life of the app, so logging in and out does not
+# start new threads, each opening its own database connection that nothing would close.
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Worker threads in the shared pool; SQLite in WAL mode serves one writer and many readers
+WORKER_THREADS = 4
+
+# Milliseconds between checks for finished tasks while any are outstanding (well under one frame)
+POLL_INTERVAL_MS = 10
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+# Function to get the pool shared by every TaskExecutor, starting it on first use
+def shared_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="db-worker")
+        return _shared_pool
+
+
+class TaskExecutor:
+    def __init__(self, window, on_busy_change=None, pool=None):
+        self.window = window
+        self.on_busy_change = on_busy_change
+        self._pool = pool or shared_pool()
+        self._results = queue.Queue()
+        self._lock = threading.RLock()  # Re-entrant: a future finished or cancelled under it runs _discard at once
+        self._generations = {}  # Latest submission number per task key
+        self._pending = {}      # Future of the latest submission per task key
+        self._queued = set()    # Futures of every task not yet finished, cancelled by shutdown()
+        self._outstanding = 0
+        self._polling = False
+        self._closed = False
+
+    # Function to run fn(*args, **kwargs) on a worker thread and call on_success(result) or
+    # on_error(exception) on the UI thread. Submitting again with the same key supersedes the
+    # earlier task: it is cancelled if it has not started, and its result is discarded if it has.
+    # Use key=None for tasks that must never be superseded (e.g. writes).
+    def submit(self, key, fn, *args, on_success=None, on_error=None, **kwargs):
+        if self._closed:
+            return
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            if key is not None:
+                self._generations[key] = generation
+                previous = self._pending.get(key)
+                if previous is not None and previous.cancel():
+                    self._outstanding -= 1
+            self._outstanding += 1
+            future = self._pool.submit(self._run, key, generation, fn, args, kwargs, on_success, on_error)
+            self._queued.add(future)
+            future.add_done_callback(self._discard)
+            if key is not None:
+                self._pending[key] = future
+        self._set_busy(True)
+        self._schedule_poll()
+
+    def _discard(self, future):
+        with self._lock:
+            self._queued.discard(future)
+
+    def _run(self, key, generation, fn, args, kwargs, on_success, on_error):
+        try:
+            result, error = fn(*args, **kwargs), None
+        except Exception as exception:
+            result, error = None, exception
+        self._results.put((key, generation, result, error, on_success, on_error))
+
+    def _schedule_poll(self):
+        if not self._polling and not self._closed:
+            self._polling = True
+            self.window.after(POLL_INTERVAL_MS, self._poll)
+
+    # Function to deliver finished results on the UI thread, dropping superseded ones
+    def _poll(self):
+        self._polling = False
+        if self._closed:
+            return
+        try:
+            while True:
+                try:
+                    key, generation, result, error, on_success, on_error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self._outstanding -= 1
+                    stale = key is not None and self._generations.get(key) != generation
+                    if not stale and key is not None:
+                        self._pending.pop(key, None)
+                if stale:
+                    continue
+                if error is not None:
+                    if on_error is None:
+                        raise error  # Reported by Tk's callback exception handler
+                    on_error(error)
+                elif on_success is not None:
+                    on_success(result)
+        finally:
+            if self._outstanding > 0:
+                self._schedule_poll()
+            else:
+                self._set_busy(False)
+
+    def _set_busy(self, busy):
+        if self.on_busy_change is not None:
+            self.on_busy_change(busy)
+
+    # Function to stop delivering results and cancel this executor's queued tasks (call before
+    # destroying the window). The shared pool keeps running for the other screens.
+    def shutdown(self):
+        self._closed = True
+        with self._lock:
+            queued = list(self._queued)
+        for future in queued:
+            future.cancel()
+
+
+# Function to stop the shared pool's threads once the app is closing, after waiting for running tasks
+# (call before closing the repository, whose close_all() then closes the threads' connections)
+def shutdown_shared_pool():
+    global _shared_pool
+    with _shared_pool_lock:
+        pool, _shared_pool = _shared_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)